@@ -19,6 +19,11 @@ use Illuminate\Support\Carbon;
  * @property string|null $file_name ファイル名
  * @property string|null $callback_url コールバックURL
  * @property string|null $order_destination 発注先
+ * @property int $priority 優先度（2:至急, 1:通常, 0:低）
+ * @property string|null $preprocess_status 事前処理状態（pending / ready / failed）
+ * @property int|null $page_count ページ数
+ * @property array|null $file_urls 送信するファイルのURL（送信順。単一ファイルのジョブはnull）
+ * @property array|null $source_errors ファイルごとの取得・変換エラー
  * @property Carbon $created_at 作成日時
  * @property Carbon $updated_at 更新日時
  */
@@ -64,6 +69,8 @@ class FaxParameter extends Model
         'file_name',
         'callback_url',
         'order_destination',
+        'priority',
+        'file_urls',
     ];
 
     /**
@@ -73,6 +80,10 @@ class FaxParameter extends Model
      */
     protected $casts = [
         'status' => 'integer',
+        'priority' => 'integer',
+        'page_count' => 'integer',
+        'file_urls' => 'array',
+        'source_errors' => 'array',
         'created_at' => 'datetime',
         'updated_at' => 'datetime',
     ];
@@ -1,16 +1,37 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, send_file
 from flask_cors import CORS
-import requests
 import os
+import csv
+import io
 import json
 import uuid
-from datetime import datetime
-from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from werkzeug.exceptions import RequestEntityTooLarge
+from workspace import create_job_workspace, schedule_cleanup
+from fetcher import download_file
+from eta import ESTIMATOR
+from preprocess import submit_preprocess, PREPROCESS_ENABLED, PREPROCESS_PENDING
+from compact_response import (json_response, make_etag, not_modified, to_columns, FORMAT_ROWS,
+                              FORMAT_COLUMNS, RESPONSE_FORMATS)
+from upload_store import StreamingUploadRequest, store_upload, UPLOAD_MAX_BYTES
+from scheduler import parse_priority, lane_name, get_queue_depths
+from pacer import get_pacing_overview
+from circuit_breaker import get_breaker_overview, reset as reset_circuit_breaker
+from destination_stats import destination_overview, destination_detail, parse_days
+from search import search as search_history
+import tuning
+from retry_policy import staggered_attempt_times
+from documents import parse_sources, sources_for, is_multi_source, build_document, SourceError
+from thumbnail import get_thumbnail, cache_key as thumbnail_cache_key, ThumbnailUnavailable, THUMBNAIL_MAX_AGE
 from db import (load_parameters, add_fax_request, update_request_status,
                 update_request_converted_pdf, get_request_by_id, clear_completed_requests,
-                retry_error_requests, retry_request_by_id, clear_all_requests)
+                retry_error_requests, retry_request_by_id, clear_all_requests, REQUEST_CACHE,
+                init_connection, iter_requests, build_request_filters, REQUEST_FILTER_LIKE_COLUMNS,
+                REQUEST_COLUMNS, get_requests_summary)
 
 app = Flask(__name__)
+# アップロードファイルはチャンクごとにハッシュを計算しながらディスクへ書き込む（上限を超えた時点で中断）
+app.request_class = StreamingUploadRequest
 CORS(app) # すべてのオリジンを許可
 # CORS(app, resources={r"/send_fax": {"origins": "http://monokanri-manage.local"}})
 # CORS(app, resources={r"/send_fax": {"origins": "http://127.0.0.1:8000"}})
@@ -21,11 +42,17 @@ UPLOAD_FOLDER = "uploads"
 CONVERTED_PDF_FOLDER = "converted_pdfs"
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'tiff', 'tif'}
 
-# フォルダを作成
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-if not os.path.exists(CONVERTED_PDF_FOLDER):
-    os.makedirs(CONVERTED_PDF_FOLDER)
+# フォルダを作成（複数ワーカーが同時に起動しても失敗しないよう exist_ok を指定）
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(CONVERTED_PDF_FOLDER, exist_ok=True)
+
+def init_worker():
+    """プロセス（WSGIワーカー）ごとの初期化。DB接続を確立して接続設定を確認する
+
+    wsgi.py / gunicorn.conf.py から各ワーカーの起動時に呼ばれる
+    """
+    init_connection()
+    print(f"[init_worker] ワーカー初期化完了 (pid: {os.getpid()})")
 
 # FAX送信処理は別ファイル（fax_worker.py）で実行
 
@@ -39,34 +66,38 @@ def try_regenerate_converted_pdf(request_id, request_data):
         file_url = request_data.get("file_url")
         if not file_url:
             return jsonify({'success': False, 'error': '元ファイルのURLがありません'}), 404
+
+        if is_multi_source(request_data):
+            return regenerate_merged_pdf(request_id, request_data)
         
         # 元ファイルがPDFの場合は変換不要
         if file_url.lower().endswith(".pdf"):
             return jsonify({'success': False, 'error': '元ファイルがPDFのため変換は不要です'}), 400
         
-        # 元ファイルをダウンロード
+        # 元ファイルをダウンロード（リクエスト専用の作業ディレクトリを使用）
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        temp_file_path = f"temp_regen_{timestamp}"
+        workspace = create_job_workspace(request_id)
         
         # ファイル拡張子を決定
         temp_ext = ".tmp"
         if file_url.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.tif')):
             temp_ext = os.path.splitext(file_url)[1]
         
-        temp_path = temp_file_path + temp_ext
-        
-        if not download_file(file_url, temp_path):
-            return jsonify({'success': False, 'error': '元ファイルの取得に失敗しました'}), 404
-        
-        # 永続フォルダに変換されたPDFを保存
-        persistent_pdf_name = f"converted_{request_id}_{timestamp}.pdf"
-        persistent_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, persistent_pdf_name)
-        
-        # PDFに変換
-        create_pdf_from_image(temp_path, persistent_pdf_path)
+        temp_path = os.path.join(workspace, "source" + temp_ext)
         
-        # 一時ファイルを削除
-        os.remove(temp_path)
+        try:
+            if not download_file(file_url, temp_path):
+                return jsonify({'success': False, 'error': '元ファイルの取得に失敗しました'}), 404
+
+            # 永続フォルダに変換されたPDFを保存
+            persistent_pdf_name = f"converted_{request_id}_{timestamp}.pdf"
+            persistent_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, persistent_pdf_name)
+
+            # PDFに変換
+            create_pdf_from_image(temp_path, persistent_pdf_path)
+        finally:
+            # 作業ディレクトリの削除を予約（変換に失敗した場合も残さない）
+            schedule_cleanup(workspace)
         
         # データベースを更新
         update_request_converted_pdf(request_id, os.path.abspath(persistent_pdf_path))
@@ -82,6 +113,21 @@ def try_regenerate_converted_pdf(request_id, request_data):
         print(f"PDF再生成エラー: {e}")
         return jsonify({'success': False, 'error': f'PDF再生成に失敗しました: {str(e)}'}), 500
 
+def regenerate_merged_pdf(request_id, request_data):
+    """複数ファイルのジョブの結合PDFを再作成"""
+    workspace = create_job_workspace(request_id)
+    try:
+        merged_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, f"merged_{request_id}.pdf")
+        build_document(request_data["file_urls"], workspace, merged_pdf_path, create_pdf_from_image)
+    except SourceError as e:
+        return jsonify({'success': False, 'error': f'元ファイルの取得・変換に失敗しました: {e}', 'source_errors': e.errors}), 404
+    finally:
+        schedule_cleanup(workspace)
+
+    update_request_converted_pdf(request_id, os.path.abspath(merged_pdf_path))
+    with open(merged_pdf_path, 'rb') as f:
+        return Response(f.read(), mimetype='application/pdf')
+
 # -------------------------------
 # ファイル処理
 # -------------------------------
@@ -92,45 +138,14 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_uploaded_file(file):
-    """アップロードされたファイルを保存"""
+    """アップロードされたファイルを保存（内容のハッシュ値をファイル名とし、同じ内容は再利用）"""
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # タイムスタンプを追加してファイル名の重複を避ける
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{timestamp}{ext}"
-        
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
+        ext = "." + file.filename.rsplit('.', 1)[1].lower()
+        file_path = store_upload(file, ext)
         print(f"ファイルをアップロードしました: {file_path}")
         return file_path
     return None
 
-def download_file(file_url, local_path):
-    """ファイルをダウンロードまたはローカルコピー"""
-    try:
-        if file_url.startswith('file://'):
-            local_file_path = file_url[7:]
-            if local_file_path.startswith('/'):
-                local_file_path = local_file_path[1:]
-            if not os.path.exists(local_file_path):
-                print(f"ローカルファイルが見つかりません: {local_file_path}")
-                return False
-            import shutil
-            shutil.copy2(local_file_path, local_path)
-            print(f"ローカルファイルをコピーしました: {local_file_path} -> {local_path}")
-            return True
-        else:
-            response = requests.get(file_url)
-            response.raise_for_status()
-            with open(local_path, "wb") as f:
-                f.write(response.content)
-            print(f"リモートファイルをダウンロードしました: {file_url}")
-            return True
-    except Exception as e:
-        print(f"ファイル処理エラー: {e}")
-        return False
-
 # -------------------------------
 # PDF作成処理
 # -------------------------------
@@ -182,6 +197,84 @@ def create_pdf_from_image(image_path, output_pdf_path):
 
 # FAX送信処理はfax_worker.pyに移動
 
+# -------------------------------
+# 一覧・エクスポートの絞り込み
+# -------------------------------
+
+def _parse_date_arg(name, value, end_of_day=False):
+    """日付（YYYY-MM-DD）または日時（ISO形式）の引数を変換。日付のみで end_of_day なら翌日0時"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name}が不正です: {value}（YYYY-MM-DD または ISO形式の日時）")
+    if end_of_day and len(value) <= 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _parse_status_arg(value):
+    """ステータスの引数を変換（未指定なら None）"""
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"statusが不正です: {value}")
+
+def request_filters_from_args(args):
+    """クエリパラメータ（管理画面の検索項目＋作成日の範囲）から WHERE 句とパラメータを作成"""
+    status = _parse_status_arg(args.get('status'))
+    created_from = args.get('created_from')
+    created_to = args.get('created_to')
+    return build_request_filters(
+        status=status,
+        created_from=_parse_date_arg('created_from', created_from) if created_from else None,
+        created_to=_parse_date_arg('created_to', created_to, end_of_day=True) if created_to else None,
+        **{column: args.get(column) for column in REQUEST_FILTER_LIKE_COLUMNS})
+
+# エクスポートする列（全カラム）
+EXPORT_COLUMNS = [column.strip() for column in REQUEST_COLUMNS.split(",")]
+# 一覧（列形式）の列（エクスポートと同じ全カラム）
+LIST_COLUMNS = EXPORT_COLUMNS
+EXPORT_CHUNK_ROWS = 500
+
+def _csv_value(value):
+    """CSVのセルの値（NULLは空、複数ファイルのURLなどのリスト・辞書はJSON）"""
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def generate_csv(rows):
+    """CSVを一定行数ごとに出力（Excelで文字化けしないよう先頭にBOMを付ける）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(row.get(column)) for column in EXPORT_COLUMNS])
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def generate_ndjson(rows):
+    """1行1レコードのJSONを一定行数ごとに出力"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', generate_csv),
+    'ndjson': ('application/x-ndjson; charset=utf-8', generate_ndjson),
+}
+
 # -------------------------------
 # Flask API
 # -------------------------------
@@ -197,24 +290,46 @@ def send_fax_api():
         print("-" * 30)
 
         file_url = data.get('file_url')
+        file_urls = data.get('file_urls')  # file_url の代わりに複数ファイルを送信順に指定（1件のFAXに結合）
         fax_number = data.get('fax_number')
         request_user = data.get('request_user')  # オプション
         file_name = data.get('file_name')  # オプション
         callback_url = data.get('callback_url')  # オプション
         order_destination = data.get('order_destination')  # オプション
+        priority = data.get('priority')  # オプション（urgent / normal / low）
 
         print(f"[API] file_url: {file_url}")
+        print(f"[API] file_urls: {file_urls}")
         print(f"[API] fax_number: {fax_number}")
         print(f"[API] request_user: {request_user}")
         print(f"[API] file_name: {file_name}")
         print(f"[API] callback_url: {callback_url}")
         print(f"[API] order_destination: {order_destination}")
 
-        if not file_url or not fax_number:
-            print("[API] エラー: file_urlとfax_numberは必須です")
-            return jsonify({'success': False, 'error': 'file_urlとfax_numberは必須です'}), 400
-
-        new_request = add_fax_request(file_url, fax_number, request_user, file_name, callback_url, order_destination)
+        if not (file_url or file_urls) or not fax_number:
+            print("[API] エラー: file_url（またはfile_urls）とfax_numberは必須です")
+            return jsonify({'success': False, 'error': 'file_url（またはfile_urls）とfax_numberは必須です'}), 400
+
+        try:
+            sources = parse_sources(file_url, file_urls)
+        except ValueError as e:
+            print(f"[API] エラー: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        try:
+            priority = parse_priority(priority)
+        except ValueError as e:
+            print(f"[API] エラー: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 400
+        print(f"[API] priority: {lane_name(priority)}")
+
+        new_request = add_fax_request(sources[0], fax_number, request_user, file_name, callback_url, order_destination,
+                                      priority, PREPROCESS_PENDING if PREPROCESS_ENABLED else None,
+                                      sources if len(sources) > 1 else None)
+        if PREPROCESS_ENABLED:
+            # 取得・検証・PDF変換を受付直後にバックグラウンドで行い、ワーカーは送信だけを行う
+            submit_preprocess(new_request['id'], download_file, create_pdf_from_image)
+        ESTIMATOR.on_job_added(new_request)
         return jsonify({
             'success': True,
             'message': 'FAX送信リクエストを登録しました',
@@ -224,7 +339,9 @@ def send_fax_api():
             'file_name': new_request.get('file_name'),
             'callback_url': new_request.get('callback_url'),
             'order_destination': new_request.get('order_destination'),
+            'priority': lane_name(new_request.get('priority')),
             'fax_number': new_request['fax_number'],
+            'file_urls': new_request.get('file_urls'),
             'created_at': new_request['created_at']
         })
     except Exception as e:
@@ -251,6 +368,7 @@ def upload_and_send_fax():
         file_name = request.form.get('file_name')  # オプション
         callback_url = request.form.get('callback_url')  # オプション
         order_destination = request.form.get('order_destination')  # オプション
+        priority = request.form.get('priority')  # オプション（urgent / normal / low）
 
         print(f"[API] ファイル名: {file.filename if file else 'None'}")
         print(f"[API] fax_number: {fax_number}")
@@ -263,6 +381,13 @@ def upload_and_send_fax():
             print("[API] エラー: fax_numberは必須です")
             return jsonify({'success': False, 'error': 'fax_numberは必須です'}), 400
 
+        try:
+            priority = parse_priority(priority)
+        except ValueError as e:
+            print(f"[API] エラー: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 400
+        print(f"[API] priority: {lane_name(priority)}")
+
         if file.filename == '':
             print("[API] エラー: ファイルが選択されていません")
             return jsonify({'success': False, 'error': 'ファイルが選択されていません'}), 400
@@ -278,7 +403,12 @@ def upload_and_send_fax():
         
         # ローカルファイルURLとして登録
         file_url = f"file:///{file_path.replace(os.sep, '/')}"
-        new_request = add_fax_request(file_url, fax_number, request_user, file_name, callback_url, order_destination)
+        new_request = add_fax_request(file_url, fax_number, request_user, file_name, callback_url, order_destination,
+                                      priority, PREPROCESS_PENDING if PREPROCESS_ENABLED else None)
+        if PREPROCESS_ENABLED:
+            # 取得・検証・PDF変換を受付直後にバックグラウンドで行い、ワーカーは送信だけを行う
+            submit_preprocess(new_request['id'], download_file, create_pdf_from_image)
+        ESTIMATOR.on_job_added(new_request)
         
         return jsonify({
             'success': True,
@@ -289,10 +419,14 @@ def upload_and_send_fax():
             'file_name': new_request.get('file_name'),
             'callback_url': new_request.get('callback_url'),
             'order_destination': new_request.get('order_destination'),
+            'priority': lane_name(new_request.get('priority')),
             'fax_number': new_request['fax_number'],
             'uploaded_file': file_path,
             'created_at': new_request['created_at']
         })
+    except RequestEntityTooLarge:
+        print(f"[API] エラー: ファイルサイズが上限（{UPLOAD_MAX_BYTES} バイト）を超えています")
+        return jsonify({'success': False, 'error': f'ファイルサイズが上限（{UPLOAD_MAX_BYTES} バイト）を超えています'}), 413
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -306,6 +440,8 @@ def get_request_status(request_id):
     request_data = get_request_by_id(request_id)
     if request_data:
         print(f"[API] ステータス取得成功: {request_data.get('status', '不明')}")
+        # 待機中・処理中のジョブには送信予定時刻を付ける（完了・エラーは None）
+        request_data['eta'] = ESTIMATOR.estimate(request_id) if request_data.get('status') in (0, 2) else None
         return jsonify({'success': True, 'request': request_data})
     print("[API] エラー: 該当リクエストなし")
     return jsonify({'success': False, 'error': '該当リクエストなし'}), 404
@@ -316,10 +452,194 @@ def get_all_requests():
     print("=" * 50)
     print("[API] /requests - 全リクエスト一覧取得")
 
-    params_list = load_parameters()
+    try:
+        where, params = request_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    response_format = request.args.get('format', FORMAT_ROWS)
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({'success': False, 'error': f"formatが不正です: {response_format}（rows / columns）"}), 400
+
+    # 件数・最終更新日時・ステータス・リース期限から弱いETagを作り、一覧が変わっていなければ本体を作らずに 304 を返す
+    # 送信予定時刻は時間とともに変わるため一覧には含めず、/estimates で別に返す
+    summary = get_requests_summary(where, params)
+    etag = None
+    if summary is not None:
+        etag = make_etag(response_format, where, params, summary['count'], summary['max_updated_at'],
+                         summary['status_sum'], summary['max_lease_expires_at'])
+        if not_modified(etag):
+            print("[API] 一覧に変更なし（304）")
+            return json_response(None, etag=etag)
+
+    params_list = load_parameters(where, params)
     print(f"[API] 取得件数: {len(params_list)}")
 
-    return jsonify({'success': True, 'requests': params_list, 'total': len(params_list)})
+    if response_format == FORMAT_COLUMNS:
+        columns, rows = to_columns(params_list, LIST_COLUMNS)
+        payload = {'success': True, 'columns': columns, 'rows': rows, 'total': len(rows)}
+    else:
+        payload = {'success': True, 'requests': params_list, 'total': len(params_list)}
+    return json_response(payload, etag=etag)
+
+@app.route('/estimates', methods=['GET'])
+def get_estimates():
+    """待機中・処理中のジョブの送信予定（時刻とともに変わるため、ETagを付けずに毎回返す）"""
+    print("=" * 50)
+    print("[API] /estimates - 送信予定取得")
+
+    estimates = ESTIMATOR.estimates()
+    print(f"[API] 対象件数: {len(estimates)}")
+    return json_response({'success': True, 'estimates': estimates, 'total': len(estimates)})
+
+@app.route('/export', methods=['GET'])
+def export_requests():
+    """送信履歴のエクスポート（CSV / NDJSON をストリーミングで返す）"""
+    print("=" * 50)
+    print("[API] /export - 送信履歴エクスポート")
+
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f"formatが不正です: {export_format}（csv / ndjson）"}), 400
+    try:
+        where, params = request_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    mimetype, generate = EXPORT_FORMATS[export_format]
+    filename = f"fax_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    print(f"[API] 形式: {export_format}, 条件: {where or 'なし'}")
+
+    # Content-Length を付けずに返すため、チャンク転送で少しずつ送信される
+    response = Response(stream_with_context(generate(iter_requests(where, params))), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/search', methods=['GET'])
+def search():
+    """送信履歴の検索（ファイル名・発注先・依頼者の全文検索＋FAX番号の前方一致、関連度順・ページ単位）"""
+    print("=" * 50)
+    print("[API] /search - 送信履歴検索")
+
+    args = request.args
+    try:
+        created_from = args.get('created_from')
+        created_to = args.get('created_to')
+        result = search_history(
+            query=args.get('q'),
+            fax_number=args.get('fax_number'),
+            status=_parse_status_arg(args.get('status')),
+            created_from=_parse_date_arg('created_from', created_from) if created_from else None,
+            created_to=_parse_date_arg('created_to', created_to, end_of_day=True) if created_to else None,
+            page=args.get('page'),
+            per_page=args.get('per_page'))
+    except ValueError as e:
+        print(f"[API] エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+    print(f"[API] 検索語: {result['terms']}, FAX番号: {result['fax_number']}, "
+          f"取得件数: {len(result['results'])}（{result['page']}ページ目）")
+    return json_response(dict(result, success=True))
+
+@app.route('/queue_stats', methods=['GET'])
+def queue_stats():
+    """優先度レーンごとの待機件数"""
+    print("=" * 50)
+    print("[API] /queue_stats - レーン別待機件数取得")
+
+    try:
+        lanes = get_queue_depths()
+        total_pending = sum(lane['pending'] for lane in lanes)
+        print(f"[API] 待機件数合計: {total_pending}")
+        return jsonify({'success': True, 'lanes': lanes, 'total_pending': total_pending,
+                        'request_cache': REQUEST_CACHE.stats(), 'eta_model': ESTIMATOR.model().to_dict()})
+    except Exception as e:
+        print(f"[API] エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/pacing', methods=['GET'])
+def pacing():
+    """送信先ごとのペーシング状態（話中バックオフ・次回送信可能時刻）"""
+    print("=" * 50)
+    print("[API] /pacing - 送信先別ペーシング状態取得")
+
+    try:
+        destinations = get_pacing_overview()
+        print(f"[API] 送信先数: {len(destinations)}")
+        return json_response({'success': True, 'destinations': destinations, 'total': len(destinations)})
+    except Exception as e:
+        print(f"[API] エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/breakers', methods=['GET'])
+def breakers():
+    """送信先ごとのサーキットブレーカー状態（遮断中・試験送信中・失敗が続いている送信先）"""
+    print("=" * 50)
+    print("[API] /breakers - サーキットブレーカー状態取得")
+
+    try:
+        destinations = get_breaker_overview()
+        print(f"[API] 送信先数: {len(destinations)}")
+        return json_response({'success': True, 'destinations': destinations, 'total': len(destinations),
+                              'open': sum(1 for d in destinations if d['state'] != 'closed')})
+    except Exception as e:
+        print(f"[API] エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/breakers/<fax_number>/reset', methods=['POST'])
+def reset_breaker(fax_number):
+    """送信先の遮断を手動で解除（番号を修正した場合など）"""
+    print("=" * 50)
+    print(f"[API] /breakers/{fax_number}/reset - 遮断解除")
+
+    try:
+        if reset_circuit_breaker(fax_number):
+            ESTIMATOR.invalidate()
+            return jsonify({'success': True, 'message': '遮断を解除しました'})
+        return jsonify({'success': False, 'error': '指定された送信先は遮断されていません'}), 404
+    except Exception as e:
+        print(f"[API] エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/destination_stats', methods=['GET'])
+def destination_stats():
+    """送信先別の送信実績（直近 days 日間。日次集計から作成）"""
+    print("=" * 50)
+    print("[API] /destination_stats - 送信先別実績取得")
+
+    try:
+        days = parse_days(request.args.get('days'))
+        limit = int(request.args.get('limit', 100))
+        sort = request.args.get('sort', 'failed')
+        destinations = destination_overview(days, sort, limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    print(f"[API] 送信先数: {len(destinations)}")
+    return json_response({'success': True, 'days': days, 'sort': sort, 'destinations': destinations,
+                          'total': len(destinations)})
+
+@app.route('/destination_stats/<fax_number>', methods=['GET'])
+def destination_stats_detail(fax_number):
+    """1つの送信先の送信実績（発注先別・日別）"""
+    print("=" * 50)
+    print(f"[API] /destination_stats/{fax_number} - 送信先実績取得")
+
+    try:
+        days = parse_days(request.args.get('days'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    detail = destination_detail(fax_number, days)
+    if detail is None:
+        return jsonify({'success': False, 'error': '指定された送信先の実績がありません'}), 404
+    return json_response({'success': True, 'days': days, 'destination': detail})
+
+@app.route('/tuning', methods=['GET'])
+def tuning_settings():
+    """実行時の調整値（tuning.json を反映した現在の値・既定値・読み込みエラー）"""
+    print("=" * 50)
+    print("[API] /tuning - 調整値取得")
+
+    return json_response(dict(tuning.snapshot(), success=True))
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -365,7 +685,8 @@ def retry_errors():
     print("[API] /retry_errors - エラー送信再送")
 
     try:
-        retry_count = retry_error_requests()
+        # 一斉に待機中へ戻すと送信が集中するため、次回試行日時をずらして登録
+        retry_count = retry_error_requests(staggered_attempt_times)
         print(f"[API] 再送件数: {retry_count}")
 
         return jsonify({
@@ -429,6 +750,13 @@ def view_file(request_id):
             if not file_url:
                 return jsonify({'success': False, 'error': 'ファイルURLが見つかりません'}), 404
 
+            # 複数ファイルのジョブは index（1始まり）で表示するファイルを指定
+            sources = sources_for(request_data)
+            index = request.args.get('index', type=int, default=1)
+            if not 1 <= index <= len(sources):
+                return jsonify({'success': False, 'error': f'indexは1〜{len(sources)}で指定してください'}), 400
+            file_url = sources[index - 1]
+
             # ローカルファイルの場合
             if file_url.startswith('file://'):
                 local_file_path = file_url[7:]
@@ -496,6 +824,42 @@ def view_converted_pdf(request_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/thumbnail/<request_id>', methods=['GET'])
+def thumbnail(request_id):
+    """送信ファイルの1ページ目のプレビュー画像（PNG。初回に作成してキャッシュ）"""
+    print("=" * 50)
+    print(f"[API] /thumbnail/{request_id} - プレビュー画像")
+    print(f"[API] request_id: {request_id}")
+
+    request_data = get_request_by_id(request_id)
+    if not request_data:
+        return jsonify({'success': False, 'error': '該当する送信が見つかりません'}), 404
+
+    # 元ファイルが変わっていなければ、プレビューを開かずに 304 を返す
+    key = thumbnail_cache_key(request_data)
+    versioned = key is not None and request.args.get('v') == key
+    if key and request.if_none_match.contains(key):
+        print("[API] 元ファイルに変更がないため 304 を返します")
+        response = Response(status=304)
+    else:
+        try:
+            path, key = get_thumbnail(request_data)
+        except ThumbnailUnavailable as e:
+            print(f"[API] プレビュー画像を作成できません: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 404
+        response = send_file(os.path.abspath(path), mimetype='image/png', conditional=False)
+    response.set_etag(key)
+    response.cache_control.private = True
+    if versioned:
+        # キーを含むURLは内容が変わらないため、確認なしでブラウザのキャッシュから表示する
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    else:
+        # キーなしのURL（一覧）は、事前処理・PDFの再作成で元ファイルが変わるため毎回ETagで確認する
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+    return response
+
 @app.route('/<request_id>', methods=['GET'])
 def request_detail(request_id):
     """リクエスト詳細画面を表示"""
@@ -533,8 +897,15 @@ def request_detail(request_id):
                 else:
                     has_original_file = True  # URLの場合は存在すると仮定
 
+            # 複数ファイルのジョブのファイル一覧（ファイルごとのエラー付き）
+            source_errors = {item['index']: item['error'] for item in (request_data.get('source_errors') or [])}
+            sources = [{'index': i, 'file_url': url, 'error': source_errors.get(i)}
+                       for i, url in enumerate(sources_for(request_data), 1)] if is_multi_source(request_data) else []
+
             return render_template('detail.html',
                 request_data=request_data,
+                sources=sources,
+                thumbnail_key=thumbnail_cache_key(request_data),
                 status_text=status_text,
                 status_class=status_class,
                 created_at=created_at,
@@ -549,4 +920,6 @@ def request_detail(request_id):
 if __name__ == '__main__':
     print("FAX送信APIサーバー起動中...")
     print("FAX送信処理は別途 fax_worker.py を実行してください")
+    print("※開発用サーバーです。本番環境では wsgi.py（waitress / gunicorn）を使用してください")
+    init_worker()
     app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FAX送信API 負荷生成・レイテンシ計測ツール
+
+/send_fax, /upload_and_send_fax, /status/<id>, /requests に対して
+並列度・到着レートを指定して負荷をかけ、p50/p95/p99 レイテンシとスループットを出力する
+
+  closed-loop: 指定した並列数のクライアントが応答を待ってから次のリクエストを送る
+  open-loop:   指定した到着レート（ポアソン到着）でリクエストを発行する。
+               レイテンシは予定発行時刻から計測するため、サーバーの詰まりも待ち時間として現れる
+
+使用例:
+  python bench_api.py --endpoint status --mode closed --concurrency 8 --duration 30
+  python bench_api.py --endpoint send_fax --mode open --rate 20 --duration 60 --allow-writes --output results.json
+
+※ send_fax / upload_and_send_fax は実際にFAX送信ジョブを登録します。
+  テスト用DB・テスト用ワーカー環境に対してのみ --allow-writes を付けて実行してください
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ENDPOINTS = ["send_fax", "upload_and_send_fax", "status", "requests"]
+WRITE_ENDPOINTS = {"send_fax", "upload_and_send_fax"}
+
+def load_defaults(config_path="config.json"):
+    """config.json（simple_test.py と共通）から既定値を読み込み"""
+    defaults = {
+        "base_url": "http://localhost:5000",
+        "file_url": "https://www.w3.org/WAI/ER/tests/xhtml/testfiles/resources/pdf/dummy.pdf",
+        "fax_number": "0432119261",
+        "upload_file": "fax_test.pdf",
+    }
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if config.get("api_url"):
+            # api_url は /send_fax まで含むため、ベースURLに直す
+            defaults["base_url"] = config["api_url"].rsplit("/send_fax", 1)[0]
+        for key in ("file_url", "fax_number"):
+            if config.get(key):
+                defaults[key] = config[key]
+    return defaults
+
+# -------------------------------
+# リクエスト発行
+# -------------------------------
+
+class BenchClient:
+    """エンドポイントごとのリクエストを発行（スレッドごとにセッションを保持）"""
+
+    def __init__(self, args):
+        self.args = args
+        self._local = threading.local()
+        self._status_ids = list(args.status_ids or [])
+        self._ids_lock = threading.Lock()
+        self._upload_bytes = None
+        if args.endpoint == "upload_and_send_fax":
+            with open(args.upload_file, "rb") as f:
+                self._upload_bytes = f.read()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _url(self, path):
+        return self.args.base_url.rstrip("/") + path
+
+    def prepare(self):
+        """status計測用のIDが未指定なら /requests から取得"""
+        if self.args.endpoint != "status" or self._status_ids:
+            return
+        response = self._session().get(self._url("/requests"), timeout=self.args.timeout)
+        response.raise_for_status()
+        self._status_ids = [r["id"] for r in response.json().get("requests", [])][:1000]
+        if not self._status_ids:
+            raise RuntimeError("status計測用のリクエストIDがありません（--status-id で指定してください）")
+
+    def call(self):
+        """1リクエストを発行し、(HTTPステータス, 応答バイト数) を返す"""
+        endpoint = self.args.endpoint
+        session = self._session()
+        timeout = self.args.timeout
+        if endpoint == "send_fax":
+            payload = {
+                "file_url": self.args.file_url,
+                "fax_number": self.args.fax_number,
+                "request_user": "bench_api",
+                "file_name": "bench.pdf",
+                "priority": self.args.priority,
+            }
+            response = session.post(self._url("/send_fax"), json=payload, timeout=timeout)
+        elif endpoint == "upload_and_send_fax":
+            files = {"file": (os.path.basename(self.args.upload_file), self._upload_bytes)}
+            data = {"fax_number": self.args.fax_number, "request_user": "bench_api",
+                    "priority": self.args.priority}
+            response = session.post(self._url("/upload_and_send_fax"), files=files, data=data, timeout=timeout)
+        elif endpoint == "status":
+            with self._ids_lock:
+                request_id = random.choice(self._status_ids)
+            response = session.get(self._url(f"/status/{request_id}"), timeout=timeout)
+        else:
+            response = session.get(self._url("/requests"), timeout=timeout)
+        return response.status_code, len(response.content)
+
+# -------------------------------
+# 計測
+# -------------------------------
+
+class Recorder:
+    """レイテンシとエラーを記録（スレッドセーフ）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.status_codes = {}
+        self.errors = {}
+        self.bytes_received = 0
+
+    def record(self, latency, status_code=None, size=0, error=None):
+        with self.lock:
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                return
+            self.latencies.append(latency)
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            self.bytes_received += size
+
+def timed_call(client, recorder, scheduled_at=None):
+    """リクエストを発行して記録（open-loop では予定発行時刻からの経過を計測）"""
+    start = scheduled_at if scheduled_at is not None else time.perf_counter()
+    try:
+        status_code, size = client.call()
+        recorder.record(time.perf_counter() - start, status_code, size)
+    except Exception as e:
+        recorder.record(time.perf_counter() - start, error=type(e).__name__)
+
+def run_closed_loop(client, recorder, args):
+    """並列数分のクライアントが応答を待ってから次を送る"""
+    deadline = time.perf_counter() + args.duration
+    remaining = {"count": args.requests}
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            if args.requests:
+                with lock:
+                    if remaining["count"] <= 0:
+                        return
+                    remaining["count"] -= 1
+            timed_call(client, recorder)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def run_open_loop(client, recorder, args):
+    """ポアソン到着で指定レートのリクエストを発行（応答を待たない）"""
+    deadline = time.perf_counter() + args.duration
+    issued = 0
+    next_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while next_at < deadline and (not args.requests or issued < args.requests):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(timed_call, client, recorder, next_at)
+            issued += 1
+            next_at += random.expovariate(args.rate)
+
+def percentile(sorted_values, p):
+    """線形補間によるパーセンタイル"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+def summarize(recorder, elapsed):
+    """計測結果を集計"""
+    latencies = sorted(recorder.latencies)
+    total = len(latencies) + sum(recorder.errors.values())
+    ok = sum(c for code, c in recorder.status_codes.items() if code is not None and 200 <= code < 400)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": total,
+        "ok": ok,
+        "http_errors": len(latencies) - ok,
+        "transport_errors": recorder.errors,
+        "status_codes": {str(k): v for k, v in recorder.status_codes.items()},
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed > 0 else 0,
+        "bytes_received": recorder.bytes_received,
+        "latency_ms": {
+            "min": ms(latencies[0] if latencies else None),
+            "mean": ms(sum(latencies) / len(latencies) if latencies else None),
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+def build_info():
+    """ビルド比較用の情報（gitリビジョンなど）"""
+    info = {"python": platform.python_version(), "host": platform.node()}
+    try:
+        info["git_revision"] = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        info["git_revision"] = None
+    return info
+
+def parse_args(argv=None):
+    defaults = load_defaults()
+    parser = argparse.ArgumentParser(description="FAX送信API 負荷生成・レイテンシ計測")
+    parser.add_argument("--base-url", default=defaults["base_url"], help="APIサーバーのURL")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="status")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: 並列数固定 / open: 到着レート固定")
+    parser.add_argument("--concurrency", type=int, default=4, help="並列数（open-loop では最大同時実行数）")
+    parser.add_argument("--rate", type=float, default=10.0, help="open-loop の到着レート（件/秒）")
+    parser.add_argument("--duration", type=float, default=10.0, help="計測時間（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="総リクエスト数の上限（0 = 時間のみで制御）")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前のウォームアップ件数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--file-url", default=defaults["file_url"])
+    parser.add_argument("--fax-number", default=defaults["fax_number"])
+    parser.add_argument("--priority", default="low", help="send系で登録するジョブの優先度")
+    parser.add_argument("--upload-file", default=defaults["upload_file"])
+    parser.add_argument("--status-id", dest="status_ids", action="append", help="status計測に使うID（複数指定可）")
+    parser.add_argument("--allow-writes", action="store_true", help="send系エンドポイント（ジョブ登録）の計測を許可")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--label", default="", help="結果に付けるラベル（ビルド名など）")
+    args = parser.parse_args(argv)
+    if args.endpoint in WRITE_ENDPOINTS and not args.allow_writes:
+        parser.error(f"{args.endpoint} は実際にFAXジョブを登録します。テスト環境で --allow-writes を付けて実行してください")
+    if args.mode == "open" and args.rate <= 0:
+        parser.error("--rate は正の値を指定してください")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    client = BenchClient(args)
+    client.prepare()
+
+    print("FAX送信API 負荷計測")
+    print("=" * 50)
+    print(f"URL: {args.base_url}  エンドポイント: {args.endpoint}  モード: {args.mode}")
+    print(f"並列数: {args.concurrency}  到着レート: {args.rate if args.mode == 'open' else '-'}  計測時間: {args.duration}秒")
+    print("=" * 50)
+
+    # ウォームアップ（接続確立・キャッシュ温め。結果には含めない）
+    warmup = Recorder()
+    for _ in range(args.warmup):
+        timed_call(client, warmup)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.mode == "closed":
+        run_closed_loop(client, recorder, args)
+    else:
+        run_open_loop(client, recorder, args)
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(recorder, elapsed)
+    latency = summary["latency_ms"]
+    print(f"総リクエスト数: {summary['requests']}  成功: {summary['ok']}  "
+          f"HTTPエラー: {summary['http_errors']}  通信エラー: {sum(summary['transport_errors'].values())}")
+    print(f"スループット: {summary['throughput_rps']} req/s")
+    print(f"レイテンシ(ms): p50={latency['p50']}  p95={latency['p95']}  p99={latency['p99']}  max={latency['max']}")
+
+    result = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "build": build_info(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("status_ids",)},
+        "summary": summary,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+    return result
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
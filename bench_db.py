@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+db.py マイクロベンチマーク
+
+検証用DBに parameter.json の分布を元にした合成データを 10万件・100万件…と投入し、
+db.py の各操作の実行時間・EXPLAIN 結果・データ量に対するスケーリングを計測する
+
+使用例:
+  python bench_db.py --db-host localhost --db-user bench --db-password xxx --db-name fax_bench \
+      --sizes 10000,100000,1000000 --output db_bench.json
+
+※ 指定したDBの fax_parameters と送信先別のテーブルは削除・再作成されます。本番DBには絶対に向けないでください
+※ MySQL 用のSQL（EXPLAIN・ANALYZE TABLE・FULLTEXT など）を使うため、FAX_DB_BACKEND に関わらず MySQL に接続する
+
+計測しない db.py の関数:
+  save_parameters（未実装）、send_callback_notification（DBではなくHTTP通知）、
+  build_request_filters（SQLを組み立てるだけでDBに問い合わせない）、
+  init_connection / close_connection（connect の計測に含まれる）
+"""
+
+import os
+import io
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import itertools
+import statistics
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+PRODUCTION_HOSTS = {"akioka.cloud"}
+SEED_BATCH_SIZE = 5000
+HISTORY_DAYS = 365 * 3  # 合成データの作成日時を分布させる期間
+
+# fax_parameters_migration.txt と同じ構成（ベンチ用DBに作成）
+SCHEMA_STATEMENTS = [
+    "DROP TABLE IF EXISTS fax_parameters",
+    """
+    CREATE TABLE fax_parameters (
+        id VARCHAR(36) PRIMARY KEY,
+        file_url TEXT,
+        fax_number VARCHAR(20),
+        status INT DEFAULT 0,
+        created_at DATETIME,
+        updated_at DATETIME,
+        error_message TEXT,
+        converted_pdf_path TEXT,
+        request_user VARCHAR(100),
+        file_name VARCHAR(255),
+        callback_url TEXT,
+        order_destination VARCHAR(100),
+        priority INT NOT NULL DEFAULT 1,
+        attempt_count INT NOT NULL DEFAULT 0,
+        next_attempt_at DATETIME NULL,
+        last_error_class VARCHAR(32) NULL,
+        lease_owner VARCHAR(64) NULL,
+        lease_expires_at DATETIME NULL,
+        preprocess_status VARCHAR(16) NULL,
+        page_count INT NULL,
+        source_bytes BIGINT NULL,
+        prepared_pdf_path TEXT NULL,
+        preprocessed_at DATETIME NULL,
+        started_at DATETIME NULL,
+        send_seconds DOUBLE NULL,
+        file_urls TEXT NULL,
+        source_errors TEXT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    "CREATE INDEX idx_status ON fax_parameters(status)",
+    "CREATE INDEX idx_created_at ON fax_parameters(created_at)",
+    "CREATE INDEX idx_fax_number ON fax_parameters(fax_number)",
+    "CREATE INDEX idx_request_user ON fax_parameters(request_user)",
+    "CREATE INDEX idx_status_created ON fax_parameters(status, created_at)",
+    "CREATE INDEX idx_status_priority_created ON fax_parameters(status, priority, created_at)",
+    "CREATE INDEX idx_status_next_attempt ON fax_parameters(status, next_attempt_at)",
+    "CREATE INDEX idx_status_lease_expires ON fax_parameters(status, lease_expires_at)",
+    "ALTER TABLE fax_parameters ADD FULLTEXT INDEX ft_search_text (file_name, order_destination, request_user) WITH PARSER ngram",
+    "DROP TABLE IF EXISTS fax_destination_daily_stats",
+    """
+    CREATE TABLE fax_destination_daily_stats (
+        destination VARCHAR(32) NOT NULL,
+        order_destination VARCHAR(100) NOT NULL DEFAULT '',
+        stat_date DATE NOT NULL,
+        sent_count INT NOT NULL DEFAULT 0,
+        failed_count INT NOT NULL DEFAULT 0,
+        pages_sent INT NOT NULL DEFAULT 0,
+        timed_count INT NOT NULL DEFAULT 0,
+        send_seconds_total DOUBLE NOT NULL DEFAULT 0,
+        last_error_class VARCHAR(32) NULL,
+        last_failed_at DATETIME NULL,
+        updated_at DATETIME,
+        PRIMARY KEY (destination, order_destination, stat_date),
+        INDEX idx_stats_date (stat_date)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    "DROP TABLE IF EXISTS fax_destination_pacing",
+    """
+    CREATE TABLE fax_destination_pacing (
+        destination VARCHAR(32) PRIMARY KEY,
+        tokens DOUBLE NOT NULL DEFAULT 0,
+        last_refill_at DATETIME,
+        next_eligible_at DATETIME NULL,
+        busy_count INT NOT NULL DEFAULT 0,
+        last_result VARCHAR(20) NULL,
+        updated_at DATETIME
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    "DROP TABLE IF EXISTS fax_destination_breaker",
+    """
+    CREATE TABLE fax_destination_breaker (
+        destination VARCHAR(32) PRIMARY KEY,
+        state VARCHAR(16) NOT NULL DEFAULT 'closed',
+        consecutive_failures INT NOT NULL DEFAULT 0,
+        open_count INT NOT NULL DEFAULT 0,
+        opened_at DATETIME NULL,
+        retry_at DATETIME NULL,
+        probe_started_at DATETIME NULL,
+        last_error_class VARCHAR(32) NULL,
+        last_error_message TEXT NULL,
+        updated_at DATETIME
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+]
+
+# 送信先別のテーブル（ペーシング・ブレーカー）に投入する送信先数の上限
+DESTINATION_SEED_LIMIT = 5000
+# bulk_insert_requests の計測で一括登録する件数
+BULK_INSERT_ROWS = 1000
+
+INSERT_COLUMNS = ["id", "file_url", "fax_number", "status", "created_at", "updated_at", "error_message",
+                  "converted_pdf_path", "request_user", "file_name", "callback_url", "order_destination",
+                  "priority", "attempt_count"]
+
+# -------------------------------
+# 合成データ生成
+# -------------------------------
+
+class SyntheticProfile:
+    """parameter.json から各カラムの分布を求め、同じ傾向の行を生成する"""
+
+    def __init__(self, records, pending_ratio, seed):
+        self.random = random.Random(seed)
+        self.status_weights = self._weights(r.get("status") for r in records)
+        # 実データは完了・エラーのみのため、待機中の割合は指定値で補う
+        self.status_weights[0] = pending_ratio * sum(self.status_weights.values()) / max(1e-9, 1 - pending_ratio)
+        self.destinations = self._weights((r.get("fax_number"), r.get("order_destination")) for r in records)
+        self.file_names = [r.get("file_name") for r in records]
+        self.request_users = [r.get("request_user") for r in records]
+        self.callback_ratio = sum(1 for r in records if r.get("callback_url")) / max(1, len(records))
+        self.local_file_ratio = sum(1 for r in records if (r.get("file_url") or "").startswith("file://")) / max(1, len(records))
+        self.error_messages = [r.get("error_message") for r in records if r.get("status") == -1] or ["FAX送信に失敗しました"]
+        durations = [(datetime.fromisoformat(r["updated_at"]) - datetime.fromisoformat(r["created_at"])).total_seconds()
+                     for r in records if r.get("created_at") and r.get("updated_at")]
+        self.durations = [d for d in durations if d >= 0] or [20.0]
+
+    @staticmethod
+    def _weights(values):
+        weights = {}
+        for value in values:
+            weights[value] = weights.get(value, 0) + 1
+        return weights
+
+    def _choice(self, weights):
+        keys = list(weights)
+        return self.random.choices(keys, weights=[weights[k] for k in keys])[0]
+
+    def _destination(self, total_rows):
+        """観測された宛先に加え、件数に比例した数の合成宛先をZipf分布で混ぜる"""
+        synthetic_count = max(1, total_rows // 200)
+        if self.random.random() < 0.5:
+            return self._choice(self.destinations)
+        rank = min(synthetic_count, int(self.random.paretovariate(1.1)))
+        return f"0{860000000 + rank:09d}", f"合成発注先{rank:05d}株式会社"
+
+    def rows(self, start_index, count, total_rows, start_time):
+        """total_rows 件が HISTORY_DAYS 日間に収まる間隔でポアソン到着させた行を生成"""
+        mean_gap = HISTORY_DAYS * 86400 / total_rows
+        created_at = start_time + timedelta(seconds=start_index * mean_gap)
+        for i in range(count):
+            created_at += timedelta(seconds=self.random.expovariate(1 / mean_gap))
+            status = self._choice(self.status_weights)
+            fax_number, order_destination = self._destination(total_rows)
+            if self.random.random() < self.local_file_ratio:
+                file_url = f"file:///uploads/print_content_{created_at:%Y%m%d_%H%M%S}_{i}.pdf"
+            else:
+                file_url = f"http://monokanri-manage.local/storage/purchase/{int(created_at.timestamp() * 1000)}.png"
+            updated_at = created_at if status == 0 else created_at + timedelta(seconds=self.random.choice(self.durations))
+            yield (
+                str(uuid.UUID(int=self.random.getrandbits(128))),
+                file_url,
+                fax_number,
+                status,
+                created_at,
+                updated_at,
+                self.random.choice(self.error_messages) if status == -1 else None,
+                None,
+                self.random.choice(self.request_users),
+                self.random.choice(self.file_names),
+                "http://monokanri-manage.local/callback" if self.random.random() < self.callback_ratio else None,
+                order_destination,
+                self.random.choices([2, 1, 0], weights=[1, 8, 1])[0],
+                0 if status == 0 else 1,
+            )
+
+def seed_rows(db, profile, current, target, start_time):
+    """current 件から target 件までバッチINSERTで追加"""
+    sql = (f"INSERT INTO fax_parameters ({', '.join(INSERT_COLUMNS)}) "
+           f"VALUES ({', '.join(['%s'] * len(INSERT_COLUMNS))})")
+    cursor = db.mydb.cursor()
+    inserted = current
+    while inserted < target:
+        batch = list(profile.rows(inserted, min(SEED_BATCH_SIZE, target - inserted), target, start_time))
+        cursor.executemany(sql, batch)
+        db.mydb.commit()
+        inserted += len(batch)
+        print(f"\r  投入中: {inserted}/{target}", end="", flush=True)
+    print()
+    cursor.execute("ANALYZE TABLE fax_parameters")
+    cursor.fetchall()
+    cursor.close()
+
+# -------------------------------
+# 計測
+# -------------------------------
+
+def time_op(func, repeat):
+    """func を repeat 回実行し、実行時間（ミリ秒）の統計を返す"""
+    samples = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+def sample_ids(db, count, where=""):
+    cursor = db.mydb.cursor()
+    cursor.execute(f"SELECT id FROM fax_parameters{where} ORDER BY RAND() LIMIT %s", (count,))
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+def seed_destinations(db):
+    """投入済みの送信先をペーシング・ブレーカーのテーブルに登録し、送信先の一覧を返す"""
+    from pacer import normalize_fax_number
+    cursor = db.mydb.cursor()
+    cursor.execute("SELECT DISTINCT fax_number FROM fax_parameters LIMIT %s", (DESTINATION_SEED_LIMIT,))
+    destinations = sorted({normalize_fax_number(row[0]) for row in cursor.fetchall()} - {""})
+    cursor.close()
+    now = datetime.now()
+    with redirect_stdout(io.StringIO()):
+        for i, destination in enumerate(destinations):
+            db.save_destination_pacing(destination, 3.0, now, None, 0, "success")
+            # 1割を遮断中にする（get_all_destination_breakers・試験送信の取得の対象）
+            state = "open" if i % 10 == 0 else "closed"
+            db.save_destination_breaker(destination, state, 3 if state == "open" else 0, 1 if state == "open" else 0,
+                                        now if state == "open" else None, now if state == "open" else None,
+                                        None, None, None)
+    return destinations
+
+def explain_plans(db):
+    """主要クエリの EXPLAIN 結果を取得"""
+    now = datetime.now()
+    queries = {
+        "load_parameters": (f"SELECT {db.REQUEST_COLUMNS} FROM fax_parameters ORDER BY created_at ASC", ()),
+        "get_request_by_id": (f"SELECT {db.REQUEST_COLUMNS} FROM fax_parameters WHERE id = %s", ("x",)),
+        "get_pending_lane_heads": (
+            f"SELECT {db.REQUEST_COLUMNS} FROM fax_parameters WHERE status = 0 AND priority = %s "
+            "AND (next_attempt_at IS NULL OR next_attempt_at <= %s) ORDER BY created_at ASC LIMIT 20", (1, now)),
+        "get_queue_depth_by_priority": (
+            "SELECT priority, COUNT(*), MIN(created_at) FROM fax_parameters WHERE status = 0 GROUP BY priority", ()),
+        "get_earliest_next_attempt": (
+            "SELECT MIN(next_attempt_at) FROM fax_parameters WHERE status = 0 AND next_attempt_at > %s", (now,)),
+        "reap_expired_leases": (
+            "SELECT id FROM fax_parameters WHERE status = 2 AND (lease_expires_at < %s "
+            "OR (lease_expires_at IS NULL AND updated_at < %s))", (now, now)),
+        "retry_error_requests": ("SELECT id FROM fax_parameters WHERE status = -1 ORDER BY updated_at ASC", ()),
+        "clear_completed_requests": ("DELETE FROM fax_parameters WHERE status = 1", ()),
+    }
+    plans = {}
+    cursor = db.mydb.cursor()
+    for name, (sql, params) in queries.items():
+        cursor.execute("EXPLAIN " + sql, params)
+        columns = [desc[0] for desc in cursor.description]
+        plans[name] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+    return plans
+
+def run_size(db, profile, size, args):
+    """1つのデータ量で各操作を計測"""
+    from scheduler import PRIORITY_LANES
+    from lease import WORKER_ID
+    results = {}
+    repeat = max(args.point_repeat, 1)
+    ids = sample_ids(db, repeat)
+    # 待機中のレコードを変える操作ごとに別のレコードを使う（同じレコードだと2回目以降は0件更新になる）
+    pending_ids = sample_ids(db, repeat * 3, " WHERE status = 0")
+    pending_slices = [pending_ids[i::3] for i in range(3)]
+    destinations = seed_destinations(db)
+    now = datetime.now()
+    since = now - timedelta(days=30)
+
+    def cycle(values):
+        iterator = itertools.cycle(values)
+        return lambda: next(iterator)
+
+    next_id = cycle(ids)
+    next_destination = cycle(destinations or ["0000000000"])
+    cursor = db.mydb.cursor()
+    cursor.execute("SELECT file_name FROM fax_parameters WHERE file_name IS NOT NULL ORDER BY RAND() LIMIT 50")
+    terms = [name[:4] for (name,) in cursor.fetchall() if name and len(name) >= 4] or ["発注"]
+    cursor.close()
+    next_term = cycle(terms)
+
+    def connect_and_close():
+        db.connect().close()
+
+    def drain_requests():
+        for _ in db.iter_requests():
+            pass
+
+    # 接続・読み込み
+    results["connect"] = time_op(connect_and_close, args.scan_repeat)
+    results["load_parameters"] = time_op(db.load_parameters, args.scan_repeat)
+    results["iter_requests"] = time_op(drain_requests, args.scan_repeat)
+    results["get_requests_summary"] = time_op(db.get_requests_summary, args.scan_repeat)
+    results["get_request_by_id"] = time_op(lambda: db.get_request_by_id(next_id(), use_cache=False), args.point_repeat)
+    results["search_requests"] = time_op(lambda: db.search_requests([next_term()]), args.point_repeat)
+    results["search_requests_prefix"] = time_op(
+        lambda: db.search_requests(fax_number_prefix=next_destination()[:4]), args.point_repeat)
+    # スケジューラー・推定
+    results["get_pending_lane_heads"] = time_op(
+        lambda: db.get_pending_lane_heads(list(PRIORITY_LANES.values()), 20), args.point_repeat)
+    results["get_queue_depth_by_priority"] = time_op(db.get_queue_depth_by_priority, args.scan_repeat)
+    results["get_earliest_next_attempt"] = time_op(db.get_earliest_next_attempt, args.point_repeat)
+    results["get_oldest_preprocessing_created_at"] = time_op(
+        lambda: db.get_oldest_preprocessing_created_at(now), args.point_repeat)
+    results["get_send_history"] = time_op(lambda: db.get_send_history(since, 500), args.scan_repeat)
+    results["get_active_queue"] = time_op(lambda: db.get_active_queue(500), args.scan_repeat)
+    results["get_pending_request_destinations"] = time_op(db.get_pending_request_destinations, args.scan_repeat)
+    # 送信先別のテーブル
+    results["get_destination_daily_stats"] = time_op(lambda: db.get_destination_daily_stats(since.date()),
+                                                     args.scan_repeat)
+    results["get_destination_pacing"] = time_op(lambda: db.get_destination_pacing(next_destination()),
+                                                args.point_repeat)
+    results["get_all_destination_pacing"] = time_op(db.get_all_destination_pacing, args.scan_repeat)
+    results["save_destination_pacing"] = time_op(
+        lambda: db.save_destination_pacing(next_destination(), 2.0, now, None, 0, "success"), args.point_repeat)
+    results["get_destination_breaker"] = time_op(lambda: db.get_destination_breaker(next_destination()),
+                                                 args.point_repeat)
+    results["get_all_destination_breakers"] = time_op(db.get_all_destination_breakers, args.scan_repeat)
+    results["save_destination_breaker"] = time_op(
+        lambda: db.save_destination_breaker(next_destination(), "closed", 1, 0, None, None, None,
+                                            "send_failed", "bench"), args.point_repeat)
+    results["try_begin_breaker_probe"] = time_op(
+        lambda: db.try_begin_breaker_probe(next_destination(), now, now), args.point_repeat)
+    # 1件の更新
+    results["add_fax_request"] = time_op(
+        lambda: db.add_fax_request("http://bench.local/x.pdf", "0000000000", "bench", "bench.pdf"), args.point_repeat)
+    results["update_request_converted_pdf"] = time_op(
+        lambda: db.update_request_converted_pdf(next_id(), "converted_pdfs/bench.pdf"), args.point_repeat)
+    results["update_preprocess_result"] = time_op(
+        lambda: db.update_preprocess_result(next_id(), "ready", 1, 1024, "uploads/bench.pdf"), args.point_repeat)
+    results["update_source_errors"] = time_op(lambda: db.update_source_errors(next_id(), None), args.point_repeat)
+    results["record_send_metrics"] = time_op(lambda: db.record_send_metrics(next_id(), 20.0, 1, 1024),
+                                             args.point_repeat)
+    results["extend_lease"] = time_op(
+        lambda: db.extend_lease(next_id(), WORKER_ID, now + timedelta(minutes=2)), args.point_repeat)
+    results["update_request_status"] = time_op(lambda: db.update_request_status(next_id(), 1), args.point_repeat)
+    plans = explain_plans(db)
+
+    # 破壊的な操作（待機中・エラーのレコードを変える／削除する）はテーブルを退避してから計測し、元に戻す
+    tables = ["fax_parameters", "fax_destination_daily_stats"]
+    cursor = db.mydb.cursor()
+    for table in tables:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_bench_snapshot")
+        cursor.execute(f"CREATE TABLE {table}_bench_snapshot LIKE {table}")
+        cursor.execute(f"INSERT INTO {table}_bench_snapshot SELECT * FROM {table}")
+    db.mydb.commit()
+    claim_ids, reject_ids, fail_ids = (iter(ids_) for ids_ in pending_slices)
+    claimed, rejected = [], []
+
+    def claim():
+        request_id = next(claim_ids)
+        claimed.append(request_id)
+        db.claim_request(request_id, WORKER_ID, now + timedelta(minutes=2))
+
+    def reject():
+        request_id = next(reject_ids)
+        rejected.append(request_id)
+        db.reject_pending_request(request_id, "invalid_file", "bench")
+
+    # 取得したレコードを再試行待ちに戻す／却下したレコードを再送する、の順で実運用の遷移をなぞる
+    results["claim_request"] = time_op(claim, len(pending_slices[0]))
+    next_claimed = iter(claimed)
+    results["schedule_retry"] = time_op(
+        lambda: db.schedule_retry(next(next_claimed), "send_failed", now, "bench", WORKER_ID), len(claimed))
+    results["reject_pending_request"] = time_op(reject, len(pending_slices[1]))
+    next_rejected = iter(rejected)
+    results["retry_request_by_id"] = time_op(lambda: db.retry_request_by_id(next(next_rejected)), len(rejected))
+    results["fail_pending_request"] = time_op(
+        lambda: db.fail_pending_request(next(fail_ids), "circuit_open", "bench"), len(pending_slices[2]))
+    results["reap_expired_leases"] = time_op(lambda: db.reap_expired_leases(3, now), args.scan_repeat)
+    new_rows = list(profile.rows(size, BULK_INSERT_ROWS, size, now))
+    results["bulk_insert_requests"] = time_op(lambda: db.bulk_insert_requests(INSERT_COLUMNS, new_rows), 1)
+    results["rebuild_destination_stats"] = time_op(db.rebuild_destination_stats, 1)
+    results["retry_error_requests"] = time_op(db.retry_error_requests, 1)
+    results["clear_completed_requests"] = time_op(db.clear_completed_requests, 1)
+    results["clear_all_requests"] = time_op(db.clear_all_requests, 1)
+    for table in tables:
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"RENAME TABLE {table}_bench_snapshot TO {table}")
+    db.mydb.commit()
+    cursor.close()
+    db.REQUEST_CACHE.clear()
+    return results, plans
+
+def scaling_exponents(sizes, results_by_size):
+    """隣り合うデータ量間の log(t2/t1) / log(n2/n1)（1 ≒ 線形、0 ≒ 定数時間）"""
+    curves = {}
+    operations = results_by_size[sizes[0]].keys()
+    for op in operations:
+        points = [(n, results_by_size[n][op]["median_ms"]) for n in sizes]
+        exponents = []
+        for (n1, t1), (n2, t2) in zip(points, points[1:]):
+            if t1 > 0 and t2 > 0:
+                exponents.append(round(math.log(t2 / t1) / math.log(n2 / n1), 3))
+        curves[op] = {"points": [{"rows": n, "median_ms": t} for n, t in points], "exponents": exponents}
+    return curves
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="db.py マイクロベンチマーク")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-port", default="3306")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="fax_bench")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="計測するデータ量（カンマ区切り）")
+    parser.add_argument("--pending-ratio", type=float, default=0.01, help="待機中レコードの割合")
+    parser.add_argument("--scan-repeat", type=int, default=3, help="全件走査系の繰り返し回数")
+    parser.add_argument("--point-repeat", type=int, default=200, help="1件操作系の繰り返し回数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--source", default="parameter.json", help="分布の元データ")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+    if args.db_host in PRODUCTION_HOSTS:
+        parser.error(f"本番DB（{args.db_host}）は指定できません")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+
+    # db.py のインポート前に接続先をベンチ用DBに切り替える
+    os.environ.update({
+        "FAX_DB_HOST": args.db_host, "FAX_DB_PORT": str(args.db_port), "FAX_DB_USER": args.db_user,
+        "FAX_DB_PASSWORD": args.db_password, "FAX_DB_NAME": args.db_name, "FAX_DB_BACKEND": "mysql",
+    })
+    import db
+    if db.BACKEND.name != "mysql":
+        # 既に別のバックエンドで db がインポート済みの場合（他のモジュールから main を呼んだ場合など）
+        sys.exit(f"bench_db.py は MySQL 専用です（現在のバックエンド: {db.BACKEND.name}）")
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        profile = SyntheticProfile(json.load(f), args.pending_ratio, args.seed)
+
+    cursor = db.mydb.cursor()
+    for statement in SCHEMA_STATEMENTS:
+        cursor.execute(statement)
+    db.mydb.commit()
+    cursor.close()
+
+    print("db.py マイクロベンチマーク")
+    print("=" * 60)
+    start_time = datetime.now() - timedelta(days=HISTORY_DAYS)
+    results_by_size = {}
+    plans_by_size = {}
+    current = 0
+    for size in sizes:
+        print(f"[{size}件] データ投入")
+        seed_rows(db, profile, current, size, start_time)
+        current = size
+        print(f"[{size}件] 計測中...")
+        results, plans = run_size(db, profile, size, args)
+        results_by_size[size] = results
+        plans_by_size[size] = plans
+        # add_fax_request で増えた行を含めて次のサイズへ
+        cursor = db.mydb.cursor()
+        cursor.execute("SELECT COUNT(*) FROM fax_parameters")
+        current = cursor.fetchone()[0]
+        cursor.close()
+        for op, stats in results.items():
+            print(f"  {op:<36} median={stats['median_ms']:>10.3f}ms  p95={stats['p95_ms']:>10.3f}ms")
+
+    curves = scaling_exponents(sizes, results_by_size)
+    print("\nスケーリング（log(t2/t1)/log(n2/n1)：0≒定数時間, 1≒線形）")
+    for op, curve in curves.items():
+        print(f"  {op:<36} {curve['exponents']}")
+
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "sizes": sizes,
+        "results": {str(k): v for k, v in results_by_size.items()},
+        "explain": {str(k): v for k, v in plans_by_size.items()},
+        "scaling": curves,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+        print(f"結果を保存しました: {args.output}")
+    return result
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
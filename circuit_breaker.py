@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信先ごとのサーキットブレーカー
+番号違い・解約済みなどで送信に失敗し続ける宛先を一定時間「遮断」し、
+その宛先のジョブでダイアログ操作（1回あたり数十秒）を繰り返さないようにする
+
+  closed     通常。送信失敗が breaker_failure_threshold 回続くと open に遷移
+  open       遮断中。retry_at まで待機中のジョブは保留（breaker_mode が fail の場合はエラーにする）
+  half_open  retry_at を過ぎた後、1件だけ試験送信する。成功すれば closed、失敗すれば遮断時間を延ばして open
+
+状態は fax_destination_breaker テーブルに保存し、ワーカーとAPIサーバーで共有する
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import tuning
+from pacer import normalize_fax_number
+from retry_policy import ERROR_SEND_FAILED, ERROR_DESTINATION_WARNING
+from db import (get_all_destination_breakers, get_destination_breaker, save_destination_breaker,
+                try_begin_breaker_probe, get_pending_request_destinations, fail_pending_request)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 遮断までの連続失敗回数（breaker_failure_threshold）と遮断中のジョブの扱い（breaker_mode: park / fail）は
+# tuning.json で調整する（従来の環境変数 FAX_BREAKER_THRESHOLD / FAX_BREAKER_MODE も既定値として使える）
+# 遮断時間（遮断のたびに倍にし、上限で頭打ち）も tuning.json で調整する
+# （breaker_cooldown_seconds / breaker_cooldown_max_seconds）
+# 試験送信がこの秒数を過ぎても終わらない場合（ワーカー停止など）は、別のジョブで試験送信し直す
+BREAKER_PROBE_TIMEOUT_SECONDS = 900
+# 宛先の不調とみなすエラー種別（送信失敗と、送信先のエラーダイアログ。話中はペーシング、
+# ダイアログ未検出・取得失敗は宛先と無関係）
+BREAKER_ERROR_CLASSES = (ERROR_SEND_FAILED, ERROR_DESTINATION_WARNING)
+# 遮断時にエラーにしたジョブのエラー種別
+ERROR_CIRCUIT_OPEN = "circuit_open"
+
+# APIサーバーでの表示用キャッシュの有効秒数
+OVERVIEW_CACHE_SECONDS = 5
+
+_overview_cache = {"at": None, "value": None}
+_overview_lock = threading.Lock()
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+def _new_state(destination):
+    return {
+        "destination": destination,
+        "state": STATE_CLOSED,
+        "consecutive_failures": 0,
+        "open_count": 0,
+        "opened_at": None,
+        "retry_at": None,
+        "probe_started_at": None,
+        "last_error_class": None,
+        "last_error_message": None,
+    }
+
+def _load_state(row):
+    state = dict(row)
+    for key in ("opened_at", "retry_at", "probe_started_at"):
+        state[key] = _parse_datetime(state.get(key))
+    return state
+
+def _get_state(destination):
+    row = get_destination_breaker(destination)
+    return _load_state(row) if row else _new_state(destination)
+
+def _save_state(state):
+    save_destination_breaker(state["destination"], state["state"], state["consecutive_failures"],
+                             state["open_count"], state["opened_at"], state["retry_at"],
+                             state["probe_started_at"], state["last_error_class"], state["last_error_message"])
+
+def cooldown_seconds(open_count):
+    """open_count 回目の遮断の遮断秒数"""
+    return min(tuning.get("breaker_cooldown_max_seconds"),
+               tuning.get("breaker_cooldown_seconds") * (2 ** max(0, open_count - 1)))
+
+def load_breaker_states():
+    """遮断中・試験送信中の送信先の状態を取得（送信先 → 状態）"""
+    return {row["destination"]: _load_state(row) for row in get_all_destination_breakers()
+            if row["state"] != STATE_CLOSED}
+
+def _probe_due(state, now):
+    if state["state"] == STATE_OPEN:
+        return state["retry_at"] is None or state["retry_at"] <= now
+    # 試験送信が終わらないまま時間が過ぎた場合
+    started = state["probe_started_at"]
+    return started is None or started <= now - timedelta(seconds=BREAKER_PROBE_TIMEOUT_SECONDS)
+
+def blocked_until(states, fax_number, now=None):
+    """送信先が遮断中なら試験送信が可能になる時刻を返す（送信できる・試験送信できる場合は None）"""
+    now = now or datetime.now()
+    state = states.get(normalize_fax_number(fax_number))
+    if state is None or _probe_due(state, now):
+        return None
+    if state["state"] == STATE_OPEN:
+        return state["retry_at"]
+    return state["probe_started_at"] + timedelta(seconds=BREAKER_PROBE_TIMEOUT_SECONDS)
+
+def needs_probe(states, fax_number):
+    """このジョブを送信する前に試験送信の権利（begin_probe）が必要か"""
+    return normalize_fax_number(fax_number) in states
+
+def begin_probe(fax_number, now=None):
+    """試験送信を開始（half_open に遷移）。他のワーカーが先に開始した場合は False"""
+    now = now or datetime.now()
+    destination = normalize_fax_number(fax_number)
+    probe_stale_before = now - timedelta(seconds=BREAKER_PROBE_TIMEOUT_SECONDS)
+    if try_begin_breaker_probe(destination, now, probe_stale_before):
+        print(f"[breaker] 試験送信を開始: {destination}")
+        return True
+    return False
+
+def cancel_probe(fax_number, now=None):
+    """ジョブを取得できなかった場合に試験送信の権利を戻す（すぐ次の試験送信を行えるよう open に戻す）"""
+    now = now or datetime.now()
+    state = _get_state(normalize_fax_number(fax_number))
+    if state["state"] == STATE_HALF_OPEN:
+        state["state"] = STATE_OPEN
+        state["retry_at"] = now
+        state["probe_started_at"] = None
+        _save_state(state)
+
+def _open(state, now, reason):
+    state["state"] = STATE_OPEN
+    state["open_count"] += 1
+    state["opened_at"] = now
+    state["retry_at"] = now + timedelta(seconds=cooldown_seconds(state["open_count"]))
+    state["probe_started_at"] = None
+    print(f"[breaker] ⛔ 送信先を遮断: {state['destination']}（{reason}、{state['retry_at'].isoformat()} に試験送信）")
+
+def record_result(fax_number, success, error_class=None, error_message=None, now=None):
+    """送信結果を記録し、遮断・復旧を判定する。戻り値は記録後の状態"""
+    now = now or datetime.now()
+    destination = normalize_fax_number(fax_number)
+    if not destination:
+        return STATE_CLOSED
+    row = get_destination_breaker(destination)
+    state = _load_state(row) if row else _new_state(destination)
+
+    if success:
+        if row and (state["state"] != STATE_CLOSED or state["consecutive_failures"]):
+            if state["state"] != STATE_CLOSED:
+                print(f"[breaker] ✅ 送信先の遮断を解除: {destination}")
+            state.update(state=STATE_CLOSED, consecutive_failures=0, open_count=0, opened_at=None,
+                         retry_at=None, probe_started_at=None)
+            _save_state(state)
+        return state["state"]
+
+    if error_class not in BREAKER_ERROR_CLASSES:
+        # 宛先と無関係な失敗。試験送信中だった場合は結論が出ないため、すぐに次の試験送信を行えるようにする
+        if state["state"] == STATE_HALF_OPEN:
+            state.update(state=STATE_OPEN, retry_at=now, probe_started_at=None)
+            _save_state(state)
+        return state["state"]
+
+    state["consecutive_failures"] += 1
+    state["last_error_class"] = error_class
+    state["last_error_message"] = error_message
+    opened = False
+    if state["state"] == STATE_HALF_OPEN:
+        _open(state, now, "試験送信に失敗")
+        opened = True
+    elif state["state"] == STATE_CLOSED and state["consecutive_failures"] >= tuning.get("breaker_failure_threshold"):
+        _open(state, now, f"{state['consecutive_failures']}回連続で失敗")
+        opened = True
+    _save_state(state)
+
+    if opened and tuning.get("breaker_mode") == "fail":
+        fail_queued_jobs(destination, state)
+    return state["state"]
+
+def fail_queued_jobs(destination, state=None):
+    """遮断中の送信先の待機中ジョブをエラーにする（breaker_mode が fail の場合）。戻り値はエラーにした件数"""
+    return fail_queued_jobs_for({destination: state or _get_state(destination)})
+
+def fail_queued_jobs_for(states):
+    """複数の遮断中の送信先（送信先 → 状態）の待機中ジョブをまとめてエラーにする
+
+    待機中ジョブの走査は送信先の数によらず1回。戻り値はエラーにした件数
+    """
+    messages = {destination: (f"送信先が遮断中のため送信しませんでした（{state['consecutive_failures']}回連続失敗: "
+                              f"{state.get('last_error_message') or state.get('last_error_class')}）")
+                for destination, state in states.items()}
+    failed = {}
+    for row in get_pending_request_destinations():
+        destination = normalize_fax_number(row["fax_number"])
+        if destination in messages:
+            if fail_pending_request(row["id"], ERROR_CIRCUIT_OPEN, messages[destination]):
+                failed[destination] = failed.get(destination, 0) + 1
+    for destination, count in failed.items():
+        print(f"[breaker] 遮断中の送信先のジョブをエラーにしました: {destination}（{count}件）")
+    return sum(failed.values())
+
+def reset(fax_number):
+    """手動で遮断・失敗回数を解除（番号を修正した場合など）。解除するものがなかった場合は False"""
+    destination = normalize_fax_number(fax_number)
+    row = get_destination_breaker(destination)
+    if not row:
+        return False
+    state = _load_state(row)
+    changed = state["state"] != STATE_CLOSED or bool(state["consecutive_failures"])
+    state.update(state=STATE_CLOSED, consecutive_failures=0, open_count=0, opened_at=None,
+                 retry_at=None, probe_started_at=None)
+    _save_state(state)
+    invalidate_overview()
+    return changed
+
+def get_breaker_overview():
+    """送信先ごとの遮断状態（API・管理画面表示用。OVERVIEW_CACHE_SECONDS の間はキャッシュを返す）"""
+    with _overview_lock:
+        cached_at = _overview_cache["at"]
+        if cached_at is not None and time.monotonic() - cached_at < OVERVIEW_CACHE_SECONDS:
+            return _overview_cache["value"]
+
+    overview = []
+    for row in get_all_destination_breakers():
+        state = _load_state(row)
+        if state["state"] == STATE_CLOSED and not state["consecutive_failures"]:
+            continue
+        overview.append({
+            "destination": state["destination"],
+            "state": state["state"],
+            "consecutive_failures": state["consecutive_failures"],
+            "open_count": state["open_count"],
+            "opened_at": state["opened_at"].isoformat() if state["opened_at"] else None,
+            "retry_at": state["retry_at"].isoformat() if state["retry_at"] else None,
+            "last_error_class": state["last_error_class"],
+            "last_error_message": state["last_error_message"],
+        })
+    overview.sort(key=lambda item: (item["state"] == STATE_CLOSED, item["destination"]))
+
+    with _overview_lock:
+        _overview_cache["at"] = time.monotonic()
+        _overview_cache["value"] = overview
+    return overview
+
+def invalidate_overview():
+    with _overview_lock:
+        _overview_cache["at"] = None
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+一覧APIのレスポンス作成（列形式・圧縮・ETag）
+管理画面は30秒ごとに一覧を取り直すため、同じ内容の転送量と作成コストを減らす
+
+  - format=columns の場合、列名を1回だけ送り、各行は値の配列にする
+  - Accept-Encoding に応じて brotli / gzip で圧縮する（小さいレスポンスはそのまま）
+  - orjson があれば高速なJSONエンコーダーを使う（なければ標準の json）
+  - 内容から決まる弱いETagを付け、If-None-Match が一致すれば 304 を返す
+"""
+
+import decimal
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+FORMAT_ROWS = "rows"
+FORMAT_COLUMNS = "columns"
+RESPONSE_FORMATS = (FORMAT_ROWS, FORMAT_COLUMNS)
+
+def _default(value):
+    # MySQL の集計・DECIMAL 列は Decimal で返る
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"JSONに変換できない値です: {type(value).__name__}")
+
+def dumps(payload):
+    """JSONをUTF-8のバイト列で作成"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+def to_columns(rows, columns=None):
+    """辞書のリストを (列名のリスト, 値の配列のリスト) に変換"""
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    return columns, [[row.get(column) for column in columns] for row in rows]
+
+def make_etag(*parts):
+    """一覧の内容を表す値からETagの値を作成（弱いETagとして送信する）"""
+    return hashlib.sha1(dumps([str(part) for part in parts])).hexdigest()[:20]
+
+def not_modified(etag):
+    """If-None-Match が ETag と一致するか（弱い比較）"""
+    return etag is not None and request.if_none_match.contains_weak(etag)
+
+def choose_encoding():
+    """Accept-Encoding から使用する圧縮方式を選ぶ（brotli を優先。なければ None）"""
+    accept = request.accept_encodings
+    if brotli is not None and accept.quality("br") > 0:
+        return "br"
+    if accept.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def json_response(payload, status=200, etag=None):
+    """JSONレスポンスを作成（ETagの一致で 304、クライアントが対応していれば圧縮）"""
+    if not_modified(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    body = dumps(payload)
+    encoding = choose_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = compress(body, encoding)
+
+    response = Response(body, status=status, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if etag:
+        # ブラウザにも保存させ、毎回 If-None-Match 付きで確認させる
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+    return response
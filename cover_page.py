@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FAX送付状（カバーページ）の作成
+レイアウト・ロゴ・見出しなどの固定部分（テンプレート）は一度だけ描画してPDFとしてキャッシュし、
+ジョブごとには宛先・依頼者・件名・枚数などの可変項目だけを描画して重ね、送信PDFの先頭に付ける
+
+  cover_cache/<テンプレートのハッシュ>.pdf   描画済みテンプレート（設定・ロゴが変わると作り直す）
+"""
+
+import hashlib
+import io
+import os
+import threading
+from datetime import datetime
+
+# 送付状を付けるか（0 で付けない）
+COVER_PAGE_ENABLED = os.environ.get("FAX_COVER_PAGE", "1") != "0"
+COVER_CACHE_FOLDER = "cover_cache"
+
+# テンプレートの固定項目（環境変数で上書き可能）
+COVER_TITLE = os.environ.get("FAX_COVER_TITLE", "FAX送付状")
+COVER_SENDER = os.environ.get("FAX_COVER_SENDER", "")
+COVER_SENDER_CONTACT = os.environ.get("FAX_COVER_SENDER_CONTACT", "")
+COVER_NOTE = os.environ.get("FAX_COVER_NOTE", "いつもお世話になっております。下記の通り送付いたしますのでご確認ください。")
+COVER_LOGO_PATH = os.environ.get("FAX_COVER_LOGO", "")
+# 日本語フォント（TTFのパスを指定すると埋め込み。未指定なら reportlab 内蔵のCIDフォント）
+COVER_FONT_PATH = os.environ.get("FAX_COVER_FONT", "")
+CID_FONT_NAME = "HeiseiKakuGo-W5"
+
+# 可変項目（見出し, 値の描画位置 y）。座標はA4縦・左下原点のポイント
+FIELD_LABEL_X = 70
+FIELD_VALUE_X = 170
+FIELD_ROWS = [
+    ("order_destination", "宛先", 640),
+    ("fax_number", "FAX番号", 610),
+    ("request_user", "依頼者", 580),
+    ("file_name", "件名", 550),
+    ("total_pages", "送付枚数", 520),
+    ("sent_at", "送信日時", 490),
+]
+FIELD_FONT_SIZE = 13
+FIELD_VALUE_MAX_WIDTH = 360
+
+_font_lock = threading.Lock()
+_font_name = None
+_template_lock = threading.Lock()
+_template_cache = {}
+
+def _register_font():
+    """日本語フォントを登録し、フォント名を返す（プロセスで1回だけ）"""
+    global _font_name
+    with _font_lock:
+        if _font_name is None:
+            from reportlab.pdfbase import pdfmetrics
+            if COVER_FONT_PATH and os.path.exists(COVER_FONT_PATH):
+                from reportlab.pdfbase.ttfonts import TTFont
+                pdfmetrics.registerFont(TTFont("CoverFont", COVER_FONT_PATH))
+                _font_name = "CoverFont"
+            else:
+                from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+                pdfmetrics.registerFont(UnicodeCIDFont(CID_FONT_NAME))
+                _font_name = CID_FONT_NAME
+        return _font_name
+
+def template_key():
+    """テンプレートの内容から決まるキー（設定・ロゴ・フォントが変われば別のキャッシュになる）"""
+    parts = [COVER_TITLE, COVER_SENDER, COVER_SENDER_CONTACT, COVER_NOTE, COVER_FONT_PATH,
+             repr(FIELD_ROWS), str(FIELD_LABEL_X)]
+    for path in (COVER_LOGO_PATH, COVER_FONT_PATH):
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_size}:{int(stat.st_mtime)}")
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+def render_template():
+    """テンプレート（固定部分）を描画してPDFのバイト列を返す"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    font = _register_font()
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    # ロゴ・タイトル
+    if COVER_LOGO_PATH and os.path.exists(COVER_LOGO_PATH):
+        c.drawImage(COVER_LOGO_PATH, width - 190, height - 110, width=140, height=60,
+                    preserveAspectRatio=True, mask="auto")
+    c.setFont(font, 26)
+    c.drawString(FIELD_LABEL_X, height - 100, COVER_TITLE)
+    c.setLineWidth(2)
+    c.line(FIELD_LABEL_X, height - 115, width - 50, height - 115)
+
+    # 発信元
+    c.setFont(font, 11)
+    y = height - 140
+    for line in (COVER_SENDER, COVER_SENDER_CONTACT):
+        if line:
+            c.drawString(FIELD_LABEL_X, y, line)
+            y -= 16
+
+    # 可変項目の見出しと罫線
+    c.setLineWidth(0.5)
+    for _, label, row_y in FIELD_ROWS:
+        c.setFont(font, FIELD_FONT_SIZE)
+        c.drawString(FIELD_LABEL_X, row_y, label)
+        c.line(FIELD_VALUE_X - 10, row_y - 6, width - 50, row_y - 6)
+
+    # 本文
+    c.setFont(font, 11)
+    text = c.beginText(FIELD_LABEL_X, FIELD_ROWS[-1][2] - 50)
+    for line in COVER_NOTE.splitlines():
+        text.textLine(line)
+    c.drawText(text)
+    c.rect(FIELD_LABEL_X - 10, 80, width - FIELD_LABEL_X - 40, 120)
+    c.drawString(FIELD_LABEL_X, 185, "備考")
+
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def get_template():
+    """描画済みテンプレートを取得（メモリ → ディスクのキャッシュ → 描画 の順）"""
+    key = template_key()
+    with _template_lock:
+        data = _template_cache.get(key)
+        if data is not None:
+            return data
+
+        cache_path = os.path.join(COVER_CACHE_FOLDER, f"{key}.pdf")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                data = f.read()
+        else:
+            started = datetime.now()
+            data = render_template()
+            os.makedirs(COVER_CACHE_FOLDER, exist_ok=True)
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, cache_path)
+            elapsed = (datetime.now() - started).total_seconds()
+            print(f"[cover] 送付状テンプレートを作成しました: {cache_path}（{elapsed:.2f}秒）")
+        _template_cache.clear()
+        _template_cache[key] = data
+        return data
+
+def _fit_text(c, font, text, max_width):
+    """描画幅に収まらない値は末尾を省略"""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    if stringWidth(text, font, FIELD_FONT_SIZE) <= max_width:
+        return text
+    while text and stringWidth(text + "…", font, FIELD_FONT_SIZE) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+def render_fields(fields):
+    """可変項目だけを描画した透明なページ（PDFのバイト列）"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    font = _register_font()
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setFont(font, FIELD_FONT_SIZE)
+    for key, _, row_y in FIELD_ROWS:
+        value = fields.get(key)
+        if value in (None, ""):
+            continue
+        c.drawString(FIELD_VALUE_X, row_y, _fit_text(c, font, str(value), FIELD_VALUE_MAX_WIDTH))
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def cover_fields(request_data, body_pages, now=None):
+    """リクエストから送付状の可変項目を作成（送付枚数は送付状を含む）"""
+    now = now or datetime.now()
+    total_pages = f"{body_pages + 1}枚（本状含む）" if body_pages else None
+    return {
+        "order_destination": (f"{request_data['order_destination']} 御中"
+                              if request_data.get("order_destination") else None),
+        "fax_number": request_data.get("fax_number"),
+        "request_user": request_data.get("request_user"),
+        "file_name": request_data.get("file_name"),
+        "total_pages": total_pages,
+        "sent_at": now.strftime("%Y年%m月%d日 %H:%M"),
+    }
+
+def prepend_cover(send_pdf_path, output_pdf_path, request_data, body_pages=None):
+    """送付状を先頭に付けたPDFを output_pdf_path に書き出し、本文のページ数を返す
+
+    テンプレートのページに可変項目のページを重ね、本文のページはそのまま後ろに追加する
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    started = datetime.now()
+    body = PdfReader(send_pdf_path)
+    if body_pages is None:
+        body_pages = len(body.pages)
+
+    cover = PdfReader(io.BytesIO(get_template())).pages[0]
+    cover.merge_page(PdfReader(io.BytesIO(render_fields(cover_fields(request_data, body_pages)))).pages[0])
+
+    writer = PdfWriter()
+    writer.add_page(cover)
+    for page in body.pages:
+        writer.add_page(page)
+    with open(output_pdf_path, "wb") as f:
+        writer.write(f)
+
+    elapsed = (datetime.now() - started).total_seconds() * 1000
+    print(f"[cover] 送付状を付けました: {output_pdf_path}（本文{body_pages}ページ, {elapsed:.0f}ms）")
+    return body_pages
@@ -1,34 +1,134 @@
-import mysql.connector
-from datetime import datetime
+import os
+import json
+import threading
+from datetime import date, datetime
 import uuid
 import requests
+from db_backend import create_backend
+from request_cache import RequestCache
+import tuning
 
-# MySQLに接続
-mydb = mysql.connector.connect(
-  host="akioka.cloud",
-  port="3306",
-  user="akioka_administrator",
-  password="Akiokapass0",
-  database="akioka_db"
-)
+# MySQL接続設定（環境変数 FAX_DB_* で上書き可能。ベンチマーク・検証用DBへの切り替えに使用）
+DB_CONFIG = {
+  "host": os.environ.get("FAX_DB_HOST", "akioka.cloud"),
+  "port": os.environ.get("FAX_DB_PORT", "3306"),
+  "user": os.environ.get("FAX_DB_USER", "akioka_administrator"),
+  "password": os.environ.get("FAX_DB_PASSWORD", "Akiokapass0"),
+  "database": os.environ.get("FAX_DB_NAME", "akioka_db")
+}
 
-mycursor = mydb.cursor()
+# ストレージバックエンド（mysql: リモートMySQL / sqlite: 組み込みSQLite・WALモード）
+DB_BACKEND = os.environ.get("FAX_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("FAX_DB_PATH", "fax_queue.db")
+BACKEND = create_backend(DB_BACKEND, DB_CONFIG, SQLITE_PATH)
+
+def connect():
+    """新しいDB接続を作成（別スレッドから使う場合は専用の接続を作成すること）"""
+    return BACKEND.connect()
+
+class _ThreadLocalConnection:
+    """スレッドごと（fork後はプロセスごと）に専用のDB接続を使う接続プロキシ
+
+    WSGIサーバーのワーカースレッド間で1つの接続・カーソルを共有しないようにする。
+    接続は各スレッドで最初に使われたときに作成する
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _thread_state(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            # 初回、または fork 後の子プロセス（親の接続は閉じずに手放す）
+            local.conn = connect()
+            local.cursor = BACKEND.cursor(local.conn)
+            local.pid = os.getpid()
+        return local
+
+    def thread_connection(self):
+        return self._thread_state().conn
+
+    def thread_cursor(self):
+        return self._thread_state().cursor
+
+    def close_thread_connection(self):
+        """このスレッドの接続を閉じる（次回使用時に再接続）"""
+        local = self._local
+        if getattr(local, "pid", None) == os.getpid():
+            try:
+                local.conn.close()
+            except Exception as e:
+                print(f"DB切断エラー: {e}")
+        local.pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.thread_connection(), name)
+
+class _ThreadLocalCursor:
+    """現在のスレッドの接続に対応するカーソルへ委譲するプロキシ"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.thread_cursor(), name)
+
+# DB接続（mydb / mycursor は従来どおり使用でき、実体はスレッドごとに分かれる）
+mydb = _ThreadLocalConnection()
+
+mycursor = _ThreadLocalCursor(mydb)
+
+def init_connection():
+    """現在のスレッドのDB接続を確立（起動時の接続確認・ワーカー初期化用）"""
+    return mydb.thread_connection()
+
+def close_connection():
+    """現在のスレッドのDB接続を閉じる"""
+    mydb.close_thread_connection()
+
+# 優先度の既定値（scheduler.PRIORITY_NORMAL と同じ値）
+DEFAULT_PRIORITY = 1
+
+# get_request_by_id の読み込みキャッシュ（更新関数で該当IDを無効化する）
+REQUEST_CACHE = RequestCache()
+
+# リクエスト取得時のカラム一覧
+REQUEST_COLUMNS = """id, file_url, fax_number, status, created_at, updated_at,
+                   error_message, converted_pdf_path, request_user, file_name,
+                   callback_url, order_destination, priority,
+                   attempt_count, next_attempt_at, last_error_class,
+                   lease_owner, lease_expires_at,
+                   preprocess_status, page_count, source_bytes, prepared_pdf_path, preprocessed_at,
+                   started_at, send_seconds, file_urls, source_errors"""
+
+# JSON文字列で保存し、取得時にリスト・辞書に変換するカラム
+JSON_COLUMNS = ("file_urls", "source_errors")
+
+def _row_to_dict(row, columns):
+    """SELECT結果の1行を辞書に変換（DATETIME・DATEはISO形式の文字列、JSON_COLUMNSはリスト・辞書）"""
+    param_dict = {}
+    for i, col in enumerate(columns):
+        if isinstance(row[i], (datetime, date)):
+            param_dict[col] = row[i].isoformat()
+        elif col in JSON_COLUMNS and row[i]:
+            param_dict[col] = json.loads(row[i])
+        else:
+            param_dict[col] = row[i]
+    return param_dict
 
 # -------------------------------
 # FAXパラメータデータベース操作
 # -------------------------------
 
-def load_parameters():
-    """fax_parametersテーブルから全データを読み込み"""
+def load_parameters(where="", params=()):
+    """fax_parametersテーブルから全データを読み込み（where / params は build_request_filters の絞り込み条件）"""
     print("[load_parameters] テーブルからデータを読み込み開始")
     try:
-        mycursor.execute("""
-            SELECT id, file_url, fax_number, status, created_at, updated_at,
-                   error_message, converted_pdf_path, request_user, file_name,
-                   callback_url, order_destination
-            FROM fax_parameters
+        mycursor.execute(f"""
+            SELECT {REQUEST_COLUMNS}
+            FROM fax_parameters{where}
             ORDER BY created_at ASC
-        """)
+        """, params)
         rows = mycursor.fetchall()
         print(f"[load_parameters] {len(rows)} 件のレコードを取得")
 
@@ -37,16 +137,7 @@ def load_parameters():
         print(f"[load_parameters] カラム: {columns}")
 
         # 辞書のリストに変換
-        params_list = []
-        for row in rows:
-            param_dict = {}
-            for i, col in enumerate(columns):
-                # DATETIMEをISO形式の文字列に変換
-                if isinstance(row[i], datetime):
-                    param_dict[col] = row[i].isoformat()
-                else:
-                    param_dict[col] = row[i]
-            params_list.append(param_dict)
+        params_list = [_row_to_dict(row, columns) for row in rows]
 
         print(f"[load_parameters] 辞書変換完了: {len(params_list)} 件")
         return params_list
@@ -56,13 +147,38 @@ def load_parameters():
         traceback.print_exc()
         return []
 
+def get_requests_summary(where="", params=()):
+    """一覧の変更検出用の集計（件数・最終更新日時・ステータス合計・最新のリース期限）
+
+    リースの延長（extend_lease）は updated_at を変えないため、lease_expires_at も別に集計する
+    """
+    try:
+        mycursor.execute(f"""
+            SELECT COUNT(*), MAX(updated_at), SUM(status), MAX(lease_expires_at)
+            FROM fax_parameters{where}
+        """, params)
+        count, max_updated_at, status_sum, max_lease_expires_at = mycursor.fetchone()
+        if isinstance(max_updated_at, datetime):
+            max_updated_at = max_updated_at.isoformat()
+        if isinstance(max_lease_expires_at, datetime):
+            max_lease_expires_at = max_lease_expires_at.isoformat()
+        return {"count": count, "max_updated_at": max_updated_at,
+                "status_sum": int(status_sum or 0), "max_lease_expires_at": max_lease_expires_at}
+    except Exception as e:
+        print(f"[get_requests_summary] エラー: {e}")
+        return None
+
 def save_parameters(data):
     """パラメータデータを保存（未実装：個別更新関数を使用）"""
     # この関数は後方互換性のため保持（実際の保存は個別関数で行う）
     pass
 
-def add_fax_request(file_url, fax_number, request_user=None, file_name=None, callback_url=None, order_destination=None):
-    """新しいFAX送信リクエストを追加"""
+def add_fax_request(file_url, fax_number, request_user=None, file_name=None, callback_url=None, order_destination=None,
+                    priority=DEFAULT_PRIORITY, preprocess_status=None, file_urls=None):
+    """新しいFAX送信リクエストを追加（preprocess_status は事前処理を予約する場合に 'pending' を指定）
+
+    複数ファイルのジョブは file_urls に送信順のURLリストを指定する（file_url は先頭のURL）
+    """
     print(f"[add_fax_request] 新規リクエスト追加開始: {fax_number}")
     try:
         request_id = str(uuid.uuid4())
@@ -73,13 +189,18 @@ def add_fax_request(file_url, fax_number, request_user=None, file_name=None, cal
         print(f"[add_fax_request] fax_number: {fax_number}")
         print(f"[add_fax_request] request_user: {request_user}")
         print(f"[add_fax_request] file_name: {file_name}")
+        print(f"[add_fax_request] priority: {priority}")
+        if file_urls:
+            print(f"[add_fax_request] file_urls: {len(file_urls)}件")
 
         sql = """
             INSERT INTO fax_parameters
-            (id, file_url, fax_number, status, created_at, updated_at, request_user, file_name, callback_url, order_destination)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            (id, file_url, fax_number, status, created_at, updated_at, request_user, file_name, callback_url, order_destination,
+             priority, preprocess_status, file_urls)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        val = (request_id, file_url, fax_number, 0, created_at, created_at, request_user, file_name, callback_url, order_destination)
+        val = (request_id, file_url, fax_number, 0, created_at, created_at, request_user, file_name, callback_url, order_destination,
+               priority, preprocess_status, json.dumps(file_urls, ensure_ascii=False) if file_urls else None)
         print(f"[add_fax_request] INSERT実行")
         print(f"[add_fax_request] VALUES: {val}")
 
@@ -100,7 +221,22 @@ def add_fax_request(file_url, fax_number, request_user=None, file_name=None, cal
             "request_user": request_user,
             "file_name": file_name,
             "callback_url": callback_url,
-            "order_destination": order_destination
+            "order_destination": order_destination,
+            "priority": priority,
+            "attempt_count": 0,
+            "next_attempt_at": None,
+            "last_error_class": None,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "preprocess_status": preprocess_status,
+            "page_count": None,
+            "source_bytes": None,
+            "prepared_pdf_path": None,
+            "preprocessed_at": None,
+            "started_at": None,
+            "send_seconds": None,
+            "file_urls": list(file_urls) if file_urls else None,
+            "source_errors": None
         }
 
         print(f"[add_fax_request] リクエスト作成完了: {request_id}")
@@ -112,10 +248,16 @@ def add_fax_request(file_url, fax_number, request_user=None, file_name=None, cal
         mydb.rollback()
         raise e
 
-def update_request_status(request_id, status, error_message=None):
-    """リクエストのステータスを更新"""
+def update_request_status(request_id, status, error_message=None, error_class=None, lease_owner=None):
+    """リクエストのステータスを更新（完了・エラーになった場合は送信先別の日次集計にも加算）
+
+    lease_owner を指定すると、そのワーカーがリースを持つ処理中のレコードだけを更新する
+    （リース切れで回収され、他のワーカーが取得し直したジョブの結果を上書きしない）。
+    戻り値は更新できたか
+    """
     try:
         updated_at = datetime.now()
+        previous = _fetch_outcome_source(request_id) if status in TERMINAL_STATUSES else None
 
         sql = "UPDATE fax_parameters SET status = %s, updated_at = %s"
         val = [status, updated_at]
@@ -124,14 +266,33 @@ def update_request_status(request_id, status, error_message=None):
             sql += ", error_message = %s"
             val.append(error_message)
 
+        if error_class is not None:
+            sql += ", last_error_class = %s"
+            val.append(error_class)
+
+        if status != 2:
+            # 処理中以外に遷移したらリースを解放
+            sql += ", lease_owner = NULL, lease_expires_at = NULL"
+
         sql += " WHERE id = %s"
         val.append(request_id)
+        if lease_owner is not None:
+            sql += " AND status = 2 AND lease_owner = %s"
+            val.append(lease_owner)
 
         mycursor.execute(sql, val)
+        updated = mycursor.rowcount
+        if updated == 1 and previous and previous["status"] != status:
+            # ステータス更新と同じトランザクションで加算する（片方だけ反映されることはない）
+            _add_destination_outcome(previous, status, error_class, updated_at)
         mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
 
-        if mycursor.rowcount == 0:
+        if updated == 0 and lease_owner is not None:
+            print(f"警告: ID {request_id} のリースを失っているため更新しませんでした")
+        elif updated == 0:
             print(f"警告: ID {request_id} のレコードが見つかりません")
+        return updated == 1
     except Exception as e:
         print(f"ステータス更新エラー: {e}")
         mydb.rollback()
@@ -147,6 +308,7 @@ def update_request_converted_pdf(request_id, pdf_path):
 
         mycursor.execute(sql, val)
         mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
 
         if mycursor.rowcount == 0:
             print(f"警告: ID {request_id} のレコードが見つかりません")
@@ -155,13 +317,75 @@ def update_request_converted_pdf(request_id, pdf_path):
         mydb.rollback()
         raise e
 
-def get_request_by_id(request_id):
-    """指定されたIDのリクエストを取得"""
+def update_preprocess_result(request_id, preprocess_status, page_count=None, source_bytes=None,
+                             prepared_pdf_path=None, converted_pdf_path=None):
+    """事前処理（検証・ページ数計測・PDF変換）の結果を記録"""
     try:
+        now = datetime.now()
         sql = """
-            SELECT id, file_url, fax_number, status, created_at, updated_at,
-                   error_message, converted_pdf_path, request_user, file_name,
-                   callback_url, order_destination
+            UPDATE fax_parameters
+            SET preprocess_status = %s, page_count = %s, source_bytes = %s, prepared_pdf_path = %s,
+                preprocessed_at = %s, updated_at = %s
+        """
+        val = [preprocess_status, page_count, source_bytes, prepared_pdf_path, now, now]
+        if converted_pdf_path is not None:
+            sql += ", converted_pdf_path = %s"
+            val.append(converted_pdf_path)
+        sql += " WHERE id = %s"
+        val.append(request_id)
+
+        mycursor.execute(sql, val)
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+    except Exception as e:
+        print(f"事前処理結果の更新エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def update_source_errors(request_id, source_errors):
+    """複数ファイルのジョブのファイルごとの取得・変換エラーを記録（None または空リストで消去）"""
+    try:
+        sql = "UPDATE fax_parameters SET source_errors = %s, updated_at = %s WHERE id = %s"
+        value = json.dumps(source_errors, ensure_ascii=False) if source_errors else None
+        mycursor.execute(sql, (value, datetime.now(), request_id))
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+    except Exception as e:
+        print(f"ファイル別エラーの更新エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def reject_pending_request(request_id, error_class, error_message):
+    """待機中のリクエストをエラーにする（送信できないファイルの受付時点での却下用）
+
+    ワーカーが既に取得済み（待機中以外）の場合は何もせず False を返す
+    """
+    try:
+        now = datetime.now()
+        previous = _fetch_outcome_source(request_id)
+        sql = """
+            UPDATE fax_parameters
+            SET status = -1, updated_at = %s, error_message = %s, last_error_class = %s,
+                preprocess_status = 'failed', preprocessed_at = %s
+            WHERE id = %s AND status = 0
+        """
+        mycursor.execute(sql, (now, error_message, error_class, now, request_id))
+        rejected = mycursor.rowcount == 1
+        if rejected and previous:
+            _add_destination_outcome(previous, -1, error_class, now)
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+        return rejected
+    except Exception as e:
+        print(f"リクエスト却下エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def _fetch_request_by_id(request_id):
+    """指定されたIDのリクエストをDBから取得"""
+    try:
+        sql = f"""
+            SELECT {REQUEST_COLUMNS}
             FROM fax_parameters WHERE id = %s
         """
         mycursor.execute(sql, (request_id,))
@@ -169,18 +393,637 @@ def get_request_by_id(request_id):
 
         if row:
             columns = [desc[0] for desc in mycursor.description]
-            param_dict = {}
-            for i, col in enumerate(columns):
-                if isinstance(row[i], datetime):
-                    param_dict[col] = row[i].isoformat()
-                else:
-                    param_dict[col] = row[i]
-            return param_dict
+            return _row_to_dict(row, columns)
         return None
     except Exception as e:
         print(f"リクエスト取得エラー: {e}")
         return None
 
+def get_request_by_id(request_id, use_cache=True):
+    """指定されたIDのリクエストを取得（request_cache 経由。use_cache=False で常にDBから読む）"""
+    if not use_cache:
+        return _fetch_request_by_id(request_id)
+    return REQUEST_CACHE.get(request_id, _fetch_request_by_id)
+
+def claim_request(request_id, lease_owner=None, lease_expires_at=None):
+    """待機中のリクエストを処理中に遷移させ、試行回数を加算（他ワーカーが取得済みなら False）
+
+    lease_owner / lease_expires_at を指定すると、リース（処理担当と有効期限）を記録する
+    """
+    try:
+        sql = """
+            UPDATE fax_parameters
+            SET status = 2, updated_at = %s, started_at = %s, error_message = %s,
+                attempt_count = COALESCE(attempt_count, 0) + 1, lease_owner = %s, lease_expires_at = %s
+            WHERE id = %s AND status = 0
+        """
+        now = datetime.now()
+        mycursor.execute(sql, (now, now, "処理中", lease_owner, lease_expires_at, request_id))
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+        return mycursor.rowcount == 1
+    except Exception as e:
+        print(f"リクエスト取得（claim）エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def extend_lease(request_id, lease_owner, lease_expires_at, connection=None):
+    """リースの有効期限を延長（ハートビート用）。リースを失っていれば False
+
+    ハートビートは別スレッドで動くため、専用の connection を渡して使う
+    """
+    conn = connection or mydb
+    cursor = BACKEND.cursor(conn)
+    try:
+        sql = """
+            UPDATE fax_parameters SET lease_expires_at = %s
+            WHERE id = %s AND status = 2 AND lease_owner = %s
+        """
+        cursor.execute(sql, (lease_expires_at, request_id, lease_owner))
+        conn.commit()
+        REQUEST_CACHE.invalidate(request_id)
+        return cursor.rowcount == 1
+    except Exception as e:
+        print(f"リース延長エラー: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def reap_expired_leases(max_attempts, stale_before):
+    """リース期限切れの処理中リクエストを回収
+
+    試行回数が max_attempts 未満なら待機中に戻し、上限に達していればエラーにする。
+    リース導入前の処理中レコード（lease_expires_at が NULL）は updated_at が stale_before より古いものを対象とする。
+    戻り値は (待機中に戻した件数, エラーにした件数)
+    """
+    try:
+        now = datetime.now()
+        where = """
+            status = 2 AND (lease_expires_at < %s OR (lease_expires_at IS NULL AND updated_at < %s))
+        """
+        # 試行回数の上限に達したものは1件ずつエラーにし、送信先別の日次集計にも加算する
+        mycursor.execute(f"""
+            SELECT id, status, fax_number, order_destination, page_count, send_seconds
+            FROM fax_parameters WHERE {where} AND COALESCE(attempt_count, 0) >= %s
+        """, (now, stale_before, max_attempts))
+        columns = [desc[0] for desc in mycursor.description]
+        expired = [_row_to_dict(row, columns) for row in mycursor.fetchall()]
+        sql_fail = f"""
+            UPDATE fax_parameters
+            SET status = -1, updated_at = %s, last_error_class = 'lease_expired',
+                error_message = '処理が中断されました（リース期限切れ、試行回数上限）',
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s AND {where}
+        """
+        failed = 0
+        for row in expired:
+            mycursor.execute(sql_fail, (now, row["id"], now, stale_before))
+            if mycursor.rowcount == 1:
+                _add_destination_outcome(row, -1, "lease_expired", now)
+                failed += 1
+
+        sql_requeue = f"""
+            UPDATE fax_parameters
+            SET status = 0, updated_at = %s, last_error_class = 'lease_expired',
+                error_message = 'リース期限切れのため再投入', next_attempt_at = NULL,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE {where}
+        """
+        mycursor.execute(sql_requeue, (now, now, stale_before))
+        requeued = mycursor.rowcount
+        mydb.commit()
+        REQUEST_CACHE.clear()
+        return requeued, failed
+    except Exception as e:
+        print(f"リース回収エラー: {e}")
+        mydb.rollback()
+        return 0, 0
+
+def get_pending_lane_heads(priorities, limit_per_lane=1, exclude_fax_numbers=None, preprocess_before=None):
+    """優先度レーンごとに待機中の古い順のリクエストを取得
+
+    idx_status_priority_created（status, priority, created_at）を使い、各レーン先頭のみを読む。
+    再送待ち（next_attempt_at が未来）のリクエストと、
+    exclude_fax_numbers に指定したFAX番号（送信保留中の宛先）は除外する。
+    preprocess_before を指定すると、事前処理中（preprocess_status = 'pending'）でそれより後に作成されたものも除外する
+    """
+    try:
+        exclude = list(exclude_fax_numbers or [])
+        sql = f"""
+            SELECT {REQUEST_COLUMNS}
+            FROM fax_parameters
+            WHERE status = 0 AND priority = %s
+              AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+        """
+        params = []
+        if preprocess_before is not None:
+            sql += " AND (preprocess_status IS NULL OR preprocess_status <> 'pending' OR created_at <= %s)"
+            params.append(preprocess_before)
+        if exclude:
+            sql += " AND fax_number NOT IN (" + ", ".join(["%s"] * len(exclude)) + ")"
+            params.extend(exclude)
+        sql += " ORDER BY created_at ASC LIMIT %s"
+        now = datetime.now()
+        heads = []
+        for priority in priorities:
+            mycursor.execute(sql, (priority, now, *params, limit_per_lane))
+            rows = mycursor.fetchall()
+            columns = [desc[0] for desc in mycursor.description]
+            heads.extend(_row_to_dict(row, columns) for row in rows)
+        return heads
+    except Exception as e:
+        print(f"レーン先頭取得エラー: {e}")
+        return []
+
+def get_queue_depth_by_priority():
+    """優先度レーンごとの待機件数と最古の作成日時を取得"""
+    try:
+        sql = """
+            SELECT priority, COUNT(*) AS pending, MIN(created_at) AS oldest_created_at
+            FROM fax_parameters
+            WHERE status = 0
+            GROUP BY priority
+        """
+        mycursor.execute(sql)
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"キュー件数取得エラー: {e}")
+        return []
+
+def schedule_retry(request_id, error_class, next_attempt_at, message, lease_owner=None):
+    """失敗したリクエストを next_attempt_at 以降に再試行する待機中に戻す
+
+    lease_owner を指定すると、そのワーカーがリースを持つ処理中のレコードだけを戻す。戻り値は更新できたか
+    """
+    try:
+        sql = """
+            UPDATE fax_parameters
+            SET status = 0, updated_at = %s, error_message = %s, last_error_class = %s, next_attempt_at = %s,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s
+        """
+        val = [datetime.now(), message, error_class, next_attempt_at, request_id]
+        if lease_owner is not None:
+            sql += " AND status = 2 AND lease_owner = %s"
+            val.append(lease_owner)
+        mycursor.execute(sql, val)
+        updated = mycursor.rowcount
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+        if updated == 0 and lease_owner is not None:
+            print(f"警告: ID {request_id} のリースを失っているため再送待ちに戻しませんでした")
+        return updated == 1
+    except Exception as e:
+        print(f"再送スケジュールエラー: {e}")
+        mydb.rollback()
+        raise e
+
+def get_earliest_next_attempt():
+    """再送待ちの待機中リクエストのうち、最も早い次回試行日時を取得（なければ None）"""
+    try:
+        sql = "SELECT MIN(next_attempt_at) FROM fax_parameters WHERE status = 0 AND next_attempt_at > %s"
+        mycursor.execute(sql, (datetime.now(),))
+        row = mycursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"次回試行日時取得エラー: {e}")
+        return None
+
+def get_oldest_preprocessing_created_at(created_after):
+    """事前処理中の待機中リクエストのうち、created_after より後に作成された最古の作成日時（なければ None）"""
+    try:
+        sql = """
+            SELECT MIN(created_at) FROM fax_parameters
+            WHERE status = 0 AND preprocess_status = 'pending' AND created_at > %s
+        """
+        mycursor.execute(sql, (created_after,))
+        row = mycursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"事前処理中リクエスト取得エラー: {e}")
+        return None
+
+def record_send_metrics(request_id, send_seconds, page_count=None, source_bytes=None):
+    """送信に要した秒数を記録（ページ数・サイズは未記録の場合のみ設定）。送信予定時刻の推定に使用"""
+    try:
+        sql = """
+            UPDATE fax_parameters
+            SET send_seconds = %s, page_count = COALESCE(page_count, %s), source_bytes = COALESCE(source_bytes, %s)
+            WHERE id = %s
+        """
+        mycursor.execute(sql, (send_seconds, page_count, source_bytes, request_id))
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+    except Exception as e:
+        print(f"送信実績の記録エラー: {e}")
+        mydb.rollback()
+
+def get_send_history(since, limit):
+    """送信実績（完了ジョブのFAX番号・ページ数・所要秒数）を新しい順に取得
+
+    idx_status_created（status, created_at）で完了ジョブの直近分だけを読む
+    """
+    try:
+        sql = """
+            SELECT fax_number, page_count, source_bytes, send_seconds
+            FROM fax_parameters
+            WHERE status = 1 AND created_at >= %s AND send_seconds IS NOT NULL
+            ORDER BY created_at DESC
+            LIMIT %s
+        """
+        mycursor.execute(sql, (since, limit))
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"送信実績取得エラー: {e}")
+        return []
+
+def get_active_queue(limit):
+    """待機中・処理中のジョブを取得（送信予定時刻の推定用。idx_status を使用）"""
+    try:
+        sql = """
+            SELECT id, fax_number, status, priority, created_at, next_attempt_at, page_count, started_at
+            FROM fax_parameters
+            WHERE status IN (0, 2)
+            ORDER BY created_at ASC
+            LIMIT %s
+        """
+        mycursor.execute(sql, (limit,))
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"待機キュー取得エラー: {e}")
+        return []
+
+# -------------------------------
+# 送信先別の日次集計
+# -------------------------------
+
+# 日次集計に加算する終了ステータス（完了・エラー）
+TERMINAL_STATUSES = (1, -1)
+DESTINATION_STATS_COLUMNS = ["destination", "order_destination", "stat_date", "sent_count", "failed_count",
+                             "pages_sent", "timed_count", "send_seconds_total", "last_error_class",
+                             "last_failed_at", "updated_at"]
+
+def normalize_order_destination(order_destination):
+    """発注先名を正規化（全角英数→半角、前後・連続する空白を整理）。未指定は空文字列"""
+    import unicodedata
+    if not order_destination:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", str(order_destination)).split())
+
+def _fetch_outcome_source(request_id):
+    """日次集計に必要な項目（更新前のステータス・送信先・ページ数・所要秒数）を取得"""
+    mycursor.execute("""
+        SELECT status, fax_number, order_destination, page_count, send_seconds
+        FROM fax_parameters WHERE id = %s
+    """, (request_id,))
+    row = mycursor.fetchone()
+    if not row:
+        return None
+    return _row_to_dict(row, [desc[0] for desc in mycursor.description])
+
+def _add_destination_outcome(request_data, status, error_class, now, stat_date=None):
+    """1件の送信結果を送信先・日付の集計行に加算（コミットは呼び出し側で行う）"""
+    from pacer import normalize_fax_number
+    succeeded = status == 1
+    send_seconds = request_data.get("send_seconds") if succeeded else None
+    sql = BACKEND.increment_sql(
+        "fax_destination_daily_stats",
+        DESTINATION_STATS_COLUMNS[:3], DESTINATION_STATS_COLUMNS[3:8], DESTINATION_STATS_COLUMNS[8:])
+    val = (normalize_fax_number(request_data.get("fax_number")),
+           normalize_order_destination(request_data.get("order_destination")),
+           stat_date or now.date(),
+           1 if succeeded else 0,
+           0 if succeeded else 1,
+           (request_data.get("page_count") or 0) if succeeded else 0,
+           1 if send_seconds is not None else 0,
+           float(send_seconds or 0),
+           None if succeeded else (error_class or "unknown"),
+           None if succeeded else now,
+           now)
+    mycursor.execute(sql, val)
+
+def get_destination_daily_stats(since_date, destination=None):
+    """送信先別の日次集計を取得（destination を指定するとその番号のみ。主キー・idx_stats_date を使用）"""
+    try:
+        sql = f"SELECT {', '.join(DESTINATION_STATS_COLUMNS)} FROM fax_destination_daily_stats WHERE stat_date >= %s"
+        val = [since_date]
+        if destination is not None:
+            sql += " AND destination = %s"
+            val.append(destination)
+        mycursor.execute(sql + " ORDER BY stat_date ASC", val)
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"送信先別集計の取得エラー: {e}")
+        return []
+
+def rebuild_destination_stats():
+    """送信履歴全体から日次集計を作り直す（集計導入前の履歴の取り込み用）。戻り値は集計した件数"""
+    try:
+        mycursor.execute("DELETE FROM fax_destination_daily_stats")
+        counted = 0
+        where = " WHERE status IN (1, -1)"
+        for row in iter_requests(where):
+            updated_at = row.get("updated_at") or row.get("created_at")
+            now = datetime.fromisoformat(updated_at) if updated_at else datetime.now()
+            _add_destination_outcome(row, row["status"], row.get("last_error_class"), now)
+            counted += 1
+        mydb.commit()
+        return counted
+    except Exception as e:
+        print(f"送信先別集計の再作成エラー: {e}")
+        mydb.rollback()
+        raise e
+
+# -------------------------------
+# 送信先ペーシング状態
+# -------------------------------
+
+def get_destination_pacing(destination):
+    """送信先（正規化済みFAX番号）のペーシング状態を取得"""
+    try:
+        sql = """
+            SELECT destination, tokens, last_refill_at, next_eligible_at, busy_count, last_result, updated_at
+            FROM fax_destination_pacing WHERE destination = %s
+        """
+        mycursor.execute(sql, (destination,))
+        row = mycursor.fetchone()
+        if row:
+            columns = [desc[0] for desc in mycursor.description]
+            return _row_to_dict(row, columns)
+        return None
+    except Exception as e:
+        print(f"ペーシング状態取得エラー: {e}")
+        return None
+
+def get_all_destination_pacing():
+    """全送信先のペーシング状態を取得"""
+    try:
+        sql = """
+            SELECT destination, tokens, last_refill_at, next_eligible_at, busy_count, last_result, updated_at
+            FROM fax_destination_pacing
+        """
+        mycursor.execute(sql)
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"ペーシング状態一覧取得エラー: {e}")
+        return []
+
+def save_destination_pacing(destination, tokens, last_refill_at, next_eligible_at, busy_count, last_result):
+    """送信先のペーシング状態を保存（存在しなければ作成）"""
+    try:
+        sql = BACKEND.upsert_sql(
+            "fax_destination_pacing",
+            ["destination", "tokens", "last_refill_at", "next_eligible_at", "busy_count", "last_result", "updated_at"],
+            ["destination"])
+        val = (destination, tokens, last_refill_at, next_eligible_at, busy_count, last_result, datetime.now())
+        mycursor.execute(sql, val)
+        mydb.commit()
+    except Exception as e:
+        print(f"ペーシング状態保存エラー: {e}")
+        mydb.rollback()
+        raise e
+
+# -------------------------------
+# 送信先サーキットブレーカー
+# -------------------------------
+
+BREAKER_COLUMNS = ["destination", "state", "consecutive_failures", "open_count", "opened_at", "retry_at",
+                   "probe_started_at", "last_error_class", "last_error_message", "updated_at"]
+
+def get_destination_breaker(destination):
+    """送信先（正規化済みFAX番号）のサーキットブレーカー状態を取得"""
+    try:
+        sql = f"SELECT {', '.join(BREAKER_COLUMNS)} FROM fax_destination_breaker WHERE destination = %s"
+        mycursor.execute(sql, (destination,))
+        row = mycursor.fetchone()
+        if row:
+            columns = [desc[0] for desc in mycursor.description]
+            return _row_to_dict(row, columns)
+        return None
+    except Exception as e:
+        print(f"ブレーカー状態取得エラー: {e}")
+        return None
+
+def get_all_destination_breakers():
+    """全送信先のサーキットブレーカー状態を取得"""
+    try:
+        mycursor.execute(f"SELECT {', '.join(BREAKER_COLUMNS)} FROM fax_destination_breaker")
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"ブレーカー状態一覧取得エラー: {e}")
+        return []
+
+def save_destination_breaker(destination, state, consecutive_failures, open_count, opened_at, retry_at,
+                             probe_started_at, last_error_class, last_error_message):
+    """送信先のサーキットブレーカー状態を保存（存在しなければ作成）"""
+    try:
+        sql = BACKEND.upsert_sql("fax_destination_breaker", BREAKER_COLUMNS, ["destination"])
+        val = (destination, state, consecutive_failures, open_count, opened_at, retry_at, probe_started_at,
+               last_error_class, last_error_message, datetime.now())
+        mycursor.execute(sql, val)
+        mydb.commit()
+    except Exception as e:
+        print(f"ブレーカー状態保存エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def try_begin_breaker_probe(destination, now, probe_stale_before):
+    """遮断中の送信先を試験送信中（half_open）に遷移させる
+
+    遮断時間が過ぎた open、または試験送信が probe_stale_before より前から終わっていない half_open の場合のみ
+    更新する（条件付き UPDATE のため、複数のワーカーがいても試験送信は1件だけ）
+    """
+    try:
+        sql = """
+            UPDATE fax_destination_breaker
+            SET state = 'half_open', probe_started_at = %s, updated_at = %s
+            WHERE destination = %s
+              AND ((state = 'open' AND (retry_at IS NULL OR retry_at <= %s))
+                   OR (state = 'half_open' AND (probe_started_at IS NULL OR probe_started_at <= %s)))
+        """
+        mycursor.execute(sql, (now, now, destination, now, probe_stale_before))
+        mydb.commit()
+        return mycursor.rowcount == 1
+    except Exception as e:
+        print(f"試験送信の開始エラー: {e}")
+        mydb.rollback()
+        return False
+
+def get_pending_request_destinations():
+    """待機中のリクエストのIDとFAX番号を取得（遮断中の送信先のジョブを探す用。idx_status を使用）"""
+    try:
+        mycursor.execute("SELECT id, fax_number FROM fax_parameters WHERE status = 0")
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"待機中リクエストの取得エラー: {e}")
+        return []
+
+def fail_pending_request(request_id, error_class, error_message):
+    """待機中のリクエストをエラーにする（送信先別の日次集計にも加算）
+
+    ワーカーが既に取得済み（待機中以外）の場合は何もせず False を返す
+    """
+    try:
+        now = datetime.now()
+        previous = _fetch_outcome_source(request_id)
+        sql = """
+            UPDATE fax_parameters
+            SET status = -1, updated_at = %s, error_message = %s, last_error_class = %s, next_attempt_at = NULL
+            WHERE id = %s AND status = 0
+        """
+        mycursor.execute(sql, (now, error_message, error_class, request_id))
+        failed = mycursor.rowcount == 1
+        if failed and previous:
+            _add_destination_outcome(previous, -1, error_class, now)
+        mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
+        return failed
+    except Exception as e:
+        print(f"リクエストのエラー化エラー: {e}")
+        mydb.rollback()
+        raise e
+
+def bulk_insert_requests(columns, rows):
+    """複数のリクエストを1文の複数行 INSERT でまとめて登録（同じIDが既にあれば無視）
+
+    取り込みの再開時に同じ行を再度送っても重複しない。戻り値は実際に追加した件数
+    """
+    if not rows:
+        return 0
+    try:
+        inserted = 0
+        per_statement = max(1, BACKEND.max_params // len(columns))
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            sql = BACKEND.insert_ignore_sql("fax_parameters", columns, len(chunk))
+            mycursor.execute(sql, [value for row in chunk for value in row])
+            inserted += mycursor.rowcount
+        mydb.commit()
+        REQUEST_CACHE.clear()
+        return inserted
+    except Exception as e:
+        print(f"一括登録エラー: {e}")
+        mydb.rollback()
+        raise e
+
+# 一覧・エクスポートの絞り込み条件（管理画面の検索項目と同じ。文字列は部分一致）
+REQUEST_FILTER_LIKE_COLUMNS = ("request_user", "file_name", "order_destination", "fax_number")
+
+def _escape_like(value):
+    """LIKE のパターン用にエスケープ（MySQL と SQLite で解釈が同じになるよう、エスケープ文字には ! を使う）"""
+    return value.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+def _request_filter_conditions(status=None, created_from=None, created_to=None, **like_filters):
+    """絞り込み条件の (条件のリスト, パラメータ)"""
+    conditions = []
+    params = []
+    if status is not None and status != "":
+        conditions.append("status = %s")
+        params.append(int(status))
+    if created_from:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+    for column in REQUEST_FILTER_LIKE_COLUMNS:
+        value = like_filters.get(column)
+        if value:
+            conditions.append(f"{column} LIKE %s ESCAPE '!'")
+            params.append(f"%{_escape_like(value)}%")
+    return conditions, params
+
+def build_request_filters(status=None, created_from=None, created_to=None, **like_filters):
+    """絞り込み条件から WHERE 句とパラメータを作成（条件がなければ空文字列）"""
+    conditions, params = _request_filter_conditions(status, created_from, created_to, **like_filters)
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    return where, params
+
+# 全文検索の対象カラム（MySQL は FULLTEXT ngram、SQLite は FTS5 trigram の索引）
+SEARCH_TEXT_COLUMNS = ("file_name", "order_destination", "request_user")
+
+def _prefix_upper_bound(prefix):
+    """前方一致を範囲検索（prefix <= 値 < 上限）にするための上限"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_requests(terms=(), fax_number_prefix=None, status=None, created_from=None, created_to=None,
+                    limit=20, offset=0):
+    """キーワード（全文検索）・FAX番号（前方一致）でリクエストを検索し、関連度順に返す
+
+    terms はすべて含むものだけを返す。索引で検索できない短い語は部分一致で絞り込む。
+    各行には関連度（score、全文検索をしない場合は 0）を付ける
+    """
+    conditions, params = _request_filter_conditions(status, created_from, created_to)
+    join, join_params = "", []
+    score, score_params = "0", []
+
+    fulltext_terms = [term for term in terms if len(term) >= BACKEND.fulltext_min_length]
+    if fulltext_terms:
+        fulltext = BACKEND.fulltext_search_sql("fax_parameters", SEARCH_TEXT_COLUMNS, fulltext_terms)
+        join, join_params = fulltext["join"], fulltext["join_params"]
+        score, score_params = fulltext["score"], fulltext["score_params"]
+        if fulltext["where"]:
+            conditions.insert(0, fulltext["where"])
+            params[:0] = fulltext["where_params"]
+    for term in terms:
+        if len(term) < BACKEND.fulltext_min_length:
+            conditions.append("(" + " OR ".join(f"{column} LIKE %s ESCAPE '!'" for column in SEARCH_TEXT_COLUMNS) + ")")
+            params.extend([f"%{_escape_like(term)}%"] * len(SEARCH_TEXT_COLUMNS))
+    if fax_number_prefix:
+        # LIKE 'xxx%' ではなく範囲条件にし、どちらのバックエンドでも idx_fax_number を使う
+        conditions.append("fax_number >= %s AND fax_number < %s")
+        params.extend([fax_number_prefix, _prefix_upper_bound(fax_number_prefix)])
+
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    sql = (f"SELECT {REQUEST_COLUMNS}, {score} AS score FROM fax_parameters{join}{where}"
+           f" ORDER BY score DESC, created_at DESC, id LIMIT %s OFFSET %s")
+    try:
+        mycursor.execute(sql, score_params + join_params + params + [limit, offset])
+        rows = mycursor.fetchall()
+        columns = [desc[0] for desc in mycursor.description]
+        return [_row_to_dict(row, columns) for row in rows]
+    except Exception as e:
+        print(f"[search_requests] エラー: {e}")
+        raise
+
+def iter_requests(where="", params=(), chunk_size=1000):
+    """条件に合うリクエストを1件ずつ返すジェネレーター（エクスポート用）
+
+    専用の接続でサーバー側カーソル（結果をまとめて読み込まないカーソル）を使い、
+    chunk_size 件ずつ読み出すため、件数に関わらずメモリ使用量は一定
+    """
+    conn = connect()
+    cursor = BACKEND.streaming_cursor(conn)
+    try:
+        cursor.execute(f"SELECT {REQUEST_COLUMNS} FROM fax_parameters{where} ORDER BY created_at ASC", params)
+        columns = [desc[0] for desc in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _row_to_dict(row, columns)
+    finally:
+        try:
+            cursor.close()
+        finally:
+            conn.close()
+
 def clear_completed_requests():
     """完了済みの送信履歴を削除"""
     try:
@@ -188,20 +1031,36 @@ def clear_completed_requests():
         mycursor.execute(sql)
         deleted_count = mycursor.rowcount
         mydb.commit()
+        REQUEST_CACHE.clear()
         return deleted_count
     except Exception as e:
         print(f"完了済み削除エラー: {e}")
         mydb.rollback()
         raise e
 
-def retry_error_requests():
-    """エラー状態の送信を再送状態に変更"""
+def retry_error_requests(attempt_times=None):
+    """エラー状態の送信を再送状態に変更
+
+    attempt_times(件数) を渡すと、古い順に各リクエストの次回試行日時を割り当てる
+    （一斉に待機中へ戻して送信が集中しないようにする）
+    """
     try:
-        sql = "UPDATE fax_parameters SET status = 0, updated_at = %s, error_message = NULL WHERE status = -1"
-        val = (datetime.now(),)
-        mycursor.execute(sql, val)
+        mycursor.execute("SELECT id FROM fax_parameters WHERE status = -1 ORDER BY updated_at ASC")
+        ids = [row[0] for row in mycursor.fetchall()]
+        if not ids:
+            return 0
+
+        now = datetime.now()
+        times = attempt_times(len(ids)) if attempt_times else [None] * len(ids)
+        sql = """
+            UPDATE fax_parameters
+            SET status = 0, updated_at = %s, error_message = NULL, attempt_count = 0, next_attempt_at = %s
+            WHERE id = %s AND status = -1
+        """
+        mycursor.executemany(sql, [(now, at, request_id) for request_id, at in zip(ids, times)])
         retry_count = mycursor.rowcount
         mydb.commit()
+        REQUEST_CACHE.clear()
         return retry_count
     except Exception as e:
         print(f"エラーリトライエラー: {e}")
@@ -220,10 +1079,15 @@ def retry_request_by_id(request_id):
             return False, "エラー状態の送信のみ再送可能です"
 
         # 再送状態に変更
-        sql_update = "UPDATE fax_parameters SET status = 0, updated_at = %s, error_message = NULL WHERE id = %s"
+        sql_update = """
+            UPDATE fax_parameters
+            SET status = 0, updated_at = %s, error_message = NULL, attempt_count = 0, next_attempt_at = NULL
+            WHERE id = %s
+        """
         val = (datetime.now(), request_id)
         mycursor.execute(sql_update, val)
         mydb.commit()
+        REQUEST_CACHE.invalidate(request_id)
 
         if mycursor.rowcount > 0:
             return True, "送信を再送しました"
@@ -241,6 +1105,7 @@ def clear_all_requests():
         mycursor.execute(sql)
         deleted_count = mycursor.rowcount
         mydb.commit()
+        REQUEST_CACHE.clear()
         return deleted_count
     except Exception as e:
         print(f"全削除エラー: {e}")
@@ -283,7 +1148,7 @@ def send_callback_notification(request_data):
         }
 
         # POSTリクエストを送信
-        response = requests.post(callback_url, json=callback_data, timeout=30)
+        response = requests.post(callback_url, json=callback_data, timeout=tuning.get("callback_timeout_seconds"))
 
         if response.status_code == 200:
             print(f"[send_callback_notification] コールバック通知送信成功: HTTP {response.status_code}")
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ストレージバックエンド
+db.py の関数はそのままに、接続先を MySQL（リモート）と SQLite（組み込み・WAL）で切り替える
+
+  FAX_DB_BACKEND=mysql   （既定）FAX_DB_HOST などの接続情報でMySQLに接続
+  FAX_DB_BACKEND=sqlite  FAX_DB_PATH のファイルをWALモードで使用（単一サーバー構成・テスト用）
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+
+# -------------------------------
+# MySQL
+# -------------------------------
+
+class MySQLBackend:
+    """リモートMySQL（スキーマは fax_parameters_migration.txt で作成）"""
+
+    name = "mysql"
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self):
+        import mysql.connector
+        return mysql.connector.connect(**self.config)
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def streaming_cursor(self, conn):
+        """結果をクライアントにまとめて読み込まないカーソル（fetchmany で少しずつ受信）"""
+        return conn.cursor(buffered=False)
+
+    # 1文あたりのプレースホルダー数の上限
+    max_params = 65535
+
+    def insert_ignore_sql(self, table, columns, row_count):
+        """既存の主キーを無視する複数行 INSERT 文を生成"""
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        return f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([row] * row_count)
+
+    def upsert_sql(self, table, columns, key_columns):
+        """INSERT ... ON DUPLICATE KEY UPDATE 文を生成"""
+        updates = ", ".join(f"{c} = VALUES({c})" for c in columns if c not in key_columns)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+    # 全文検索で索引を使える最短の語の長さ（ngram_token_size の既定値）
+    fulltext_min_length = 2
+
+    def fulltext_search_sql(self, table, columns, terms):
+        """全文検索（FULLTEXT ngram）の JOIN句・条件・スコア式とそれぞれのパラメータ
+
+        terms はすべて含むレコードだけを対象にする（語ごとにフレーズ検索）
+        """
+        query = " ".join(f'+"{term}"' for term in terms)
+        match = f"MATCH({', '.join(columns)}) AGAINST (%s IN BOOLEAN MODE)"
+        return {"join": "", "join_params": [], "where": match, "where_params": [query],
+                "score": match, "score_params": [query]}
+
+    def increment_sql(self, table, key_columns, counter_columns, latest_columns=()):
+        """集計行の INSERT（既存行があれば counter_columns を加算し、latest_columns は NULL でなければ上書き）"""
+        columns = list(key_columns) + list(counter_columns) + list(latest_columns)
+        updates = [f"{c} = {c} + VALUES({c})" for c in counter_columns]
+        updates += [f"{c} = COALESCE(VALUES({c}), {c})" for c in latest_columns]
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+
+# -------------------------------
+# SQLite
+# -------------------------------
+
+# fax_parameters_migration.txt と同等のテーブル・インデックス
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS fax_parameters (
+        id TEXT PRIMARY KEY,
+        file_url TEXT,
+        fax_number TEXT,
+        status INTEGER DEFAULT 0,
+        created_at DATETIME,
+        updated_at DATETIME,
+        error_message TEXT,
+        converted_pdf_path TEXT,
+        request_user TEXT,
+        file_name TEXT,
+        callback_url TEXT,
+        order_destination TEXT,
+        priority INTEGER NOT NULL DEFAULT 1,
+        attempt_count INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DATETIME,
+        last_error_class TEXT,
+        lease_owner TEXT,
+        lease_expires_at DATETIME,
+        preprocess_status TEXT,
+        page_count INTEGER,
+        source_bytes INTEGER,
+        prepared_pdf_path TEXT,
+        preprocessed_at DATETIME,
+        started_at DATETIME,
+        send_seconds REAL,
+        file_urls TEXT,
+        source_errors TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_status ON fax_parameters(status)",
+    "CREATE INDEX IF NOT EXISTS idx_created_at ON fax_parameters(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_fax_number ON fax_parameters(fax_number)",
+    "CREATE INDEX IF NOT EXISTS idx_request_user ON fax_parameters(request_user)",
+    "CREATE INDEX IF NOT EXISTS idx_status_created ON fax_parameters(status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_status_priority_created ON fax_parameters(status, priority, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_status_next_attempt ON fax_parameters(status, next_attempt_at)",
+    "CREATE INDEX IF NOT EXISTS idx_status_lease_expires ON fax_parameters(status, lease_expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS fax_destination_pacing (
+        destination TEXT PRIMARY KEY,
+        tokens REAL NOT NULL DEFAULT 0,
+        last_refill_at DATETIME,
+        next_eligible_at DATETIME,
+        busy_count INTEGER NOT NULL DEFAULT 0,
+        last_result TEXT,
+        updated_at DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fax_destination_daily_stats (
+        destination TEXT NOT NULL,
+        order_destination TEXT NOT NULL DEFAULT '',
+        stat_date DATE NOT NULL,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        failed_count INTEGER NOT NULL DEFAULT 0,
+        pages_sent INTEGER NOT NULL DEFAULT 0,
+        timed_count INTEGER NOT NULL DEFAULT 0,
+        send_seconds_total REAL NOT NULL DEFAULT 0,
+        last_error_class TEXT,
+        last_failed_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (destination, order_destination, stat_date)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stats_date ON fax_destination_daily_stats(stat_date)",
+    """
+    CREATE TABLE IF NOT EXISTS fax_destination_breaker (
+        destination TEXT PRIMARY KEY,
+        state TEXT NOT NULL DEFAULT 'closed',
+        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+        open_count INTEGER NOT NULL DEFAULT 0,
+        opened_at DATETIME,
+        retry_at DATETIME,
+        probe_started_at DATETIME,
+        last_error_class TEXT,
+        last_error_message TEXT,
+        updated_at DATETIME
+    )
+    """,
+    # 全文検索（MySQL の FULLTEXT ngram の代わりに FTS5 の trigram。fax_parameters の変更はトリガーで反映）
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS fax_parameters_fts USING fts5(
+        file_name, order_destination, request_user,
+        content='fax_parameters', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS fax_parameters_fts_insert AFTER INSERT ON fax_parameters BEGIN
+        INSERT INTO fax_parameters_fts(rowid, file_name, order_destination, request_user)
+        VALUES (new.rowid, new.file_name, new.order_destination, new.request_user);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS fax_parameters_fts_delete AFTER DELETE ON fax_parameters BEGIN
+        INSERT INTO fax_parameters_fts(fax_parameters_fts, rowid, file_name, order_destination, request_user)
+        VALUES ('delete', old.rowid, old.file_name, old.order_destination, old.request_user);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS fax_parameters_fts_update
+    AFTER UPDATE OF file_name, order_destination, request_user ON fax_parameters BEGIN
+        INSERT INTO fax_parameters_fts(fax_parameters_fts, rowid, file_name, order_destination, request_user)
+        VALUES ('delete', old.rowid, old.file_name, old.order_destination, old.request_user);
+        INSERT INTO fax_parameters_fts(rowid, file_name, order_destination, request_user)
+        VALUES (new.rowid, new.file_name, new.order_destination, new.request_user);
+    END
+    """,
+]
+
+# DATETIME は ISO形式の文字列で保存し、読み出し時に datetime に戻す（MySQL と同じ型で返す）
+sqlite3.register_adapter(datetime, lambda value: value.isoformat())
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+
+class SQLiteCursor:
+    """db.py の %s プレースホルダーを SQLite の ? に変換するカーソル"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(sql.replace("%s", "?"), tuple(params))
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(sql.replace("%s", "?"), [tuple(p) for p in seq_of_params])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+class SQLiteBackend:
+    """組み込みSQLite（WALモード）。初回接続時にスキーマを作成する"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        with self._schema_lock:
+            if not self._schema_ready:
+                # テーブル作成 → 不足カラムの追加 → インデックス作成 の順に行う
+                fts_missing = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'fax_parameters_fts'").fetchone() is None
+                tables = [st for st in SQLITE_SCHEMA if "CREATE TABLE" in st]
+                for statement in tables:
+                    conn.execute(statement)
+                self._add_missing_columns(conn)
+                for statement in SQLITE_SCHEMA:
+                    if statement not in tables:
+                        conn.execute(statement)
+                if fts_missing:
+                    # 全文検索の導入前からあるレコードを索引に登録
+                    conn.execute("INSERT INTO fax_parameters_fts(fax_parameters_fts) VALUES ('rebuild')")
+                conn.commit()
+                self._schema_ready = True
+        return conn
+
+    def _add_missing_columns(self, conn):
+        """既存のDBファイルに、後から追加されたカラムを追加する"""
+        for statement in SQLITE_SCHEMA:
+            match = re.match(r"\s*CREATE TABLE IF NOT EXISTS (\w+) \((.*)\)\s*$", statement, re.S)
+            if not match:
+                continue
+            table, body = match.groups()
+            # 複合主キーなどのテーブル制約はカラム定義ではないため除く
+            body = re.sub(r",\s*PRIMARY KEY\s*\([^)]*\)", "", body)
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for line in body.split(","):
+                definition = line.strip()
+                column = definition.split()[0]
+                if column not in existing:
+                    # PRIMARY KEY は既存テーブルに追加できないが、主キーは作成時から存在する
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+                    print(f"[db_backend] カラムを追加しました: {table}.{column}")
+
+    def cursor(self, conn):
+        return SQLiteCursor(conn.cursor())
+
+    def streaming_cursor(self, conn):
+        """SQLite のカーソルは fetchmany で必要な分だけ読み出す"""
+        return self.cursor(conn)
+
+    # 1文あたりのプレースホルダー数の上限（SQLite 3.32 未満は 999）
+    max_params = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+    def insert_ignore_sql(self, table, columns, row_count):
+        """既存の主キーを無視する複数行 INSERT 文を生成"""
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([row] * row_count)
+
+    def upsert_sql(self, table, columns, key_columns):
+        """INSERT ... ON CONFLICT DO UPDATE 文を生成"""
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in key_columns)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {updates}")
+
+    # 全文検索で索引を使える最短の語の長さ（trigram）
+    fulltext_min_length = 3
+
+    def fulltext_search_sql(self, table, columns, terms):
+        """全文検索（FTS5 trigram）の JOIN句・条件・スコア式とそれぞれのパラメータ
+
+        FTS5 のテーブルには同名のカラムがあるため、一致した rowid とスコアだけを副問い合わせで結合する
+        """
+        query = " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        join = (f" JOIN (SELECT rowid AS fts_rowid, -bm25({table}_fts) AS fts_score FROM {table}_fts"
+                f" WHERE {table}_fts MATCH %s) fts ON fts.fts_rowid = {table}.rowid")
+        return {"join": join, "join_params": [query], "where": None, "where_params": [],
+                "score": "fts.fts_score", "score_params": []}
+
+    def increment_sql(self, table, key_columns, counter_columns, latest_columns=()):
+        """集計行の INSERT（既存行があれば counter_columns を加算し、latest_columns は NULL でなければ上書き）"""
+        columns = list(key_columns) + list(counter_columns) + list(latest_columns)
+        updates = [f"{c} = {c} + excluded.{c}" for c in counter_columns]
+        updates += [f"{c} = COALESCE(excluded.{c}, {c})" for c in latest_columns]
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {', '.join(updates)}")
+
+# -------------------------------
+# バックエンド選択
+# -------------------------------
+
+def create_backend(name, mysql_config, sqlite_path):
+    """設定名からバックエンドを作成"""
+    name = (name or "mysql").lower()
+    if name == "mysql":
+        return MySQLBackend(mysql_config)
+    if name == "sqlite":
+        return SQLiteBackend(sqlite_path)
+    raise ValueError(f"未対応のDBバックエンドです: {name}（mysql / sqlite）")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信先別の送信実績（日次集計）
+ステータスが完了・エラーになるたびに db.update_request_status が
+送信先（正規化したFAX番号）・発注先・日付ごとの集計行に加算する。
+分析APIは集計行だけを読むため、送信履歴の件数に関わらず一定の時間で答えられる
+
+  python destination_stats.py --rebuild   集計導入前の履歴から集計を作り直す
+"""
+
+import argparse
+from datetime import date, timedelta
+
+import pacer
+from db import get_destination_daily_stats, rebuild_destination_stats
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+
+SORT_KEYS = {
+    "failed": lambda item: (item["failed"], item["failure_rate"]),
+    "failure_rate": lambda item: (item["failure_rate"], item["failed"]),
+    "sent": lambda item: (item["sent"], item["pages_sent"]),
+    "pages": lambda item: (item["pages_sent"], item["sent"]),
+    "seconds": lambda item: (item["avg_send_seconds"] or 0, item["sent"]),
+}
+
+def _empty_summary(destination, order_destination):
+    return {
+        "destination": destination,
+        "order_destination": order_destination,
+        "sent": 0,
+        "failed": 0,
+        "pages_sent": 0,
+        "_timed": 0,
+        "_seconds": 0.0,
+        "last_error_class": None,
+        "last_failed_at": None,
+    }
+
+def _accumulate(summary, row):
+    summary["sent"] += row["sent_count"]
+    summary["failed"] += row["failed_count"]
+    summary["pages_sent"] += row["pages_sent"]
+    summary["_timed"] += row["timed_count"]
+    summary["_seconds"] += float(row["send_seconds_total"] or 0)
+    if row["last_failed_at"] and (summary["last_failed_at"] is None or row["last_failed_at"] > summary["last_failed_at"]):
+        summary["last_failed_at"] = row["last_failed_at"]
+        summary["last_error_class"] = row["last_error_class"]
+
+def _finish(summary):
+    timed = summary.pop("_timed")
+    seconds = summary.pop("_seconds")
+    total = summary["sent"] + summary["failed"]
+    summary["total"] = total
+    summary["failure_rate"] = round(summary["failed"] / total, 3) if total else 0.0
+    summary["avg_send_seconds"] = round(seconds / timed, 1) if timed else None
+    summary["avg_pages"] = round(summary["pages_sent"] / summary["sent"], 1) if summary["sent"] else None
+    return summary
+
+def parse_days(value):
+    """集計期間（日数）を検証（1〜MAX_DAYS）"""
+    try:
+        days = int(value) if value not in (None, "") else DEFAULT_DAYS
+    except ValueError:
+        raise ValueError(f"daysが不正です: {value}")
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"daysは1〜{MAX_DAYS}で指定してください: {days}")
+    return days
+
+def destination_overview(days=DEFAULT_DAYS, sort="failed", limit=None, today=None):
+    """直近 days 日間の送信先（FAX番号・発注先）ごとの集計を返す"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sortが不正です: {sort}（{' / '.join(SORT_KEYS)}）")
+    since = (today or date.today()) - timedelta(days=days - 1)
+
+    summaries = {}
+    for row in get_destination_daily_stats(since):
+        key = (row["destination"], row["order_destination"])
+        if key not in summaries:
+            summaries[key] = _empty_summary(*key)
+        _accumulate(summaries[key], row)
+
+    items = sorted((_finish(summary) for summary in summaries.values()), key=SORT_KEYS[sort], reverse=True)
+    return items[:limit] if limit else items
+
+def destination_detail(fax_number, days=DEFAULT_DAYS, today=None):
+    """1つの送信先の集計（期間合計・発注先別・日別）。実績がなければ None"""
+    destination = pacer.normalize_fax_number(fax_number)
+    since = (today or date.today()) - timedelta(days=days - 1)
+    rows = get_destination_daily_stats(since, destination)
+    if not rows:
+        return None
+
+    total = _empty_summary(destination, None)
+    by_order_destination = {}
+    by_day = {}
+    for row in rows:
+        _accumulate(total, row)
+        name = row["order_destination"]
+        _accumulate(by_order_destination.setdefault(name, _empty_summary(destination, name)), row)
+        _accumulate(by_day.setdefault(row["stat_date"], _empty_summary(destination, None)), row)
+
+    daily = []
+    for stat_date in sorted(by_day):
+        day = _finish(by_day[stat_date])
+        day["date"] = stat_date
+        del day["destination"], day["order_destination"]
+        daily.append(day)
+
+    summary = _finish(total)
+    summary["by_order_destination"] = [_finish(item) for item in by_order_destination.values()]
+    summary["daily"] = daily
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="送信先別の日次集計")
+    parser.add_argument("--rebuild", action="store_true", help="送信履歴全体から集計を作り直す")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help="表示する期間（日数）")
+    parser.add_argument("--limit", type=int, default=20, help="表示する送信先の数")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        counted = rebuild_destination_stats()
+        print(f"日次集計を作り直しました（{counted}件）")
+
+    print(f"直近{args.days}日間の送信先別実績（エラー件数順）")
+    for item in destination_overview(args.days, "failed", args.limit):
+        name = item["order_destination"] or "-"
+        print(f"{item['destination']:>14}  {name:<20}  送信 {item['sent']:>5}  エラー {item['failed']:>4}"
+              f"（{item['failure_rate']:.1%}）  {item['pages_sent']:>6}ページ  平均 {item['avg_send_seconds'] or '-'}秒")
+
+if __name__ == "__main__":
+    main()
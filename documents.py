@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+複数ファイルのジョブ（発注書＋図面など）の送信用PDF作成
+1件のFAXで送れるよう、ファイルを並行して取得し、画像はA4 PDFに変換したうえで指定された順に1つのPDFへ結合する
+
+  - 取得・変換できなかったファイルは、何番目のどのファイルかとエラー内容をジョブの source_errors に記録する
+  - 結合時は各PDFをファイルから必要な部分だけ読み込み、ファイル全体をメモリに読み込まない
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from preprocess import count_pdf_pages, verify_image, InvalidFileError
+from fetcher import fetch, FetchError, FETCH_CONCURRENCY
+
+# 1件のジョブに指定できるファイル数の上限
+MAX_SOURCES = int(os.environ.get("FAX_MAX_SOURCES", "10"))
+
+class SourceError(Exception):
+    """一部のファイルを取得・変換できなかった
+
+    errors はファイルごとのエラー（{"index", "file_url", "error"} のリスト。index は1始まり）。
+    invalid は送信できないファイル（壊れた画像・パスワード付きPDFなど）が含まれるか
+    """
+
+    def __init__(self, errors, invalid=False):
+        self.errors = errors
+        self.invalid = invalid
+        super().__init__(describe_errors(errors))
+
+def describe_errors(errors):
+    """ファイルごとのエラーを1行のメッセージにする"""
+    return " / ".join(f"{item['index']}番目のファイル（{item['file_url']}）: {item['error']}" for item in errors)
+
+def parse_sources(file_url=None, file_urls=None):
+    """APIの file_url / file_urls を検証し、送信順のURLリストを返す（不正な場合は ValueError）"""
+    if file_urls is None:
+        if not file_url:
+            raise ValueError("file_urlまたはfile_urlsは必須です")
+        return [file_url]
+    if file_url:
+        raise ValueError("file_urlとfile_urlsは同時に指定できません")
+    if isinstance(file_urls, str):
+        # フォーム・クエリ文字列からの指定（JSON配列）
+        try:
+            file_urls = json.loads(file_urls)
+        except ValueError:
+            raise ValueError("file_urlsはURLの配列で指定してください")
+    if not isinstance(file_urls, list) or not file_urls:
+        raise ValueError("file_urlsはURLの配列で指定してください")
+    if len(file_urls) > MAX_SOURCES:
+        raise ValueError(f"file_urlsは{MAX_SOURCES}件までです: {len(file_urls)}件")
+    for i, url in enumerate(file_urls, 1):
+        if not isinstance(url, str) or not url.strip():
+            raise ValueError(f"file_urlsの{i}番目が不正です")
+    return [url.strip() for url in file_urls]
+
+def sources_for(request_data):
+    """ジョブの送信するファイルのURLリスト（単一ファイルのジョブは file_url のみ）"""
+    return request_data.get("file_urls") or [request_data["file_url"]]
+
+def is_multi_source(request_data):
+    return len(request_data.get("file_urls") or ()) > 1
+
+def _source_error(index, file_url, message):
+    return {"index": index + 1, "file_url": file_url, "error": message}
+
+def fetch_sources(file_urls, workspace):
+    """ファイルを並行して取得し、(取得したパスのリスト, エラーのリスト) を返す（失敗したファイルのパスは None）"""
+    def fetch_one(index):
+        path = os.path.join(workspace, f"source_{index + 1:02d}")
+        try:
+            if fetch(file_urls[index], path) == 0:
+                return None, _source_error(index, file_urls[index], "ファイルが空です")
+        except FetchError as e:
+            return None, _source_error(index, file_urls[index], str(e))
+        except Exception as e:
+            return None, _source_error(index, file_urls[index], f"ファイルを取得できません: {e}")
+        return path, None
+
+    # 同時接続数は fetcher 側でもプロセス全体で FETCH_CONCURRENCY までに制限される
+    workers = max(1, min(FETCH_CONCURRENCY, len(file_urls)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor:
+        results = list(executor.map(fetch_one, range(len(file_urls))))
+    return [path for path, _ in results], [error for _, error in results if error]
+
+def _is_pdf(path):
+    with open(path, "rb") as f:
+        return b"%PDF-" in f.read(1024)
+
+def merge_pdfs(pdf_paths, output_path):
+    """PDFを順に結合して output_path に書き出し、ページ数を返す"""
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    streams = []
+    try:
+        for path in pdf_paths:
+            # パスではなくファイルを渡す（パスを渡すと pypdf はファイル全体をメモリに読み込む）
+            stream = open(path, "rb")
+            streams.append(stream)
+            for page in PdfReader(stream).pages:
+                writer.add_page(page)
+        with open(output_path, "wb") as f:
+            writer.write(f)
+    finally:
+        for stream in streams:
+            stream.close()
+    return len(writer.pages)
+
+def build_document(file_urls, workspace, output_path, create_pdf_from_image):
+    """ファイルを取得・検証・変換し、1つの送信用PDF（output_path）を作成する
+
+    戻り値は {"page_count", "source_bytes"}。取得・変換できないファイルがあれば SourceError
+    """
+    paths, errors = fetch_sources(file_urls, workspace)
+    if errors:
+        raise SourceError(errors)
+
+    pdf_paths = []
+    invalid = []
+    for index, path in enumerate(paths):
+        try:
+            if _is_pdf(path):
+                count_pdf_pages(path)
+                pdf_paths.append(path)
+            else:
+                # PDF以外は画像として検証し、A4 PDFに変換（単一ファイルのジョブと同じ変換）
+                verify_image(path)
+                pdf_path = os.path.join(workspace, f"part_{index + 1:02d}.pdf")
+                create_pdf_from_image(path, pdf_path)
+                pdf_paths.append(pdf_path)
+        except InvalidFileError as e:
+            invalid.append(_source_error(index, file_urls[index], str(e)))
+    if invalid:
+        raise SourceError(invalid, invalid=True)
+
+    page_count = merge_pdfs(pdf_paths, output_path)
+    source_bytes = sum(os.path.getsize(path) for path in paths)
+    print(f"[documents] {len(file_urls)}件のファイルを結合しました: {output_path}（{page_count}ページ）")
+    return {"page_count": page_count, "source_bytes": source_bytes}
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信予定時刻の推定
+完了ジョブの実績（ページ数・所要秒数・送信先）から1件あたりの所要時間モデルを作り、
+待機中のジョブをスケジューラーと同じ順序で並べて開始・完了予定時刻を求める
+
+  - モデルは一定時間ごとに直近の実績から作り直す
+  - 予定時刻はキュー全体を一度計算したスナップショットから引く（/status のたびにテーブルを走査しない）
+  - 同じプロセスで追加されたジョブは、スナップショットの末尾に追記して即座に予定時刻を返す
+"""
+
+import os
+import statistics
+import threading
+from datetime import datetime, timedelta
+
+import pacer
+import circuit_breaker
+from scheduler import select_next_job, effective_priority
+from db import get_send_history, get_active_queue
+
+# モデル作成に使う実績の範囲
+HISTORY_DAYS = 30
+HISTORY_LIMIT = 500
+MIN_HISTORY_SAMPLES = 5
+# 実績がない場合の既定値（ダイヤル・ダイアログ操作の固定時間と1ページあたりの時間）
+DEFAULT_SETUP_SECONDS = 40.0
+DEFAULT_SECONDS_PER_PAGE = 30.0
+# 送信先ごとの補正係数を全体平均に寄せる強さ（この件数分の平均的な実績があるものとして扱う）
+DESTINATION_PRIOR_JOBS = 3
+DESTINATION_FACTOR_RANGE = (0.5, 3.0)
+
+# モデル・スナップショットの再作成間隔
+MODEL_TTL_SECONDS = 300
+SNAPSHOT_TTL_SECONDS = 10
+# ワーカーのジョブ間の待機秒数（fax_worker.py の time.sleep(1)）
+WORKER_GAP_SECONDS = 1.0
+# 同時に送信できる回線（ワーカー）数
+FAX_LINES = int(os.environ.get("FAX_LINES", "1"))
+# 推定対象とする待機中ジョブの上限
+MAX_QUEUE_SCAN = 1000
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+# -------------------------------
+# 所要時間モデル
+# -------------------------------
+
+class SendTimeModel:
+    """1件の所要秒数 = (固定時間 + ページ数 × 1ページあたりの時間) × 送信先ごとの補正係数"""
+
+    def __init__(self, setup_seconds=DEFAULT_SETUP_SECONDS, seconds_per_page=DEFAULT_SECONDS_PER_PAGE,
+                 destination_factors=None, default_pages=1, samples=0):
+        self.setup_seconds = setup_seconds
+        self.seconds_per_page = seconds_per_page
+        self.destination_factors = destination_factors or {}
+        self.default_pages = default_pages
+        self.samples = samples
+
+    def base_seconds(self, page_count):
+        pages = page_count or self.default_pages
+        return self.setup_seconds + self.seconds_per_page * pages
+
+    def predict(self, fax_number, page_count):
+        factor = self.destination_factors.get(pacer.normalize_fax_number(fax_number), 1.0)
+        return self.base_seconds(page_count) * factor
+
+    def to_dict(self):
+        return {
+            "setup_seconds": round(self.setup_seconds, 1),
+            "seconds_per_page": round(self.seconds_per_page, 1),
+            "default_pages": self.default_pages,
+            "samples": self.samples,
+            "destinations": len(self.destination_factors),
+        }
+
+def fit_model(history):
+    """送信実績から SendTimeModel を作成（実績が少なければ既定値）"""
+    samples = [(row["fax_number"], row.get("page_count") or 1, float(row["send_seconds"]))
+               for row in history if row.get("send_seconds") is not None]
+    if len(samples) < MIN_HISTORY_SAMPLES:
+        return SendTimeModel(samples=len(samples))
+
+    pages = [p for _, p, _ in samples]
+    seconds = [s for _, _, s in samples]
+    mean_pages = statistics.fmean(pages)
+    mean_seconds = statistics.fmean(seconds)
+
+    # ページ数に対する最小二乗法（ページ数が一様な場合や不自然な傾きは既定の固定時間で按分）
+    var_pages = sum((p - mean_pages) ** 2 for p in pages)
+    per_page = None
+    if var_pages > 0:
+        per_page = sum((p - mean_pages) * (s - mean_seconds) for p, s in zip(pages, seconds)) / var_pages
+        setup = mean_seconds - per_page * mean_pages
+    if per_page is None or per_page <= 0 or setup < 0:
+        setup = min(DEFAULT_SETUP_SECONDS, mean_seconds / 2)
+        per_page = (mean_seconds - setup) / mean_pages
+
+    model = SendTimeModel(setup, per_page, default_pages=max(1, round(statistics.median(pages))),
+                          samples=len(samples))
+
+    # 送信先ごとの補正係数（実績 / 予測 を、件数が少ないほど 1.0 に寄せる）
+    totals = {}
+    for fax_number, page_count, actual in samples:
+        destination = pacer.normalize_fax_number(fax_number)
+        predicted = model.base_seconds(page_count)
+        acc = totals.setdefault(destination, [0.0, 0.0])
+        acc[0] += actual
+        acc[1] += predicted
+    prior = DESTINATION_PRIOR_JOBS * model.base_seconds(model.default_pages)
+    low, high = DESTINATION_FACTOR_RANGE
+    model.destination_factors = {
+        destination: min(high, max(low, (actual + prior) / (predicted + prior)))
+        for destination, (actual, predicted) in totals.items()
+    }
+    return model
+
+# -------------------------------
+# 送信予定時刻
+# -------------------------------
+
+def simulate_queue(queue, model, now, lines=FAX_LINES, pacing_states=None, breaker_states=None):
+    """待機中・処理中のジョブについて開始・完了予定時刻を求める
+
+    処理中のジョブの残り時間を回線の空き時刻とし、待機中のジョブは送信可能になったものから
+    スケジューラーと同じ基準（実効優先度・待ち時間）で順に割り当てる。戻り値は {ID: 予定} と末尾の空き時刻
+    """
+    line_free = [now] * max(1, lines)
+    estimates = {}
+
+    pending = []
+    for row in queue:
+        if row["status"] == 2:
+            started = _parse_datetime(row.get("started_at")) or now
+            finish = max(now, started + timedelta(seconds=model.predict(row["fax_number"], row.get("page_count"))))
+            slot = line_free.index(min(line_free))
+            line_free[slot] = finish + timedelta(seconds=WORKER_GAP_SECONDS)
+            estimates[row["id"]] = {
+                "queue_position": 0,
+                "estimated_start_at": started.isoformat(),
+                "estimated_finish_at": finish.isoformat(),
+                "estimated_wait_seconds": 0,
+            }
+        else:
+            ready_at = _parse_datetime(row.get("next_attempt_at")) or now
+            if pacing_states is not None:
+                blocked_until = pacer.eligible_at(pacing_states, row["fax_number"], now)
+                if blocked_until is not None:
+                    ready_at = max(ready_at, blocked_until)
+            if breaker_states:
+                # 遮断中の宛先は試験送信が可能になるまで送信されない
+                blocked_until = circuit_breaker.blocked_until(breaker_states, row["fax_number"], now)
+                if blocked_until is not None:
+                    ready_at = max(ready_at, blocked_until)
+            pending.append((max(ready_at, now), row))
+
+    position = 0
+    while pending:
+        slot = line_free.index(min(line_free))
+        t = line_free[slot]
+        ready = [item for item in pending if item[0] <= t]
+        if not ready:
+            t = min(item[0] for item in pending)
+            ready = [item for item in pending if item[0] <= t]
+        chosen = select_next_job([row for _, row in ready], t)
+        pending = [item for item in pending if item[1] is not chosen]
+
+        position += 1
+        duration = model.predict(chosen["fax_number"], chosen.get("page_count"))
+        finish = t + timedelta(seconds=duration)
+        line_free[slot] = finish + timedelta(seconds=WORKER_GAP_SECONDS)
+        estimates[chosen["id"]] = {
+            "queue_position": position,
+            "estimated_start_at": t.isoformat(),
+            "estimated_finish_at": finish.isoformat(),
+            "estimated_wait_seconds": round((t - now).total_seconds()),
+        }
+    return estimates, max(line_free), position
+
+class EtaEstimator:
+    """送信予定時刻のスナップショットを保持し、IDごとの予定を返す"""
+
+    def __init__(self, clock=datetime.now):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_at = None
+        self._estimates = {}
+        self._snapshot_at = None
+        self._tail_free_at = None
+        self._tail_position = 0
+        self._min_priority = None
+
+    def model(self):
+        """所要時間モデル（MODEL_TTL_SECONDS ごとに実績から作り直す）"""
+        now = self._clock()
+        if self._model is None or (now - self._model_at).total_seconds() >= MODEL_TTL_SECONDS:
+            history = get_send_history(now - timedelta(days=HISTORY_DAYS), HISTORY_LIMIT)
+            self._model = fit_model(history)
+            self._model_at = now
+        return self._model
+
+    def _refresh_if_stale(self):
+        now = self._clock()
+        if self._snapshot_at is not None and (now - self._snapshot_at).total_seconds() < SNAPSHOT_TTL_SECONDS:
+            return
+        model = self.model()
+        queue = get_active_queue(MAX_QUEUE_SCAN)
+        states = pacer.load_pacing_states(now)
+        breakers = circuit_breaker.load_breaker_states()
+        self._estimates, self._tail_free_at, self._tail_position = simulate_queue(
+            queue, model, now, pacing_states=states, breaker_states=breakers)
+        pending = [row for row in queue if row["status"] == 0]
+        self._min_priority = min((effective_priority(row, now) for row in pending), default=None)
+        self._snapshot_at = now
+
+    def estimate(self, request_id):
+        """ジョブの開始・完了予定（待機中・処理中でなければ None）"""
+        with self._lock:
+            self._refresh_if_stale()
+            return self._estimates.get(request_id)
+
+    def estimates(self):
+        """全ジョブの予定（一覧表示用）"""
+        with self._lock:
+            self._refresh_if_stale()
+            return dict(self._estimates)
+
+    def on_job_added(self, request_data):
+        """新しいジョブをスナップショットの末尾に追記（他のジョブを追い越す優先度なら次回に再計算）"""
+        with self._lock:
+            if self._snapshot_at is None:
+                return
+            now = self._clock()
+            priority = effective_priority(request_data, now)
+            if self._min_priority is not None and priority > self._min_priority:
+                self._snapshot_at = None
+                return
+            start = max(now, self._tail_free_at or now)
+            duration = self.model().predict(request_data["fax_number"], request_data.get("page_count"))
+            finish = start + timedelta(seconds=duration)
+            self._tail_position += 1
+            self._tail_free_at = finish + timedelta(seconds=WORKER_GAP_SECONDS)
+            self._min_priority = priority if self._min_priority is None else min(self._min_priority, priority)
+            self._estimates[request_data["id"]] = {
+                "queue_position": self._tail_position,
+                "estimated_start_at": start.isoformat(),
+                "estimated_finish_at": finish.isoformat(),
+                "estimated_wait_seconds": round((start - now).total_seconds()),
+            }
+
+    def invalidate(self):
+        """次回の参照時にスナップショットを作り直す"""
+        with self._lock:
+            self._snapshot_at = None
+
+ESTIMATOR = EtaEstimator()
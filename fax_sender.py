@@ -6,105 +6,136 @@ FAX送信処理モジュール
 
 import os
 import time
-import win32api
-import pyautogui
-import pygetwindow as gw
 from datetime import datetime
+from window_watcher import wait_for_window, wait_for_active, get_default_provider
+import tuning
 
-# FAX送信設定
-PRINTER_NAME = "FX 5570 FAX Driver"
+# 話中（相手先回線ビジー）を示すダイアログタイトルのキーワード
+LINE_BUSY_KEYWORDS = ["話中", "ビジー", "Busy"]
+# 送信先側の理由（番号違い・応答なしなど）で送れなかったことを示すエラーダイアログのタイトルのキーワード
+# 「警告」ダイアログは毎回の送信で表示される確認（OKで閉じると送信が続く）のため含めない。
+# 実機のドライバーで表示を確認したタイトルだけを追加すること（現時点で確認済みのものはない）
+DESTINATION_ERROR_KEYWORDS = []
 
-def send_fax(pdf_path, fax_number):
-    """FAX送信を実行"""
-    try:
-        print(f"FAX送信開始: {pdf_path} -> {fax_number}")
-        
-        # FAX送信ダイアログを開く
-        win32api.ShellExecute(0, "printto", pdf_path, f'"{PRINTER_NAME}"', ".", 1)
-        print("FAXダイアログを起動中...")
-
-        # ダイアログが開くまで待機
-        fax_window = None
-        for i in range(30):  # 最大30秒待機
-            time.sleep(1)
-            titles = [t for t in gw.getAllTitles() if "ファクス送信" in t]
-            if titles:
-                fax_window = gw.getWindowsWithTitle(titles[0])[0]
-                print(f"FAXダイアログ検出: {titles[0]}")
-                break
-            print(f"FAXダイアログ待機中... ({i+1}/30)")
-        else:
-            raise RuntimeError("FAXダイアログが見つかりませんでした。")
+# プリンター名・ステップごとのタイムアウト・キー入力の間隔は tuning.json で調整する（tuning.SETTINGS）
 
-        # ウィンドウを確実にアクティブ化
-        print("FAXダイアログをアクティブ化中...")
-        fax_window.activate()
-        time.sleep(1.0)
-        
-        # ウィンドウが最前面に来るまで確認
-        for attempt in range(5):
-            if fax_window.isActive:
-                print("FAXダイアログがアクティブになりました")
-                break
-            else:
-                print(f"アクティブ化再試行 {attempt + 1}/5")
-                fax_window.activate()
-                time.sleep(0.5)
-        else:
-            print("⚠ ウィンドウのアクティブ化に失敗しましたが、続行します")
-
-        # 宛先番号入力（より確実に）
-        print(f"宛先番号 {fax_number} を入力中...")
-        pyautogui.click(fax_window.left + 100, fax_window.top + 100)  # ダイアログ内をクリック
-        time.sleep(0.3)
-        pyautogui.typewrite(fax_number, interval=0.1)  # より遅い入力
-        print(f"宛先番号 {fax_number} を入力しました。")
-
-        # 以下一時的にコメント
-        time.sleep(0.8)
-
-        # TABキーを9回押して「送信開始」ボタンにフォーカス
-        print("送信開始ボタンにフォーカス移動中...")
-        pyautogui.press("tab", presses=9, interval=0.2)  # より遅い間隔
-        print("Tabキーを9回送信しました。")
-
-        time.sleep(0.5)
-
-        # Enterで送信開始
-        print("送信開始ボタンを押下中...")
-        pyautogui.press("enter")
-        print("『送信開始』を押下しました。")
-
-        # 警告ウィンドウ処理（より確実に）
-        print("警告ダイアログをチェック中...")
-        for i in range(15):  # より長い待機時間
-            time.sleep(0.5)
-            warnings = [t for t in gw.getAllTitles() if "警告" in t]
-            if warnings:
-                w = gw.getWindowsWithTitle(warnings[0])[0]
-                print(f"警告ダイアログ検出: {warnings[0]}")
-                w.activate()
-                time.sleep(0.5)
-                pyautogui.press("enter")
-                print("警告ダイアログの『OK』を押しました。")
-                break
-            print(f"警告ダイアログ待機中... ({i+1}/15)")
-        else:
-            print("⚠ 警告ダイアログは検出されませんでした。")
+class LineBusyError(RuntimeError):
+    """相手先が話中のため送信できなかった"""
 
-        print("FAX送信処理が完了しました")
-        return True
+class DialogNotFoundError(RuntimeError):
+    """FAX送信ダイアログが表示されなかった"""
 
+class DestinationWarningError(RuntimeError):
+    """送信開始後にドライバーがエラーダイアログ（DESTINATION_ERROR_KEYWORDS）を表示した（送信先側の理由で送れなかった）"""
+
+def send_fax(pdf_path, fax_number):
+    """FAX送信を実行"""
+    try:
+        return send_fax_attempt(pdf_path, fax_number)
     except Exception as e:
         print(f"FAX送信エラー: {e}")
         return False
 
+def open_fax_dialog(pdf_path):
+    """FAXドライバーへの印刷を開始し、FAX送信ダイアログを開く"""
+    import win32api
+    win32api.ShellExecute(0, "printto", pdf_path, f'"{tuning.get("printer_name")}"', ".", 1)
+
+def send_fax_attempt(pdf_path, fax_number, provider=None, keyboard=None, launcher=open_fax_dialog):
+    """FAX送信を1回実行
+
+    失敗時は例外を送出する（話中は LineBusyError、送信先のエラーダイアログは DestinationWarningError、
+    ダイアログ未検出は DialogNotFoundError）。毎回表示される「警告」ダイアログはOKで閉じて送信を続ける。
+    provider / keyboard / launcher を差し替えると、Windows以外でも動作確認できる
+    """
+    provider = provider or get_default_provider()
+    if keyboard is None:
+        import pyautogui as keyboard
+    # 1回の送信の途中で設定が読み直されても、同じ値で操作する
+    settings = tuning.current()
+
+    print(f"FAX送信開始: {pdf_path} -> {fax_number}")
+    started = time.monotonic()
+
+    # FAX送信ダイアログを開く
+    launcher(pdf_path)
+    print("FAXダイアログを起動中...")
+
+    # ダイアログが開くまで待機（短い間隔から徐々に広げてポーリング）
+    title, fax_window = wait_for_window(["ファクス送信"], settings["dialog_timeout_seconds"], provider)
+    if fax_window is None:
+        raise DialogNotFoundError("FAXダイアログが見つかりませんでした。")
+    print(f"FAXダイアログ検出: {title} ({time.monotonic() - started:.2f}秒)")
+
+    # ウィンドウを確実にアクティブ化
+    print("FAXダイアログをアクティブ化中...")
+    if wait_for_active(fax_window, settings["activate_timeout_seconds"]):
+        print("FAXダイアログがアクティブになりました")
+    else:
+        print("⚠ ウィンドウのアクティブ化に失敗しましたが、続行します")
+
+    # 宛先番号入力
+    print(f"宛先番号 {fax_number} を入力中...")
+    keyboard.click(fax_window.left + 100, fax_window.top + 100)  # ダイアログ内をクリック
+    time.sleep(settings["input_settle_seconds"])
+    keyboard.typewrite(fax_number, interval=settings["type_interval_seconds"])
+    print(f"宛先番号 {fax_number} を入力しました。")
+    time.sleep(settings["input_settle_seconds"])
+
+    # TABキーで「送信開始」ボタンにフォーカス
+    print("送信開始ボタンにフォーカス移動中...")
+    keyboard.press("tab", presses=settings["tab_presses"], interval=settings["tab_interval_seconds"])
+    print(f"Tabキーを{settings['tab_presses']}回送信しました。")
+    time.sleep(settings["input_settle_seconds"])
+
+    # Enterで送信開始
+    print("送信開始ボタンを押下中...")
+    keyboard.press("enter")
+    print("『送信開始』を押下しました。")
+
+    # 警告・話中ダイアログ処理
+    print("警告ダイアログをチェック中...")
+    title, dialog = wait_for_window(["警告"] + LINE_BUSY_KEYWORDS + DESTINATION_ERROR_KEYWORDS,
+                                    settings["warning_timeout_seconds"], provider)
+    if dialog is not None:
+        is_busy = any(k in title for k in LINE_BUSY_KEYWORDS)
+        is_error = any(k in title for k in DESTINATION_ERROR_KEYWORDS)
+        print(f"{'話中' if is_busy else 'エラー' if is_error else '警告'}ダイアログ検出: {title}")
+        wait_for_active(dialog, settings["activate_timeout_seconds"])
+        keyboard.press("enter")
+        if is_busy:
+            raise LineBusyError(f"相手先が話中です: {fax_number}")
+        if is_error:
+            raise DestinationWarningError(f"送信先についてエラーが表示されました（{title}）: {fax_number}")
+        print("警告ダイアログの『OK』を押しました。")
+    else:
+        print("⚠ 警告ダイアログは検出されませんでした。")
+
+    print(f"FAX送信処理が完了しました ({time.monotonic() - started:.2f}秒)")
+    return True
+
 def send_fax_with_retry(pdf_path, fax_number, max_retries=3):
-    """FAX送信をリトライ機能付きで実行"""
+    """FAX送信をリトライ機能付きで実行（手動テスト用。ワーカーは send_fax_attempt と retry_policy で再送する）
+
+    話中・送信先のエラーの場合は同じ番号へすぐ再試行しても回線を占有するだけなので、
+    LineBusyError / DestinationWarningError をそのまま呼び出し元へ送出する
+    """
     for attempt in range(max_retries):
         print(f"FAX送信試行 {attempt + 1}/{max_retries}")
         
-        if send_fax(pdf_path, fax_number):
+        try:
+            success = send_fax_attempt(pdf_path, fax_number)
+        except LineBusyError:
+            print(f"FAX送信中断（話中）: {fax_number}")
+            raise
+        except DestinationWarningError:
+            print(f"FAX送信中断（送信先のエラー）: {fax_number}")
+            raise
+        except Exception as e:
+            print(f"FAX送信エラー: {e}")
+            success = False
+
+        if success:
             print(f"FAX送信成功: {fax_number}")
             return True
         else:
@@ -137,7 +168,11 @@ if __name__ == "__main__":
     
     if os.path.exists(test_pdf):
         print("FAX送信テストを開始...")
-        success = send_fax_with_retry(test_pdf, test_fax_number)
+        try:
+            success = send_fax_with_retry(test_pdf, test_fax_number)
+        except (LineBusyError, DestinationWarningError) as e:
+            print(f"FAX送信テスト中断: {e}")
+            success = False
         if success:
             print("✅ FAX送信テスト成功")
         else:
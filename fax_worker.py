@@ -11,18 +11,34 @@ import time
 import threading
 import uuid
 from datetime import datetime
-from fax_sender import send_fax_with_retry, cleanup_temp_files
+from fax_sender import (send_fax_attempt, cleanup_temp_files, LineBusyError, DialogNotFoundError,
+                        DestinationWarningError)
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 from PIL import Image
-import requests
 import shutil
-from db import (load_parameters, add_fax_request, update_request_status,
-                update_request_converted_pdf, send_callback_notification)
+from workspace import (create_job_workspace, schedule_cleanup, sweep_stale_workspaces,
+                       wait_for_cleanup)
+from scheduler import claim_next_job, lane_name
+from fetcher import download_file
+import pacer
+import circuit_breaker
+import retry_policy
+import tuning
+from lease import job_lease, reap_expired, WORKER_ID
+from preprocess import prepared_pdf_for, count_pdf_pages, ERROR_INVALID_FILE
+from documents import build_document, is_multi_source, SourceError
+from cover_page import prepend_cover, COVER_PAGE_ENABLED
+from retry_policy import (ERROR_DOWNLOAD_FAILED, ERROR_DIALOG_NOT_FOUND, ERROR_LINE_BUSY,
+                          ERROR_DESTINATION_WARNING, ERROR_SEND_FAILED)
+from db import (add_fax_request, update_request_status,
+                update_request_converted_pdf, send_callback_notification, schedule_retry,
+                record_send_metrics, update_source_errors)
 
 # 設定
 CONVERTED_PDF_FOLDER = "converted_pdfs"
+# ジョブ間の待機秒数・送信保留中のジョブだけが残っている場合の最大待機秒数は tuning.json で調整する
 
 # フォルダを作成
 if not os.path.exists(CONVERTED_PDF_FOLDER):
@@ -36,33 +52,9 @@ fax_lock = threading.Lock()
 # -------------------------------
 
 # -------------------------------
-# ファイル処理
+# ファイル処理（取得は fetcher.download_file）
 # -------------------------------
 
-def download_file(file_url, local_path):
-    """ファイルをダウンロードまたはローカルコピー"""
-    try:
-        if file_url.startswith('file://'):
-            local_file_path = file_url[7:]
-            if local_file_path.startswith('/'):
-                local_file_path = local_file_path[1:]
-            if not os.path.exists(local_file_path):
-                print(f"ローカルファイルが見つかりません: {local_file_path}")
-                return False
-            shutil.copy2(local_file_path, local_path)
-            print(f"ローカルファイルをコピーしました: {local_file_path} -> {local_path}")
-            return True
-        else:
-            response = requests.get(file_url)
-            response.raise_for_status()
-            with open(local_path, "wb") as f:
-                f.write(response.content)
-            print(f"リモートファイルをダウンロードしました: {file_url}")
-            return True
-    except Exception as e:
-        print(f"ファイル処理エラー: {e}")
-        return False
-
 # -------------------------------
 # PDF作成処理
 # -------------------------------
@@ -112,78 +104,172 @@ def create_pdf_from_image(image_path, output_pdf_path):
 # FAX送信処理
 # -------------------------------
 
+def handle_send_failure(request_data, error_class, error_msg):
+    """失敗したジョブを再送待ちに戻すか、試行回数を使い切っていればエラーにする
+
+    回線を塞がないよう、ここでは待機せず next_attempt_at を記録するだけ。
+    リースを失っていた（回収され他のワーカーが取得し直した）場合は何も記録せず False を返す
+    """
+    request_id = request_data["id"]
+    attempt_count = request_data.get("attempt_count") or 1
+    if retry_policy.should_retry(error_class, attempt_count):
+        next_at = retry_policy.next_attempt_at(error_class, attempt_count)
+        if not schedule_retry(request_id, error_class, next_at,
+                              f"{error_msg}（{attempt_count}回目失敗、{next_at.strftime('%H:%M:%S')} 以降に再送）",
+                              WORKER_ID):
+            return False
+        print(f"🔁 再送予約: ID={request_id}, 種別={error_class}, 次回={next_at.isoformat()}")
+    else:
+        if not update_request_status(request_id, -1, f"{error_msg}（{attempt_count}回試行）", error_class,
+                                     WORKER_ID):
+            return False
+        print(f"FAX送信最終失敗: ID={request_id}, 種別={error_class}（{attempt_count}回試行）")
+    return True
+
+def record_job_metrics(request_data, send_path, elapsed_seconds):
+    """送信実績（所要秒数・ページ数・サイズ）を記録（送信予定時刻の推定に使用）"""
+    page_count = request_data.get("page_count")
+    if page_count is None:
+        try:
+            page_count = count_pdf_pages(send_path)
+        except Exception as e:
+            print(f"ページ数の取得に失敗: {e}")
+    source_bytes = request_data.get("source_bytes")
+    if source_bytes is None and os.path.exists(send_path):
+        source_bytes = os.path.getsize(send_path)
+    record_send_metrics(request_data["id"], round(elapsed_seconds, 2), page_count, source_bytes)
+
 def process_single_fax_request(request_data):
     """単一のFAX送信リクエストを処理"""
     request_id = request_data["id"]
     file_url = request_data["file_url"]
     fax_number = request_data["fax_number"]
     print(f"FAX送信処理開始: ID={request_id}, FAX番号={fax_number}")
+    started = time.monotonic()
+
+    # ジョブ専用の作業ディレクトリ（同時刻に開始したジョブとも衝突しない）
+    workspace = create_job_workspace(request_id)
 
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        local_file_path = f"temp_fax_{timestamp}"
-
-        # 元ファイルをダウンロード
-        temp_ext = ".pdf" if file_url.lower().endswith(".pdf") else ".tmp"
-        temp_path = local_file_path + temp_ext
-        if not download_file(file_url, temp_path):
-            update_request_status(request_id, -1, f"ファイル取得に失敗: {file_url}")
-            return False
+        prepared_pdf_path = prepared_pdf_for(request_data)
+        if prepared_pdf_path:
+            # APIサーバーが受付時に取得・検証・変換済み（ドライバーが掴んでも影響しないよう作業ディレクトリにコピー）
+            send_path = os.path.join(workspace, "send.pdf")
+            shutil.copy2(prepared_pdf_path, send_path)
+            print(f"事前処理済みのPDFを送信します: {prepared_pdf_path}（{request_data.get('page_count')}ページ）")
+        elif is_multi_source(request_data):
+            # 複数ファイルのジョブ：並行して取得し、1つのPDFに結合して1回のFAXで送る
+            send_path = os.path.join(workspace, "send.pdf")
+            try:
+                result = build_document(request_data["file_urls"], workspace, send_path, create_pdf_from_image)
+            except SourceError as e:
+                update_source_errors(request_id, e.errors)
+                if e.invalid:
+                    circuit_breaker.record_result(fax_number, False, ERROR_INVALID_FILE)
+                    update_request_status(request_id, -1, f"送信できないファイルがあります: {e}", ERROR_INVALID_FILE,
+                                          WORKER_ID)
+                    return False
+                circuit_breaker.record_result(fax_number, False, ERROR_DOWNLOAD_FAILED)
+                handle_send_failure(request_data, ERROR_DOWNLOAD_FAILED, f"ファイル取得に失敗: {e}")
+                return False
+            if request_data.get("source_errors"):
+                update_source_errors(request_id, None)
+            request_data.update(result)
+
+            # 結合したPDFを変換後PDFとして保存（画面から確認できるようにする）
+            merged_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, f"merged_{request_id}.pdf")
+            shutil.copy2(send_path, merged_pdf_path)
+            update_request_converted_pdf(request_id, os.path.abspath(merged_pdf_path))
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+            # 元ファイルをダウンロード
+            temp_ext = ".pdf" if file_url.lower().endswith(".pdf") else ".tmp"
+            temp_path = os.path.join(workspace, "source" + temp_ext)
+            if not download_file(file_url, temp_path):
+                # 試験送信のジョブだった場合は宛先を確認できていないため、試験送信の権利を戻す
+                circuit_breaker.record_result(fax_number, False, ERROR_DOWNLOAD_FAILED)
+                handle_send_failure(request_data, ERROR_DOWNLOAD_FAILED, f"ファイル取得に失敗: {file_url}")
+                return False
 
-        # 🟡 PDF以外の場合はPDFに変換
-        if not file_url.lower().endswith(".pdf"):
-            # 永続フォルダに変換されたPDFを保存
-            persistent_pdf_name = f"converted_{request_id}_{timestamp}.pdf"
-            persistent_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, persistent_pdf_name)
+            # 🟡 PDF以外の場合はPDFに変換
+            if not file_url.lower().endswith(".pdf"):
+                # 永続フォルダに変換されたPDFを保存
+                persistent_pdf_name = f"converted_{request_id}_{timestamp}.pdf"
+                persistent_pdf_path = os.path.join(CONVERTED_PDF_FOLDER, persistent_pdf_name)
             
-            # 一時PDFを作成
-            temp_pdf_path = local_file_path + ".pdf"
-            create_pdf_from_image(temp_path, temp_pdf_path)
-            os.remove(temp_path)
+                # 一時PDFを作成
+                temp_pdf_path = os.path.join(workspace, "send.pdf")
+                create_pdf_from_image(temp_path, temp_pdf_path)
             
-            # 永続フォルダにコピー
-            shutil.copy2(temp_pdf_path, persistent_pdf_path)
+                # 永続フォルダにコピー
+                shutil.copy2(temp_pdf_path, persistent_pdf_path)
             
-            send_path = temp_pdf_path
+                send_path = temp_pdf_path
             
-            # 変換後のPDFファイルパスを保存
-            update_request_converted_pdf(request_id, os.path.abspath(persistent_pdf_path))
-        else:
-            send_path = temp_path
-
-        # FAX送信実行
-        if send_fax_with_retry(os.path.abspath(send_path), fax_number):
-            update_request_status(request_id, 1)
-            print(f"FAX送信完了: ID={request_id}")
-            # コールバック通知を送信（成功時のみ）
-            send_callback_notification(request_data)
-            return True
-        else:
-            error_msg = "FAX送信に失敗しました"
-            update_request_status(request_id, -1, error_msg)
-            print(f"FAX送信失敗: ID={request_id}")
+                # 変換後のPDFファイルパスを保存
+                update_request_converted_pdf(request_id, os.path.abspath(persistent_pdf_path))
+            else:
+                send_path = temp_path
+
+        # 送付状を先頭に付ける（作成に失敗しても本文は送信する）
+        body_path = send_path
+        if COVER_PAGE_ENABLED:
+            try:
+                cover_path = os.path.join(workspace, "send_with_cover.pdf")
+                prepend_cover(body_path, cover_path, request_data, request_data.get("page_count"))
+                send_path = cover_path
+            except Exception as e:
+                print(f"⚠ 送付状の作成に失敗したため、送付状なしで送信します: {e}")
+
+        # FAX送信実行（1回のみ。失敗時の再試行は next_attempt_at で再スケジュール）
+        try:
+            send_fax_attempt(os.path.abspath(send_path), fax_number)
+        except LineBusyError as e:
+            # 話中の番号は後回しにし、回線は他の宛先の送信に使う
+            pacer.record_busy(fax_number)
+            circuit_breaker.record_result(fax_number, False, ERROR_LINE_BUSY, str(e))
+            handle_send_failure(request_data, ERROR_LINE_BUSY, str(e))
+            return False
+        except DestinationWarningError as e:
+            # 送信先のエラーダイアログ（番号違い・解約済みなど）が続く宛先は遮断し、同じ宛先のジョブで回線を使わない
+            pacer.record_result(fax_number, False)
+            circuit_breaker.record_result(fax_number, False, ERROR_DESTINATION_WARNING, str(e))
+            handle_send_failure(request_data, ERROR_DESTINATION_WARNING, str(e))
             return False
+        except DialogNotFoundError as e:
+            pacer.record_result(fax_number, False)
+            circuit_breaker.record_result(fax_number, False, ERROR_DIALOG_NOT_FOUND, str(e))
+            handle_send_failure(request_data, ERROR_DIALOG_NOT_FOUND, str(e))
+            return False
+        except Exception as e:
+            # 番号違い・解約済みなどで失敗が続く宛先は遮断し、同じ宛先のジョブで回線を使わない
+            pacer.record_result(fax_number, False)
+            circuit_breaker.record_result(fax_number, False, ERROR_SEND_FAILED, str(e))
+            raise
+
+        pacer.record_result(fax_number, True)
+        circuit_breaker.record_result(fax_number, True)
+        # 実績を先に記録し、完了時に送信先別の日次集計へ所要秒数・ページ数を加算できるようにする
+        record_job_metrics(request_data, body_path, time.monotonic() - started)
+        if not update_request_status(request_id, 1, lease_owner=WORKER_ID):
+            # 送信中にリースが切れて他のワーカーが取得し直した（二重に完了・通知しない）
+            print(f"⚠ リースを失ったため完了を記録しません: ID={request_id}")
+            return False
+        print(f"FAX送信完了: ID={request_id}")
+        # コールバック通知を送信（成功時のみ）
+        send_callback_notification(request_data)
+        return True
 
     except Exception as e:
         error_msg = str(e)
-        update_request_status(request_id, -1, error_msg)
+        handle_send_failure(request_data, ERROR_SEND_FAILED, error_msg)
         print(f"FAX送信処理エラー: {e}")
         return False
 
     finally:
-        # FAXドライバーがファイルを使用中の場合があるため、削除をリトライ
-        for f in [local_file_path + ".pdf", local_file_path + ".tmp"]:
-            if os.path.exists(f):
-                for retry in range(5):
-                    try:
-                        os.remove(f)
-                        print(f"一時ファイルを削除: {f}")
-                        break
-                    except PermissionError:
-                        print(f"⚠ ファイル使用中のため削除保留: {f} (試行 {retry+1}/5)")
-                        time.sleep(2)
-                else:
-                    print(f"⚠ ファイル削除失敗（使用中の可能性あり）: {f}")
+        # FAXドライバーがファイルを使用中の場合があるため、削除はジャニターに任せる（次のジョブをブロックしない）
+        schedule_cleanup(workspace)
 
 # -------------------------------
 # ワーカースレッド
@@ -193,33 +279,39 @@ def fax_worker():
     """FAX送信ワーカー（タスクスケジューラー用：未処理データをすべて処理して終了）"""
     print("FAX送信ワーカー開始（未処理データをすべて処理）")
 
+    # 前回の実行で残った作業ディレクトリを回収
+    sweep_stale_workspaces()
+    print(f"ワーカーID: {WORKER_ID}")
+    print(f"調整値ファイル: {tuning.TUNING_FILE}（更新すると次のジョブから反映）")
+
     processed_count = 0
     error_count = 0
 
     while True:
         try:
-            params_list = load_parameters()
-            if not isinstance(params_list, list):
-                print("パラメータデータの読み込みに失敗しました")
-                break
-
-            # 待機中のリクエストを取得し、作成日時でソート（古い順）
-            pending = [p for p in params_list if p.get("status") == 0]
-            if not pending:
+            # 落ちたワーカー・固まったGUIが残した処理中ジョブを待機中に戻す
+            reap_expired()
+
+            # 優先度レーン＋エイジングで次のジョブを選択し、処理中に遷移
+            request_data, retry_after = claim_next_job()
+            if request_data is None:
+                if retry_after is not None and retry_after <= tuning.get("worker_max_idle_wait_seconds"):
+                    # 送信保留中の宛先しか残っていない場合は、送信可能になるまで待機
+                    print(f"⏳ 送信保留中のジョブのみのため {retry_after:.0f}秒待機します")
+                    time.sleep(max(1.0, retry_after))
+                    continue
+                if retry_after is not None:
+                    print(f"送信保留中のジョブは次回起動時に処理します（{retry_after:.0f}秒後に送信可能）")
                 # 未処理データがない場合は終了
                 print(f"すべてのFAX送信処理が完了しました（処理件数: {processed_count}, エラー件数: {error_count}）")
                 break
 
-            # created_atでソートして一番古いデータを取得
-            pending_sorted = sorted(pending, key=lambda x: x.get("created_at", ""))
-            request_data = pending_sorted[0]  # 一番古いデータ
             request_id = request_data["id"]
+            print(f"📋 処理対象を取得: ID={request_id}, 優先度={lane_name(request_data.get('priority'))}, "
+                  f"作成日時={request_data.get('created_at')}")
 
-            print(f"📋 処理対象を取得: ID={request_id}, 作成日時={request_data.get('created_at')}")
-            update_request_status(request_id, 2, "処理中")
-
-            # 🔒 ロックでワーカー全体を排他制御
-            with fax_lock:
+            # 🔒 ロックでワーカー全体を排他制御し、処理中はリースを延長し続ける
+            with fax_lock, job_lease(request_id):
                 success = process_single_fax_request(request_data)
 
             if success:
@@ -229,13 +321,16 @@ def fax_worker():
                 error_count += 1
                 print(f"❌ 処理失敗: ID={request_id}（累計エラー: {error_count}件）")
 
-            time.sleep(1)  # 次の処理まで1秒待機
+            time.sleep(tuning.get("worker_poll_interval_seconds"))  # 次の処理まで待機
 
         except Exception as e:
             error_count += 1
             print(f"FAXワーカーエラー: {e}")
             print(f"処理を継続します（累計エラー: {error_count}件）")
-            time.sleep(1)
+            time.sleep(tuning.get("worker_poll_interval_seconds"))
+
+    # 予約済みの作業ディレクトリ削除を待ってから終了
+    wait_for_cleanup(timeout=60)
 
     print(f"FAX送信ワーカー終了（総処理件数: {processed_count + error_count}, 成功: {processed_count}, エラー: {error_count}）")
 
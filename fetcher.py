@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信ファイルの取得（APIサーバー・ワーカー共通）
+
+  - 取得元ホストごとに requests.Session を使い回し、接続をキープアライブで再利用する
+  - 接続・読み込みにタイムアウトを設け、応答しないサーバーでワーカーが止まらないようにする
+  - 本文はチャンクごとにディスクへ書き込み（メモリに全体を読み込まない）、上限サイズを超えたら中断する
+  - 同時に取得する数を FETCH_CONCURRENCY までに制限する（事前処理・複数ファイルの並行取得の合計）
+"""
+
+import os
+import shutil
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tuning
+
+# 同時に取得する最大数（プロセス全体。接続プールの大きさに使うため起動時に決める）
+FETCH_CONCURRENCY = tuning.env_int("FAX_FETCH_WORKERS", 4)
+# 接続・読み込み・全体のタイムアウトと上限サイズは tuning.json で調整する（fetch_connect_timeout_seconds /
+# fetch_read_timeout_seconds / fetch_total_timeout_seconds / fetch_max_bytes。従来の環境変数も既定値として使える）
+FETCH_CHUNK_BYTES = 64 * 1024
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_fetch_slots = threading.BoundedSemaphore(FETCH_CONCURRENCY)
+
+class FetchError(Exception):
+    """ファイルを取得できなかった"""
+
+def local_path_from_url(file_url):
+    """file:// URL をローカルパスに変換（ローカルファイルでなければ None）"""
+    if not file_url.startswith('file://'):
+        return None
+    local_file_path = file_url[7:]
+    if local_file_path.startswith('/'):
+        local_file_path = local_file_path[1:]
+    return local_file_path
+
+def _session_for(file_url):
+    """取得元ホストごとのセッション（接続プールはホストあたり FETCH_CONCURRENCY 本まで）"""
+    parts = urlsplit(file_url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_CONCURRENCY)
+            session.mount(f"{parts.scheme}://", adapter)
+            _sessions[key] = session
+        return session
+
+def _download(file_url, local_path):
+    """リモートのファイルを local_path に書き込み、バイト数を返す"""
+    started = time.monotonic()
+    # 1回の取得の途中で設定が読み直されても、同じ値で判定する
+    settings = tuning.current()
+    max_bytes = settings["fetch_max_bytes"]
+    total_timeout = settings["fetch_total_timeout_seconds"]
+    response = _session_for(file_url).get(
+        file_url, stream=True,
+        timeout=(settings["fetch_connect_timeout_seconds"], settings["fetch_read_timeout_seconds"]))
+    with response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise FetchError(f"ファイルサイズが上限（{max_bytes} バイト）を超えています: {length} バイト")
+
+        temp_path = local_path + ".part"
+        received = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(FETCH_CHUNK_BYTES):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise FetchError(f"ファイルサイズが上限（{max_bytes} バイト）を超えています")
+                    if time.monotonic() - started > total_timeout:
+                        raise FetchError(f"{total_timeout:.0f}秒以内に取得が終わりませんでした")
+                    f.write(chunk)
+            os.replace(temp_path, local_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return received
+
+def fetch(file_url, local_path):
+    """ファイルをダウンロードまたはローカルコピーし、バイト数を返す（失敗した場合は FetchError）"""
+    local_file_path = local_path_from_url(file_url)
+    if local_file_path is not None:
+        if not os.path.exists(local_file_path):
+            raise FetchError(f"ローカルファイルが見つかりません: {local_file_path}")
+        shutil.copy2(local_file_path, local_path)
+        print(f"ローカルファイルをコピーしました: {local_file_path} -> {local_path}")
+        return os.path.getsize(local_path)
+
+    started = time.monotonic()
+    with _fetch_slots:
+        try:
+            received = _download(file_url, local_path)
+        except requests.RequestException as e:
+            # 本文の読み込み中のタイムアウトは ConnectionError として送出される
+            if isinstance(e, requests.Timeout) or "timed out" in str(e):
+                raise FetchError(f"取得元が応答しません（タイムアウト）: {file_url}")
+            raise FetchError(f"取得に失敗: {e}")
+    elapsed = time.monotonic() - started
+    print(f"リモートファイルをダウンロードしました: {file_url}（{received}バイト, {elapsed:.2f}秒）")
+    return received
+
+def download_file(file_url, local_path):
+    """ファイルをダウンロードまたはローカルコピー（成功したら True）"""
+    try:
+        fetch(file_url, local_path)
+        return True
+    except Exception as e:
+        print(f"ファイル処理エラー: {e}")
+        return False
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 設定（Linux 用）
+  gunicorn -c gunicorn.conf.py wsgi:application
+
+  kill -HUP <masterのpid>   新しいワーカーを起動してから古いワーカーを順に終了（グレースフルリロード）
+  kill -TERM <masterのpid>  処理中のリクエストを graceful_timeout 秒まで待って終了
+"""
+
+import os
+
+_host = os.environ.get("FAX_API_HOST", "0.0.0.0")
+_port = os.environ.get("FAX_API_PORT", "5000")
+
+bind = f"{_host}:{_port}"
+workers = int(os.environ.get("FAX_API_WORKERS", str(os.cpu_count() or 1)))
+threads = int(os.environ.get("FAX_API_THREADS", "8"))
+worker_class = "gthread"
+
+# アップロード・ファイル変換を含むリクエストがあるため長めに設定
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# メモリ肥大化対策として一定リクエストごとにワーカーを入れ替える
+max_requests = 2000
+max_requests_jitter = 200
+
+# アプリはワーカーごとに読み込む（DB接続・キャッシュをプロセス間で共有しない）
+preload_app = False
+
+def post_worker_init(worker):
+    """各ワーカープロセスの初期化（DB接続の確立）"""
+    from app import init_worker
+    init_worker()
+
+def worker_exit(server, worker):
+    """ワーカー終了時にDB接続を閉じる"""
+    from db import close_connection
+    close_connection()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信履歴の一括取り込み（parameter.json などの JSON 配列 / NDJSON → fax_parameters）
+
+  python import_history.py parameter.json
+  python import_history.py history.ndjson --batch-size 2000
+
+- ファイル全体を読み込まず、1件ずつ読みながら取り込む
+- ID・ステータス・日時などすべての項目をそのまま保存する（IDがない行は内容から決まるIDを付与）
+- --batch-size 件ごとに複数行 INSERT でまとめて登録し、コミットのたびに進捗をチェックポイントファイルに保存する
+- 中断した場合は同じコマンドで再実行すると続きから再開する（既に登録済みのIDは無視されるため重複しない）
+"""
+
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime
+
+from db import REQUEST_COLUMNS, JSON_COLUMNS, bulk_insert_requests
+
+DEFAULT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+
+# 取り込むカラム（fax_parameters の全カラム）
+IMPORT_COLUMNS = [column.strip() for column in REQUEST_COLUMNS.split(",")]
+DATETIME_COLUMNS = {"created_at", "updated_at", "next_attempt_at", "lease_expires_at", "preprocessed_at",
+                    "started_at"}
+# NOT NULL のカラムに値がない場合の既定値
+COLUMN_DEFAULTS = {"status": 0, "priority": 1, "attempt_count": 0}
+
+# IDのない行に付与するIDの名前空間（同じ内容なら再実行しても同じIDになる）
+IMPORT_NAMESPACE = uuid.UUID("6f1c1f4e-2d1a-4c55-9d7e-2b7c0b1a9e51")
+
+# -------------------------------
+# 読み込み
+# -------------------------------
+
+def iter_records(path, chunk_size=READ_CHUNK_SIZE):
+    """JSON 配列または NDJSON から1件ずつレコードを読み出す（ファイル全体は読み込まない）"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        in_array = None
+
+        while True:
+            # 空白と（配列の場合は）区切りのカンマを読み飛ばす
+            while pos < len(buf) and (buf[pos].isspace() or (in_array and buf[pos] == ",")):
+                pos += 1
+            if pos >= len(buf) or pos > chunk_size:
+                if eof and pos >= len(buf):
+                    break
+                if not eof:
+                    chunk = f.read(chunk_size)
+                    eof = not chunk
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                    continue
+
+            if in_array is None:
+                in_array = buf[pos] == "["
+                if in_array:
+                    pos += 1
+                continue
+            if in_array and buf[pos] == "]":
+                break
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # レコードの途中までしか読めていないので続きを読む
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            if not isinstance(record, dict):
+                raise ValueError(f"レコードがオブジェクトではありません: {record!r}")
+            yield record
+            pos = end
+
+def _parse_datetime(value):
+    if value is None or value == "" or isinstance(value, datetime):
+        return value or None
+    text = str(value).strip().replace("Z", "+00:00")
+    parsed = datetime.fromisoformat(text)
+    # DATETIME カラムはタイムゾーンを持たないため、ローカル時刻に変換して保存
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def to_row(record):
+    """レコードを IMPORT_COLUMNS 順の値のリストに変換"""
+    request_id = record.get("id")
+    if not request_id:
+        content = json.dumps(record, sort_keys=True, ensure_ascii=False)
+        request_id = str(uuid.uuid5(IMPORT_NAMESPACE, content))
+
+    row = []
+    for column in IMPORT_COLUMNS:
+        value = request_id if column == "id" else record.get(column)
+        if column in DATETIME_COLUMNS:
+            value = _parse_datetime(value)
+        elif column in JSON_COLUMNS and isinstance(value, (list, dict)):
+            # /export の NDJSON では配列のまま出力されるため、add_fax_request と同じくJSON文字列で保存する
+            value = json.dumps(value, ensure_ascii=False)
+        if value is None and column in COLUMN_DEFAULTS:
+            value = COLUMN_DEFAULTS[column]
+        row.append(value)
+    return row
+
+# -------------------------------
+# チェックポイント
+# -------------------------------
+
+def default_checkpoint_path(input_path):
+    return input_path + ".import_checkpoint.json"
+
+def load_checkpoint(checkpoint_path, input_path):
+    """チェックポイントを読み込む（入力ファイルが変わっていれば ValueError）"""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    stat = os.stat(input_path)
+    if checkpoint.get("size") != stat.st_size or checkpoint.get("mtime") != int(stat.st_mtime):
+        raise ValueError(f"前回の取り込み後に入力ファイルが変更されています（--restart で最初から取り込み）: {input_path}")
+    return checkpoint
+
+def save_checkpoint(checkpoint_path, input_path, records_done, inserted, completed=False):
+    """進捗を保存（書き込み途中で中断しても壊れないよう一時ファイルから置き換える）"""
+    stat = os.stat(input_path)
+    checkpoint = {
+        "input": os.path.abspath(input_path),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "records_done": records_done,
+        "inserted": inserted,
+        "completed": completed,
+        "updated_at": datetime.now().isoformat(),
+    }
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, checkpoint_path)
+
+# -------------------------------
+# 取り込み
+# -------------------------------
+
+def import_history(input_path, batch_size=DEFAULT_BATCH_SIZE, checkpoint_path=None, restart=False):
+    """履歴ファイルを取り込み、(読み込み件数, 追加件数, 既存のためスキップした件数) を返す"""
+    checkpoint_path = checkpoint_path or default_checkpoint_path(input_path)
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, input_path)
+    if checkpoint and checkpoint.get("completed"):
+        print(f"[import] 取り込み済みです（{checkpoint['records_done']}件）。最初からやり直す場合は --restart を指定してください")
+        return checkpoint["records_done"], 0, 0
+
+    skip = checkpoint["records_done"] if checkpoint else 0
+    inserted_total = checkpoint["inserted"] if checkpoint else 0
+    if skip:
+        print(f"[import] 前回の続きから再開します（{skip}件目まで取り込み済み）")
+
+    records_done = 0
+    batch = []
+    unknown_fields = set()
+    inserted_now = 0
+    sent_now = 0
+    started = datetime.now()
+
+    def flush():
+        nonlocal inserted_total, inserted_now, sent_now, batch
+        inserted = bulk_insert_requests(IMPORT_COLUMNS, batch)
+        inserted_total += inserted
+        inserted_now += inserted
+        sent_now += len(batch)
+        batch = []
+        save_checkpoint(checkpoint_path, input_path, records_done, inserted_total)
+        elapsed = max((datetime.now() - started).total_seconds(), 1e-6)
+        print(f"[import] {records_done}件 処理済み（今回追加 {inserted_now}件, {sent_now / elapsed:.0f}件/秒）")
+
+    for record in iter_records(input_path):
+        records_done += 1
+        if records_done <= skip:
+            continue
+        unknown_fields.update(set(record) - set(IMPORT_COLUMNS))
+        batch.append(to_row(record))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    save_checkpoint(checkpoint_path, input_path, records_done, inserted_total, completed=True)
+    if unknown_fields:
+        print(f"[import] 警告: テーブルにない項目は取り込んでいません: {', '.join(sorted(unknown_fields))}")
+    return records_done, inserted_now, sent_now - inserted_now
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="送信履歴（JSON 配列 / NDJSON）を fax_parameters に一括取り込み")
+    parser.add_argument("input", nargs="?", default="parameter.json", help="入力ファイル（既定: parameter.json）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1回のINSERT・コミットで登録する件数")
+    parser.add_argument("--checkpoint", help="チェックポイントファイル（既定: <入力ファイル>.import_checkpoint.json）")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初から取り込む")
+    args = parser.parse_args(argv)
+
+    print(f"{args.input} から fax_parameters テーブルへの取り込み開始（バッチ: {args.batch_size}件）")
+    total, inserted, skipped = import_history(args.input, args.batch_size, args.checkpoint, args.restart)
+    print("=" * 60)
+    print("取り込み結果サマリー")
+    print(f"読み込み: {total} 件")
+    print(f"追加: {inserted} 件")
+    print(f"登録済みのためスキップ: {skipped} 件")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ジョブリース管理
+処理中のジョブに担当ワーカーと有効期限を記録し、ハートビートで延長する。
+ワーカーが落ちる・GUIが固まるとリースが切れ、リーパーが待機中に戻す
+"""
+
+import os
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import tuning
+from db import connect, extend_lease, reap_expired_leases
+
+# リースの有効期間・ハートビート間隔・固まったとみなす秒数・回収後にエラーにする試行回数は
+# tuning.json で調整する（lease_seconds / heartbeat_interval_seconds / job_max_seconds / lease_max_attempts）
+
+# このワーカープロセスの識別子
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_expiry(now=None):
+    """新しいリースの有効期限を計算"""
+    return (now or datetime.now()) + timedelta(seconds=tuning.get("lease_seconds"))
+
+def _heartbeat_loop(request_id, stop_event):
+    """リースを定期的に延長（専用のDB接続を使用）"""
+    started = datetime.now()
+    conn = None
+    try:
+        conn = connect()
+        while not stop_event.wait(tuning.get("heartbeat_interval_seconds")):
+            job_max_seconds = tuning.get("job_max_seconds")
+            if (datetime.now() - started).total_seconds() > job_max_seconds:
+                print(f"⚠ [lease] ジョブが{job_max_seconds:g}秒を超えたためハートビートを停止: ID={request_id}")
+                return
+            if not extend_lease(request_id, WORKER_ID, lease_expiry(), conn):
+                print(f"⚠ [lease] リースを失いました: ID={request_id}")
+                return
+    except Exception as e:
+        print(f"[lease] ハートビートエラー: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+@contextmanager
+def job_lease(request_id):
+    """ジョブ処理中にハートビートを送り続けるコンテキスト"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_heartbeat_loop, args=(request_id, stop_event),
+                              name=f"lease-heartbeat-{request_id[:8]}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join(timeout=5)
+
+def reap_expired():
+    """期限切れリースを回収して待機中に戻す（試行回数上限ならエラー）"""
+    settings = tuning.current()
+    stale_before = datetime.now() - timedelta(seconds=settings["job_max_seconds"])
+    requeued, failed = reap_expired_leases(settings["lease_max_attempts"], stale_before)
+    if requeued or failed:
+        print(f"[lease] 期限切れリースを回収: 再投入 {requeued}件, エラー {failed}件")
+    return requeued, failed
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信先ごとのペーシング（トークンバケット＋話中バックオフ）
+同じ番号への連続発信を抑え、話中の番号は一定時間後回しにして回線を他の番号に使う
+"""
+
+import unicodedata
+from datetime import datetime, timedelta
+import tuning
+from db import get_all_destination_pacing, get_destination_pacing, save_destination_pacing
+
+# バケット容量・回復秒数・話中バックオフは tuning.json で調整する（pace_burst / pace_refill_seconds /
+# busy_backoff_seconds / busy_backoff_max_seconds）
+
+def normalize_fax_number(fax_number):
+    """FAX番号を正規化（全角→半角、数字以外を除去、+81 → 0）"""
+    if not fax_number:
+        return ""
+    text = unicodedata.normalize("NFKC", str(fax_number)).strip()
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if text.startswith("+81") and digits.startswith("81"):
+        digits = "0" + digits[2:]
+    return digits
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+def _new_state(destination, now):
+    return {
+        "destination": destination,
+        "tokens": float(tuning.get("pace_burst")),
+        "last_refill_at": now,
+        "next_eligible_at": None,
+        "busy_count": 0,
+        "last_result": None,
+    }
+
+def _load_state(row, now):
+    """DBの行をペーシング状態に変換し、経過時間分のトークンを補充"""
+    state = dict(row)
+    state["last_refill_at"] = _parse_datetime(state.get("last_refill_at")) or now
+    state["next_eligible_at"] = _parse_datetime(state.get("next_eligible_at"))
+    elapsed = max(0.0, (now - state["last_refill_at"]).total_seconds())
+    state["tokens"] = min(float(tuning.get("pace_burst")),
+                          float(state.get("tokens") or 0) + elapsed / tuning.get("pace_refill_seconds"))
+    state["last_refill_at"] = now
+    return state
+
+def _save_state(state):
+    save_destination_pacing(state["destination"], state["tokens"], state["last_refill_at"],
+                            state["next_eligible_at"], state["busy_count"], state["last_result"])
+
+def _get_state(destination, now):
+    row = get_destination_pacing(destination)
+    return _load_state(row, now) if row else _new_state(destination, now)
+
+def load_pacing_states(now=None):
+    """全送信先のペーシング状態を取得（送信先 → 状態）"""
+    now = now or datetime.now()
+    return {row["destination"]: _load_state(row, now) for row in get_all_destination_pacing()}
+
+def eligible_at(states, fax_number, now=None):
+    """送信先が次に送信可能になる時刻を返す（今すぐ送信できる場合は None）"""
+    now = now or datetime.now()
+    state = states.get(normalize_fax_number(fax_number))
+    if state is None:
+        return None
+    candidates = []
+    if state["next_eligible_at"] and state["next_eligible_at"] > now:
+        candidates.append(state["next_eligible_at"])
+    if state["tokens"] < 1.0:
+        candidates.append(now + timedelta(seconds=(1.0 - state["tokens"]) * tuning.get("pace_refill_seconds")))
+    return max(candidates) if candidates else None
+
+def consume(fax_number, now=None):
+    """送信開始時にトークンを1つ消費"""
+    now = now or datetime.now()
+    state = _get_state(normalize_fax_number(fax_number), now)
+    state["tokens"] = max(0.0, state["tokens"] - 1.0)
+    _save_state(state)
+
+def record_busy(fax_number, now=None):
+    """話中を記録し、指数バックオフで次回送信可能時刻を後ろにずらす"""
+    now = now or datetime.now()
+    state = _get_state(normalize_fax_number(fax_number), now)
+    state["busy_count"] += 1
+    backoff = min(tuning.get("busy_backoff_max_seconds"),
+                  tuning.get("busy_backoff_seconds") * (2 ** (state["busy_count"] - 1)))
+    state["next_eligible_at"] = now + timedelta(seconds=backoff)
+    state["last_result"] = "busy"
+    _save_state(state)
+    print(f"[pacer] 話中のため延期: {state['destination']} → {state['next_eligible_at'].isoformat()}（{backoff}秒）")
+    return state["next_eligible_at"]
+
+def record_result(fax_number, success, now=None):
+    """話中以外の送信結果を記録（成功時は話中カウンタをリセット）"""
+    now = now or datetime.now()
+    state = _get_state(normalize_fax_number(fax_number), now)
+    if success:
+        state["busy_count"] = 0
+        state["next_eligible_at"] = None
+    state["last_result"] = "success" if success else "failed"
+    _save_state(state)
+
+def get_pacing_overview(now=None):
+    """送信先ごとのペーシング状態（API表示用）"""
+    now = now or datetime.now()
+    overview = []
+    for destination, state in sorted(load_pacing_states(now).items()):
+        next_at = eligible_at({destination: state}, destination, now)
+        overview.append({
+            "destination": destination,
+            "tokens": round(state["tokens"], 2),
+            "busy_count": state["busy_count"],
+            "last_result": state["last_result"],
+            "next_eligible_at": next_at.isoformat() if next_at else None,
+            "eligible_now": next_at is None,
+        })
+    return overview
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+受付時の事前処理（APIサーバー側）
+ジョブを受け付けた直後にバックグラウンドでファイルを取得・検証し、ページ数を数えて送信用PDFを作成する
+
+  - 送信できないファイル（壊れた画像、PDFでないファイル、パスワード付きPDFなど）は数秒でエラーにする
+  - 結果（ページ数・サイズ・送信用PDFのパス）をレコードに記録し、ワーカーはそのPDFをそのまま送信する
+  - 取得失敗などの一時的なエラーの場合は preprocess_status = 'failed' とし、ワーカーが従来どおり取得・変換する
+"""
+
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import tuning
+from workspace import create_job_workspace, schedule_cleanup
+from fetcher import local_path_from_url
+from db import get_request_by_id, update_preprocess_result, reject_pending_request, update_source_errors
+
+# 事前処理の状態
+PREPROCESS_PENDING = "pending"
+PREPROCESS_READY = "ready"
+PREPROCESS_FAILED = "failed"
+
+# 送信できないファイルのエラー種別（再送しない）
+ERROR_INVALID_FILE = "invalid_file"
+
+# 受付時の事前処理を行うか（0 で無効。ワーカーが送信直前に取得・変換する従来の動作）
+PREPROCESS_ENABLED = os.environ.get("FAX_PREPROCESS", "1") != "0"
+# 事前処理を並行して行うスレッド数
+PREPROCESS_WORKERS = tuning.env_int("FAX_PREPROCESS_WORKERS", 2)
+# ワーカーが事前処理の完了を待つ最大秒数（APIサーバーが停止した場合もこの時間が過ぎれば従来どおり処理）
+PREPROCESS_GRACE_SECONDS = 60
+# 事前処理中のジョブだけが残っている場合の、ワーカーの再確認間隔
+PREPROCESS_POLL_SECONDS = 3
+
+CONVERTED_PDF_FOLDER = "converted_pdfs"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.tif')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+class InvalidFileError(ValueError):
+    """送信できないファイル"""
+
+# -------------------------------
+# 検証
+# -------------------------------
+
+def count_pdf_pages(pdf_path):
+    """PDFを検証してページ数を返す（送信できない場合は InvalidFileError）"""
+    with open(pdf_path, "rb") as f:
+        head = f.read(1024)
+    if b"%PDF-" not in head:
+        raise InvalidFileError("PDFファイルではありません")
+
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+
+    if PdfReader is not None:
+        try:
+            reader = PdfReader(pdf_path)
+            if reader.is_encrypted:
+                raise InvalidFileError("パスワード付きのPDFは送信できません")
+            pages = len(reader.pages)
+        except InvalidFileError:
+            raise
+        except Exception as e:
+            raise InvalidFileError(f"PDFを読み込めません: {e}")
+    else:
+        # pypdf がない環境ではページオブジェクトの数で代用
+        with open(pdf_path, "rb") as f:
+            pages = len(re.findall(rb"/Type\s*/Page(?![s\w])", f.read()))
+
+    if pages == 0:
+        raise InvalidFileError("ページのないPDFです")
+    return pages
+
+def verify_image(image_path):
+    """画像を検証して (幅, 高さ) を返す（読み込めない場合は InvalidFileError）"""
+    from PIL import Image
+    try:
+        with Image.open(image_path) as img:
+            img.verify()
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception as e:
+        raise InvalidFileError(f"画像ファイルを読み込めません: {e}")
+    if width == 0 or height == 0:
+        raise InvalidFileError("画像のサイズが0です")
+    return width, height
+
+# -------------------------------
+# 事前処理
+# -------------------------------
+
+def prepare_request(request_id, file_url, download_file, create_pdf_from_image):
+    """ファイルを取得・検証し、送信用PDFを作成する
+
+    戻り値は update_preprocess_result に渡す結果の辞書。取得に失敗した場合は None
+    """
+    workspace = create_job_workspace(request_id)
+    try:
+        is_image = file_url.lower().endswith(IMAGE_EXTENSIONS)
+        is_pdf = file_url.lower().endswith(".pdf")
+        source_ext = os.path.splitext(file_url)[1].lower() if (is_image or is_pdf) else ".tmp"
+        source_path = os.path.join(workspace, "source" + source_ext)
+        if not download_file(file_url, source_path):
+            return None
+        source_bytes = os.path.getsize(source_path)
+        if source_bytes == 0:
+            raise InvalidFileError("ファイルが空です")
+
+        if is_pdf:
+            page_count = count_pdf_pages(source_path)
+            local_path = local_path_from_url(file_url)
+            if local_path and os.path.exists(local_path):
+                # アップロード済みファイルはそのまま送信に使える
+                prepared_pdf_path = os.path.abspath(local_path)
+            else:
+                prepared_pdf_path = os.path.abspath(os.path.join(CONVERTED_PDF_FOLDER, f"prepared_{request_id}.pdf"))
+                shutil.copy2(source_path, prepared_pdf_path)
+            return {"page_count": page_count, "source_bytes": source_bytes,
+                    "prepared_pdf_path": prepared_pdf_path, "converted_pdf_path": None}
+
+        # PDF以外は画像として検証し、A4 PDFに変換（ワーカーの変換処理と同じ）
+        verify_image(source_path)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        converted_path = os.path.abspath(os.path.join(CONVERTED_PDF_FOLDER, f"converted_{request_id}_{timestamp}.pdf"))
+        create_pdf_from_image(source_path, converted_path)
+        return {"page_count": count_pdf_pages(converted_path), "source_bytes": source_bytes,
+                "prepared_pdf_path": converted_path, "converted_pdf_path": converted_path}
+    finally:
+        schedule_cleanup(workspace)
+
+def prepare_multi_source_request(request_id, file_urls, create_pdf_from_image):
+    """複数ファイルのジョブのファイルを取得・検証し、結合した送信用PDFを作成する（documents.SourceError あり）"""
+    from documents import build_document
+
+    workspace = create_job_workspace(request_id)
+    try:
+        prepared_pdf_path = os.path.abspath(os.path.join(CONVERTED_PDF_FOLDER, f"prepared_{request_id}.pdf"))
+        result = build_document(file_urls, workspace, prepared_pdf_path, create_pdf_from_image)
+        # 結合したPDFは変換後PDFとして画面から確認できるようにする
+        return dict(result, prepared_pdf_path=prepared_pdf_path, converted_pdf_path=prepared_pdf_path)
+    finally:
+        schedule_cleanup(workspace)
+
+def run_preprocess(request_id, download_file, create_pdf_from_image):
+    """1件の事前処理を実行し、結果をレコードに記録"""
+    request_data = get_request_by_id(request_id, use_cache=False)
+    if not request_data or request_data.get("status") != 0:
+        # ワーカーが先に取得した、または削除された
+        print(f"[preprocess] 待機中でないため事前処理をスキップ: ID={request_id}")
+        return
+
+    from documents import SourceError, is_multi_source
+
+    started = datetime.now()
+    try:
+        if is_multi_source(request_data):
+            result = prepare_multi_source_request(request_id, request_data["file_urls"], create_pdf_from_image)
+        else:
+            result = prepare_request(request_id, request_data["file_url"], download_file, create_pdf_from_image)
+    except SourceError as e:
+        update_source_errors(request_id, e.errors)
+        if e.invalid:
+            if reject_pending_request(request_id, ERROR_INVALID_FILE, f"送信できないファイルがあります: {e}"):
+                print(f"[preprocess] ❌ 受付時に却下: ID={request_id}, 理由={e}")
+        else:
+            print(f"[preprocess] ファイル取得に失敗（ワーカーで再取得）: ID={request_id}, {e}")
+            update_preprocess_result(request_id, PREPROCESS_FAILED)
+        return
+    except InvalidFileError as e:
+        message = f"送信できないファイルです: {e}"
+        if reject_pending_request(request_id, ERROR_INVALID_FILE, message):
+            print(f"[preprocess] ❌ 受付時に却下: ID={request_id}, 理由={e}")
+        return
+    except Exception as e:
+        print(f"[preprocess] 事前処理エラー（ワーカーで再処理）: ID={request_id}, {e}")
+        update_preprocess_result(request_id, PREPROCESS_FAILED)
+        return
+
+    if result is None:
+        print(f"[preprocess] ファイル取得に失敗（ワーカーで再取得）: ID={request_id}")
+        update_preprocess_result(request_id, PREPROCESS_FAILED)
+        return
+
+    update_preprocess_result(request_id, PREPROCESS_READY, **result)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"[preprocess] ✅ 送信準備完了: ID={request_id}, {result['page_count']}ページ, "
+          f"{result['source_bytes']}バイト（{elapsed:.2f}秒）")
+
+def submit_preprocess(request_id, download_file, create_pdf_from_image):
+    """事前処理をバックグラウンドで開始（APIのレスポンスは待たせない）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+
+    def task():
+        try:
+            run_preprocess(request_id, download_file, create_pdf_from_image)
+        except Exception as e:
+            print(f"[preprocess] 予期しないエラー: ID={request_id}, {e}")
+
+    return _executor.submit(task)
+
+def prepared_pdf_for(request_data):
+    """ワーカー用：事前処理済みで送信にそのまま使えるPDFのパス（なければ None）"""
+    path = request_data.get("prepared_pdf_path")
+    if request_data.get("preprocess_status") == PREPROCESS_READY and path and os.path.exists(path):
+        return path
+    return None
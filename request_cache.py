@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+リクエストレコードのキャッシュ（プロセス内・LRU＋TTL）
+/status などのポーリングで同じIDを何度もDBから読まないようにする
+
+- db.py の更新関数が該当IDを無効化する（同一プロセス内の更新は即時反映）
+- fax_worker.py・gunicorn の他のワーカープロセスでの更新は無効化が届かないため、TTLを数秒にして追従する
+- 同じIDのキャッシュミスが同時に発生した場合、DBへの問い合わせは1回にまとめる
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 保持する最大件数
+CACHE_MAX_ENTRIES = int(os.environ.get("FAX_REQUEST_CACHE_SIZE", "1024"))
+# 待機中・処理中（ワーカーが別プロセスで更新する）レコードのTTL
+ACTIVE_TTL_SECONDS = float(os.environ.get("FAX_REQUEST_CACHE_ACTIVE_TTL", "2"))
+# 完了・エラーのレコードのTTL（変わるのは再送・削除時だけなので少し長めにするが、
+# 他のAPIワーカープロセスで再送・削除された場合はこの秒数まで古い値を返すため、数秒に留める）
+SETTLED_TTL_SECONDS = float(os.environ.get("FAX_REQUEST_CACHE_SETTLED_TTL", "5"))
+
+# 完了・エラーのステータス
+SETTLED_STATUSES = (1, -1)
+
+def ttl_for(record):
+    """レコードのステータスに応じたTTL（秒）"""
+    if record.get("status") in SETTLED_STATUSES:
+        return SETTLED_TTL_SECONDS
+    return ACTIVE_TTL_SECONDS
+
+class RequestCache:
+    """IDをキーとするLRU＋TTLキャッシュ（同一IDの同時ミスは1回の読み込みにまとめる）"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=ttl_for, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (有効期限, レコード)
+        self._loading = {}  # id -> 読み込み中を示す Event
+        self._generation = 0  # 読み込み中に無効化されたかの判定用
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """キャッシュから取得し、なければ loader(key) で読み込む（呼び出し側にはコピーを返す）"""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, record = entry
+                    if self._clock() < expires_at:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return copy.copy(record)
+                    del self._entries[key]
+
+                event = self._loading.get(key)
+                if event is None:
+                    # このスレッドが読み込みを担当
+                    event = threading.Event()
+                    self._loading[key] = event
+                    generation = self._generation
+                    self.misses += 1
+                    break
+            # 他スレッドの読み込み完了を待ってから再確認
+            event.wait()
+
+        try:
+            record = loader(key)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+        if record is not None:
+            with self._lock:
+                # 読み込み中に無効化されていれば古い値の可能性があるので保存しない
+                if generation == self._generation:
+                    self._entries[key] = (self._clock() + self._ttl(record), record)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return copy.copy(record)
+        return None
+
+    def invalidate(self, key):
+        """指定IDのキャッシュを破棄"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        """すべてのキャッシュを破棄（一括更新・削除時）"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        """件数とヒット率"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+            }
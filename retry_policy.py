@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+再送スケジュール（エラー種別ごとの指数バックオフ＋ジッター）
+失敗したジョブはその場で待たずに next_attempt_at を設定して待機中に戻す
+"""
+
+import random
+from datetime import datetime, timedelta
+import tuning
+
+# エラー種別
+ERROR_DOWNLOAD_FAILED = "download_failed"
+ERROR_DIALOG_NOT_FOUND = "dialog_not_found"
+ERROR_LINE_BUSY = "line_busy"
+ERROR_DESTINATION_WARNING = "destination_warning"
+ERROR_SEND_FAILED = "send_failed"
+
+# 再送するエラー種別（初回待機秒数・最大待機秒数・最大試行回数は tuning.json の
+# retry_<エラー種別>_base_seconds / _max_seconds / _max_attempts で調整する）
+#   download_failed      取得元サーバーの一時障害を想定し、間隔を空けて数回
+#   dialog_not_found     ドライバー側の一時的な不調。すぐ再試行してよいが回数は少なめ
+#   line_busy            相手先の話中。長めに待ち、回数は多めに許容
+#   destination_warning  送信開始後のエラーダイアログ（番号違い・応答なしなど）。同じ結果になりやすいため間隔を空けて少なめ
+ERROR_CLASSES = (ERROR_DOWNLOAD_FAILED, ERROR_DIALOG_NOT_FOUND, ERROR_LINE_BUSY, ERROR_DESTINATION_WARNING,
+                 ERROR_SEND_FAILED)
+
+# /retry_errors で一括再送する際の1件あたりの間隔（一斉に待機中へ戻さない）
+BULK_RETRY_STAGGER_SECONDS = 10
+
+def get_policy(error_class):
+    """エラー種別の再送設定（base_seconds / max_seconds / max_attempts）。不明な種別は send_failed と同じ"""
+    if error_class not in ERROR_CLASSES:
+        error_class = ERROR_SEND_FAILED
+    settings = tuning.current()
+    prefix = f"retry_{error_class}"
+    return {"base_seconds": settings[f"{prefix}_base_seconds"],
+            "max_seconds": settings[f"{prefix}_max_seconds"],
+            "max_attempts": settings[f"{prefix}_max_attempts"]}
+
+def backoff_seconds(error_class, attempt_count):
+    """attempt_count 回失敗した後の待機秒数（指数バックオフ＋イコールジッター）"""
+    policy = get_policy(error_class)
+    delay = min(policy["max_seconds"], policy["base_seconds"] * (2 ** max(0, attempt_count - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def should_retry(error_class, attempt_count):
+    """まだ再試行できるか"""
+    policy = get_policy(error_class)
+    return attempt_count < policy["max_attempts"]
+
+def next_attempt_at(error_class, attempt_count, now=None):
+    """次回試行日時を計算"""
+    now = now or datetime.now()
+    return now + timedelta(seconds=backoff_seconds(error_class, attempt_count))
+
+def staggered_attempt_times(count, now=None):
+    """一括再送用に、ジッター付きで間隔を空けた試行日時を count 件返す"""
+    now = now or datetime.now()
+    return [now + timedelta(seconds=i * BULK_RETRY_STAGGER_SECONDS + random.uniform(0, BULK_RETRY_STAGGER_SECONDS / 2))
+            for i in range(count)]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FAX送信ジョブスケジューラー
+優先度レーンごとの先頭ジョブを比較し、待ち時間によるエイジングを加味して次のジョブを選ぶ
+"""
+
+from datetime import datetime, timedelta
+import pacer
+import circuit_breaker
+import tuning
+from lease import WORKER_ID, lease_expiry
+from preprocess import PREPROCESS_GRACE_SECONDS, PREPROCESS_POLL_SECONDS
+from db import (get_pending_lane_heads, claim_request, get_queue_depth_by_priority,
+                get_earliest_next_attempt, get_oldest_preprocessing_created_at)
+
+# 優先度レーン（値が大きいほど優先）
+PRIORITY_URGENT = 2
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 0
+
+PRIORITY_LANES = {
+    "urgent": PRIORITY_URGENT,
+    "normal": PRIORITY_NORMAL,
+    "low": PRIORITY_LOW,
+}
+DEFAULT_PRIORITY = PRIORITY_NORMAL
+
+# エイジング：tuning.json の aging_seconds_per_level 秒待つごとに優先度を1段階引き上げる（低優先度の飢餓を防止）
+
+# レーン先頭の読み込み件数と、送信保留中として読み飛ばす宛先数の上限
+LANE_SCAN_LIMIT = 20
+MAX_EXCLUDED_DESTINATIONS = 50
+
+def parse_priority(value):
+    """リクエストの priority 値（レーン名または数値）をレーン値に変換
+
+    不正な値の場合は ValueError を送出する
+    """
+    if value is None or value == "":
+        return DEFAULT_PRIORITY
+    if isinstance(value, str):
+        key = value.strip().lower()
+        if key in PRIORITY_LANES:
+            return PRIORITY_LANES[key]
+        try:
+            value = int(key)
+        except ValueError:
+            raise ValueError(f"priorityが不正です: {value}（{', '.join(PRIORITY_LANES)} または数値）")
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"priorityが不正です: {value}")
+    if value not in PRIORITY_LANES.values():
+        raise ValueError(f"priorityの範囲外です: {value}（{PRIORITY_LOW}〜{PRIORITY_URGENT}）")
+    return value
+
+def lane_name(priority):
+    """レーン値からレーン名を取得"""
+    for name, value in PRIORITY_LANES.items():
+        if value == priority:
+            return name
+    return "normal"
+
+def _waited_seconds(request_data, now):
+    created_at = request_data.get("created_at")
+    if not created_at:
+        return 0.0
+    return max(0.0, (now - datetime.fromisoformat(created_at)).total_seconds())
+
+def effective_priority(request_data, now=None):
+    """待ち時間を加味した実効優先度を計算"""
+    now = now or datetime.now()
+    priority = request_data.get("priority")
+    if priority is None:
+        priority = DEFAULT_PRIORITY
+    return priority + _waited_seconds(request_data, now) / tuning.get("aging_seconds_per_level")
+
+def select_next_job(candidates, now=None):
+    """候補の中から実効優先度が最も高いジョブを選ぶ（同点なら古い順）"""
+    if not candidates:
+        return None
+    now = now or datetime.now()
+    return max(candidates, key=lambda r: (effective_priority(r, now), _waited_seconds(r, now)))
+
+def _blocked_until(states, breakers, fax_number, now):
+    """ペーシング・サーキットブレーカーのどちらかで保留中なら、送信可能になる時刻を返す"""
+    candidates = [t for t in (pacer.eligible_at(states, fax_number, now),
+                              circuit_breaker.blocked_until(breakers, fax_number, now)) if t is not None]
+    return max(candidates) if candidates else None
+
+def _eligible_lane_heads(states, now, breakers=None):
+    """各レーンで送信可能な最古のジョブを集める
+
+    レーン先頭が送信保留中の宛先（話中・トークン切れ・遮断中）ばかりの場合は、その番号を除外して読み直す。
+    戻り値は (候補リスト, 保留中の宛先が最も早く送信可能になる時刻)
+    """
+    breakers = breakers or {}
+    fail_blocked = tuning.get("breaker_mode") == "fail"
+    to_fail = {}
+    heads = []
+    earliest_blocked = None
+    # API側の事前処理（検証・変換）中のジョブは、猶予時間が過ぎるまで変換済みになるのを待つ
+    preprocess_before = now - timedelta(seconds=PREPROCESS_GRACE_SECONDS)
+    for priority in PRIORITY_LANES.values():
+        excluded = set()
+        while len(excluded) <= MAX_EXCLUDED_DESTINATIONS:
+            rows = get_pending_lane_heads([priority], LANE_SCAN_LIMIT, excluded, preprocess_before)
+            if not rows:
+                break
+            eligible = None
+            for row in rows:
+                blocked_until = _blocked_until(states, breakers, row["fax_number"], now)
+                if blocked_until is None:
+                    eligible = row
+                    break
+                if fail_blocked and circuit_breaker.blocked_until(breakers, row["fax_number"], now) is not None:
+                    # 遮断中の宛先のジョブは送信せずにエラーにする（走査の後でまとめて）
+                    destination = pacer.normalize_fax_number(row["fax_number"])
+                    to_fail[destination] = breakers[destination]
+                excluded.add(row["fax_number"])
+                if earliest_blocked is None or blocked_until < earliest_blocked:
+                    earliest_blocked = blocked_until
+            if eligible:
+                heads.append(eligible)
+                break
+    if to_fail:
+        circuit_breaker.fail_queued_jobs_for(to_fail)
+    return heads, earliest_blocked
+
+def claim_next_job():
+    """次に処理するジョブを選択し、このワーカーのリースを付けて処理中に遷移させる
+
+    他のワーカーに先取りされた場合は次の候補を試す。
+    戻り値は (ジョブ, 再確認までの秒数)。ジョブがなければ ジョブ=None で、
+    送信保留中・再送待ちのジョブだけが残っている場合は再確認までの秒数を、待機中ジョブ自体がなければ None を返す
+    """
+    now = datetime.now()
+    states = pacer.load_pacing_states(now)
+    breakers = circuit_breaker.load_breaker_states()
+    candidates, earliest_blocked = _eligible_lane_heads(states, now, breakers)
+    while candidates:
+        request_data = select_next_job(candidates, now)
+        candidates = [c for c in candidates if c["id"] != request_data["id"]]
+        # 遮断中の宛先は、試験送信の権利を取れた1件だけ送信する
+        probing = circuit_breaker.needs_probe(breakers, request_data["fax_number"])
+        if probing and not circuit_breaker.begin_probe(request_data["fax_number"], now):
+            print(f"[scheduler] 他のワーカーが試験送信中: {request_data['fax_number']}")
+            continue
+        if claim_request(request_data["id"], WORKER_ID, lease_expiry()):
+            request_data["attempt_count"] = (request_data.get("attempt_count") or 0) + 1
+            request_data["breaker_probe"] = probing
+            pacer.consume(request_data["fax_number"])
+            return request_data, None
+        print(f"[scheduler] 他のワーカーが取得済み: ID={request_data['id']}")
+        if probing:
+            circuit_breaker.cancel_probe(request_data["fax_number"], now)
+
+    # 再送待ち（next_attempt_at）のジョブも、最も早く送信可能になる時刻の候補に含める
+    next_retry = get_earliest_next_attempt()
+    if isinstance(next_retry, str):
+        next_retry = datetime.fromisoformat(next_retry)
+    if next_retry is not None and (earliest_blocked is None or next_retry < earliest_blocked):
+        earliest_blocked = next_retry
+    # 事前処理中のジョブは、完了するか猶予時間が過ぎた時点で送信可能になる
+    oldest_preprocessing = get_oldest_preprocessing_created_at(now - timedelta(seconds=PREPROCESS_GRACE_SECONDS))
+    if isinstance(oldest_preprocessing, str):
+        oldest_preprocessing = datetime.fromisoformat(oldest_preprocessing)
+    if oldest_preprocessing is not None:
+        # 完了を早めに拾えるよう、猶予時間の満了を待たず短い間隔で再確認する
+        preprocess_ready = min(oldest_preprocessing + timedelta(seconds=PREPROCESS_GRACE_SECONDS),
+                               now + timedelta(seconds=PREPROCESS_POLL_SECONDS))
+        if earliest_blocked is None or preprocess_ready < earliest_blocked:
+            earliest_blocked = preprocess_ready
+    if earliest_blocked is not None:
+        return None, max(0.0, (earliest_blocked - now).total_seconds())
+    return None, None
+
+def get_queue_depths():
+    """レーンごとの待機件数と最古の待ち時間を取得"""
+    now = datetime.now()
+    rows = {row["priority"]: row for row in get_queue_depth_by_priority()}
+    lanes = []
+    for name, value in sorted(PRIORITY_LANES.items(), key=lambda item: -item[1]):
+        row = rows.get(value, {})
+        oldest = row.get("oldest_created_at")
+        lanes.append({
+            "lane": name,
+            "priority": value,
+            "pending": row.get("pending", 0),
+            "oldest_created_at": oldest,
+            "oldest_wait_seconds": round(_waited_seconds({"created_at": oldest}, now), 1) if oldest else 0,
+        })
+    return lanes
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信履歴の検索（/search）
+ファイル名・発注先・依頼者はDBの全文検索索引（MySQL: FULLTEXT ngram / SQLite: FTS5 trigram）、
+FAX番号は idx_fax_number の前方一致で検索し、関連度順に1ページずつ返す
+
+  - 一覧をすべて読み込まずに済むため、履歴の件数が増えても応答時間はほぼ一定
+  - ページは page × per_page が SEARCH_MAX_RESULTS 件までで、それより先は条件を絞り込んでもらう
+"""
+
+import re
+import unicodedata
+
+from db import search_requests
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+# 検索結果としてたどれる最大件数（深いページほど読み飛ばす行が増えるため）
+SEARCH_MAX_RESULTS = 1000
+# キーワードの最大数
+MAX_TERMS = 5
+
+def parse_terms(query):
+    """キーワードを語のリストにする（全角・半角の空白で区切り、全角英数字は半角にする）"""
+    if not query:
+        return []
+    text = unicodedata.normalize("NFKC", query)
+    terms = []
+    for term in re.split(r"\s+", text.replace('"', " ")):
+        if term and term not in terms:
+            terms.append(term)
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"キーワードは{MAX_TERMS}語までです")
+    return terms
+
+def parse_fax_prefix(value):
+    """FAX番号の前方一致の検索値（登録時の表記のまま比較するため、空白だけ除く）"""
+    if not value:
+        return None
+    return unicodedata.normalize("NFKC", value).strip() or None
+
+def _parse_positive_int(name, value, default):
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name}が不正です: {value}")
+    if number < 1:
+        raise ValueError(f"{name}は1以上で指定してください: {number}")
+    return number
+
+def search(query=None, fax_number=None, status=None, created_from=None, created_to=None, page=None, per_page=None):
+    """検索してページの結果を返す（不正な条件は ValueError）"""
+    terms = parse_terms(query)
+    fax_prefix = parse_fax_prefix(fax_number)
+    if not terms and not fax_prefix:
+        raise ValueError("qまたはfax_numberを指定してください")
+
+    page = _parse_positive_int("page", page, 1)
+    per_page = min(_parse_positive_int("per_page", per_page, DEFAULT_PER_PAGE), MAX_PER_PAGE)
+    offset = (page - 1) * per_page
+    if offset + per_page > SEARCH_MAX_RESULTS:
+        raise ValueError(f"{SEARCH_MAX_RESULTS}件より先は表示できません。条件を絞り込んでください")
+
+    # 1件多く取得して次のページがあるかを判定する（件数を数えるための全件走査はしない）
+    rows = search_requests(terms, fax_prefix, status, created_from, created_to, per_page + 1, offset)
+    for row in rows:
+        row["score"] = round(float(row["score"] or 0), 4)
+    return {
+        "terms": terms,
+        "fax_number": fax_prefix,
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(rows) > per_page,
+        "results": rows[:per_page],
+    }
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+テスト共通の設定
+MySQLに接続せず、一時ディレクトリの組み込みSQLite（FAX_DB_BACKEND=sqlite）で動かす。
+db.py は読み込み時にバックエンドを決めるため、テスト対象のモジュールより先に環境変数を設定する
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="fax_test_")
+
+os.environ["FAX_DB_BACKEND"] = "sqlite"
+os.environ["FAX_DB_PATH"] = os.path.join(TEST_DIR, "fax_queue.db")
+os.environ["FAX_PREPROCESS"] = "0"
+os.environ["FAX_TUNING_FILE"] = os.path.join(TEST_DIR, "tuning.json")
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True, scope="session")
+def _work_in_test_dir():
+    """作業ディレクトリ・変換PDFなどの相対パスはテスト用ディレクトリに作る"""
+    previous = os.getcwd()
+    os.chdir(TEST_DIR)
+    yield
+    os.chdir(previous)
+
+TABLES = ("fax_parameters", "fax_destination_pacing", "fax_destination_daily_stats", "fax_destination_breaker")
+
+@pytest.fixture
+def db():
+    """空のテーブルで db モジュールを使う"""
+    import db as db_module
+    for table in TABLES:
+        db_module.mycursor.execute(f"DELETE FROM {table}")
+    db_module.mydb.commit()
+    db_module.REQUEST_CACHE.clear()
+    return db_module
+
+@pytest.fixture
+def tuning_values(monkeypatch):
+    """調整値を一時的に差し替える（tuning_values(dialog_timeout_seconds=1) のように使う）"""
+    import tuning
+
+    def apply(**overrides):
+        unknown = set(overrides) - set(tuning.SETTINGS)
+        assert not unknown, f"不明な調整値: {unknown}"
+        monkeypatch.setattr(tuning, "_values", dict(tuning._values, **overrides))
+
+    return apply
+
+@pytest.fixture
+def tuning_file():
+    """tuning.json を書き込んで読み直す（テスト後はファイルを消して既定値に戻す）"""
+    import tuning
+
+    def write(data):
+        with open(tuning.TUNING_FILE, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return tuning.reload(force=True)
+
+    yield write
+    if os.path.exists(tuning.TUNING_FILE):
+        os.remove(tuning.TUNING_FILE)
+    tuning.reload(force=True)
+
+class FakeClock:
+    """sleep() で時刻が進む時計（待機処理を実時間を使わずに確認する）"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""APIエンドポイント（Flask のテストクライアントで確認）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+@pytest.fixture
+def client(db):
+    import app
+    app.app.config["TESTING"] = True
+    return app.app.test_client()
+
+# -------------------------------
+# /requests
+# -------------------------------
+
+def test_requests_etag_not_modified(client, db):
+    db.add_fax_request("file:///a.pdf", "0311111111")
+    first = client.get("/requests")
+    etag = first.headers["ETag"]
+
+    again = client.get("/requests", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+def test_requests_etag_changes_with_lease_extension(client, db):
+    request_id = db.add_fax_request("file:///a.pdf", "0311111111")["id"]
+    now = datetime.now()
+    db.claim_request(request_id, "worker-1", now + timedelta(minutes=2))
+    etag = client.get("/requests").headers["ETag"]
+
+    # ハートビートは updated_at を変えないが、一覧のリース期限は変わる
+    assert db.extend_lease(request_id, "worker-1", now + timedelta(minutes=4)) is True
+    response = client.get("/requests", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+# -------------------------------
+# /tuning
+# -------------------------------
+
+def test_tuning_reports_values_from_file(client, tuning_file):
+    tuning_file({"aging_seconds_per_level": 900})
+
+    data = client.get("/tuning").get_json()
+    assert data["success"] is True
+    assert data["file_exists"] is True
+    settings = {item["name"]: item for item in data["settings"]}
+    assert settings["aging_seconds_per_level"]["value"] == 900
+    assert settings["aging_seconds_per_level"]["source"] == "file"
+    assert settings["lease_seconds"]["source"] == "default"
+    # 廃止した項目は表示しない
+    assert "send_max_retries" not in settings
+
+# -------------------------------
+# /search
+# -------------------------------
+
+def _search(client, **params):
+    response = client.get("/search", query_string=params)
+    return response.status_code, response.get_json()
+
+def test_search_matches_all_keywords(client, db):
+    hit = db.add_fax_request("file:///a.pdf", "0311111111", "田中", "ABC商事_見積書.pdf", order_destination="ABC商事")
+    db.add_fax_request("file:///b.pdf", "0311111111", "田中", "ABC商事_請求書.pdf", order_destination="ABC商事")
+    db.add_fax_request("file:///c.pdf", "0622222222", "佐藤", "XYZ工業_見積書.pdf", order_destination="XYZ工業")
+
+    status, data = _search(client, q="ABC商事　見積書")
+    assert status == 200
+    assert [row["id"] for row in data["results"]] == [hit["id"]]
+    # 全角の空白でも区切り、語は正規化して返す
+    assert data["terms"] == ["ABC商事", "見積書"]
+
+def test_search_short_keyword_and_fax_prefix(client, db):
+    db.add_fax_request("file:///a.pdf", "0311111111", "田中", "見積.pdf")
+    osaka = db.add_fax_request("file:///b.pdf", "0622222222", "田中", "見積.pdf")
+
+    # 全文検索の索引で扱えない短い語は部分一致で絞り込む
+    status, data = _search(client, q="見積", fax_number="06")
+    assert status == 200
+    assert [row["id"] for row in data["results"]] == [osaka["id"]]
+
+def test_search_status_filter(client, db):
+    done = db.add_fax_request("file:///a.pdf", "0311111111", file_name="注文書.pdf")
+    db.add_fax_request("file:///b.pdf", "0311111111", file_name="注文書.pdf")
+    db.update_request_status(done["id"], 1)
+
+    _, data = _search(client, q="注文書", status="1")
+    assert [row["id"] for row in data["results"]] == [done["id"]]
+
+def test_search_pages_without_counting(client, db):
+    for i in range(3):
+        db.add_fax_request(f"file:///{i}.pdf", "0311111111", file_name=f"発注書{i}.pdf")
+
+    _, first = _search(client, fax_number="03", per_page=2)
+    _, second = _search(client, fax_number="03", per_page=2, page=2)
+    assert (len(first["results"]), first["has_more"]) == (2, True)
+    assert (len(second["results"]), second["has_more"]) == (1, False)
+    ids = [row["id"] for row in first["results"] + second["results"]]
+    assert len(set(ids)) == 3
+
+@pytest.mark.parametrize("params", [{}, {"q": "a b c d e f"}, {"fax_number": "03", "page": "0"},
+                                    {"fax_number": "03", "page": "100", "per_page": "100"}])
+def test_search_rejects_invalid_conditions(client, db, params):
+    status, data = _search(client, **params)
+    assert status == 400
+    assert data["success"] is False
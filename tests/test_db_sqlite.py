@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""db.py の関数を組み込みSQLiteバックエンドで確認（MySQLと同じ呼び出し方で動くこと）"""
+
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from db_backend import SQLiteBackend, create_backend
+
+def _status(db, request_id):
+    return db.get_request_by_id(request_id, use_cache=False)["status"]
+
+# -------------------------------
+# 登録・取得
+# -------------------------------
+
+def test_add_and_get_request_round_trip(db):
+    urls = ["https://example.com/a.pdf", "https://example.com/b.pdf"]
+    added = db.add_fax_request(urls[0], "0312345678", request_user="山田", file_name="発注書.pdf",
+                               order_destination="秋岡商店", priority=2, file_urls=urls)
+
+    stored = db.get_request_by_id(added["id"], use_cache=False)
+    assert stored["fax_number"] == "0312345678"
+    assert stored["status"] == 0
+    assert stored["priority"] == 2
+    assert stored["file_name"] == "発注書.pdf"
+    # JSONカラムはリストに戻り、日時はISO形式の文字列になる
+    assert stored["file_urls"] == urls
+    assert datetime.fromisoformat(stored["created_at"])
+
+def test_get_unknown_request_returns_none(db):
+    assert db.get_request_by_id("missing", use_cache=False) is None
+
+def test_load_parameters_with_filters(db):
+    db.add_fax_request("file:///a.pdf", "0311111111", request_user="山田")
+    db.add_fax_request("file:///b.pdf", "0322222222", request_user="佐藤")
+
+    where, params = db.build_request_filters(request_user="山田")
+    rows = db.load_parameters(where, params)
+    assert [row["fax_number"] for row in rows] == ["0311111111"]
+    assert len(db.load_parameters()) == 2
+
+def test_filter_escapes_like_wildcards(db):
+    db.add_fax_request("file:///a.pdf", "0311111111", file_name="100%_確認.pdf")
+    db.add_fax_request("file:///b.pdf", "0322222222", file_name="1000_確認.pdf")
+
+    where, params = db.build_request_filters(file_name="100%_")
+    assert [row["fax_number"] for row in db.load_parameters(where, params)] == ["0311111111"]
+
+# -------------------------------
+# 状態遷移
+# -------------------------------
+
+def test_claim_request_only_once(db):
+    request_id = db.add_fax_request("file:///a.pdf", "0312345678")["id"]
+    expires = datetime.now() + timedelta(minutes=5)
+
+    assert db.claim_request(request_id, "worker-1", expires) is True
+    assert db.claim_request(request_id, "worker-2", expires) is False
+
+    stored = db.get_request_by_id(request_id, use_cache=False)
+    assert stored["status"] == 2
+    assert stored["lease_owner"] == "worker-1"
+    assert stored["attempt_count"] == 1
+
+def test_update_request_status_adds_daily_outcome(db):
+    sent = db.add_fax_request("file:///a.pdf", "03-1234-5678", order_destination="秋岡商店")["id"]
+    failed = db.add_fax_request("file:///b.pdf", "0312345678", order_destination="秋岡商店")["id"]
+
+    db.update_request_status(sent, 1)
+    db.update_request_status(failed, -1, "送信失敗", error_class="send_failed")
+    # 同じステータスへの再更新は二重に数えない
+    db.update_request_status(failed, -1, "送信失敗", error_class="send_failed")
+
+    assert _status(db, sent) == 1
+    stats = db.get_destination_daily_stats(date.today(), "0312345678")
+    assert len(stats) == 1
+    assert stats[0]["sent_count"] == 1
+    assert stats[0]["failed_count"] == 1
+    assert stats[0]["last_error_class"] == "send_failed"
+
+def test_update_request_status_releases_lease(db):
+    request_id = db.add_fax_request("file:///a.pdf", "0312345678")["id"]
+    db.claim_request(request_id, "worker-1", datetime.now() + timedelta(minutes=5))
+
+    db.update_request_status(request_id, 1)
+    stored = db.get_request_by_id(request_id, use_cache=False)
+    assert stored["lease_owner"] is None
+    assert stored["lease_expires_at"] is None
+
+def test_reap_expired_leases_requeues_or_fails(db):
+    now = datetime.now()
+    retryable = db.add_fax_request("file:///a.pdf", "0311111111")["id"]
+    exhausted = db.add_fax_request("file:///b.pdf", "0322222222")["id"]
+    alive = db.add_fax_request("file:///c.pdf", "0333333333")["id"]
+    db.claim_request(retryable, "worker-1", now - timedelta(seconds=1))
+    db.claim_request(exhausted, "worker-1", now - timedelta(seconds=1))
+    db.claim_request(alive, "worker-2", now + timedelta(minutes=5))
+    db.mycursor.execute("UPDATE fax_parameters SET attempt_count = 3 WHERE id = %s", (exhausted,))
+    db.mydb.commit()
+
+    assert db.reap_expired_leases(3, now - timedelta(minutes=10)) == (1, 1)
+    assert _status(db, retryable) == 0
+    assert _status(db, exhausted) == -1
+    assert _status(db, alive) == 2
+    stats = db.get_destination_daily_stats(date.today(), "0322222222")
+    assert stats[0]["last_error_class"] == "lease_expired"
+
+def test_clear_completed_requests(db):
+    done = db.add_fax_request("file:///a.pdf", "0311111111")["id"]
+    pending = db.add_fax_request("file:///b.pdf", "0322222222")["id"]
+    db.update_request_status(done, 1)
+
+    assert db.clear_completed_requests() == 1
+    assert db.get_request_by_id(done, use_cache=False) is None
+    assert _status(db, pending) == 0
+
+def test_retry_error_requests_assigns_attempt_times(db):
+    first = db.add_fax_request("file:///a.pdf", "0311111111")["id"]
+    second = db.add_fax_request("file:///b.pdf", "0322222222")["id"]
+    db.update_request_status(first, -1, "送信失敗")
+    db.update_request_status(second, -1, "送信失敗")
+    base = datetime(2026, 1, 5, 10, 0, 0)
+
+    count = db.retry_error_requests(lambda n: [base + timedelta(seconds=10 * i) for i in range(n)])
+    assert count == 2
+    rows = {row["id"]: row for row in db.load_parameters()}
+    assert rows[first]["status"] == 0
+    assert rows[first]["attempt_count"] == 0
+    # 古くエラーになった順に早い時刻を割り当てる
+    assert rows[first]["next_attempt_at"] == base.isoformat()
+    assert rows[second]["next_attempt_at"] == (base + timedelta(seconds=10)).isoformat()
+
+def test_retry_error_requests_without_errors(db):
+    db.add_fax_request("file:///a.pdf", "0311111111")
+    assert db.retry_error_requests() == 0
+
+# -------------------------------
+# 一括登録・検索
+# -------------------------------
+
+def test_bulk_insert_ignores_existing_ids(db):
+    now = datetime.now()
+    columns = ["id", "file_url", "fax_number", "status", "created_at", "updated_at"]
+    rows = [("bulk-1", "file:///a.pdf", "0311111111", 1, now, now),
+            ("bulk-2", "file:///b.pdf", "0322222222", 1, now, now)]
+
+    assert db.bulk_insert_requests(columns, rows) == 2
+    # 取り込みの再開で同じ行を送っても重複しない
+    assert db.bulk_insert_requests(columns, rows) == 0
+    assert len(db.load_parameters()) == 2
+
+def test_search_requests_by_keyword_and_prefix(db):
+    db.add_fax_request("file:///a.pdf", "0311111111", file_name="見積依頼書.pdf", order_destination="秋岡商店")
+    db.add_fax_request("file:///b.pdf", "0622222222", file_name="請求書.pdf", order_destination="大阪工業")
+
+    assert [row["fax_number"] for row in db.search_requests(["見積依頼"])] == ["0311111111"]
+    assert [row["fax_number"] for row in db.search_requests(fax_number_prefix="06")] == ["0622222222"]
+    # 索引を使えない短い語は部分一致で絞り込む
+    assert [row["fax_number"] for row in db.search_requests(["大"])] == ["0622222222"]
+
+# -------------------------------
+# バックエンド
+# -------------------------------
+
+def test_create_backend_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        create_backend("postgres", {}, "unused.db")
+
+def test_sqlite_backend_adds_missing_columns(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE fax_parameters (id TEXT PRIMARY KEY, file_url TEXT, fax_number TEXT, status INTEGER)")
+    conn.execute("INSERT INTO fax_parameters (id, file_url, fax_number, status) VALUES ('old', 'x', '03', 1)")
+    conn.commit()
+    conn.close()
+
+    conn = SQLiteBackend(path).connect()
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(fax_parameters)")}
+        assert {"priority", "lease_owner", "file_urls", "source_errors"} <= columns
+        assert conn.execute("SELECT status FROM fax_parameters WHERE id = 'old'").fetchone() == (1,)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        conn.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""import_history の読み込み（JSON配列・NDJSON）と、中断からの再開・重複なしの取り込み"""
+
+import json
+import os
+
+import pytest
+
+import import_history
+
+RECORDS = [
+    {"id": f"00000000-0000-0000-0000-00000000000{i}", "file_url": f"file:///{i}.pdf", "fax_number": "0311111111",
+     "status": 1 if i % 2 else -1, "created_at": f"2024-01-0{i + 1}T09:00:00",
+     "updated_at": f"2024-01-0{i + 1}T09:01:00", "file_name": f"注文書[{i}], \"控え\".pdf"}
+    for i in range(5)
+]
+
+def _write_array(path, records):
+    with open(path, "w", encoding="utf-8-sig") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    return str(path)
+
+def _write_ndjson(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return str(path)
+
+def _count(db):
+    db.mycursor.execute("SELECT COUNT(*) FROM fax_parameters")
+    return db.mycursor.fetchone()[0]
+
+# -------------------------------
+# 読み込み
+# -------------------------------
+
+@pytest.mark.parametrize("writer", [_write_array, _write_ndjson])
+def test_iter_records_streams_across_chunks(tmp_path, writer):
+    path = writer(tmp_path / "history.json", RECORDS)
+    # 小さいチャンクでもレコードの途中・文字列中の ] や , で切れずに読める
+    assert list(import_history.iter_records(path, chunk_size=7)) == RECORDS
+
+def test_iter_records_rejects_non_object(tmp_path):
+    path = _write_array(tmp_path / "history.json", [1, 2])
+    with pytest.raises(ValueError):
+        list(import_history.iter_records(path))
+
+# -------------------------------
+# 取り込み
+# -------------------------------
+
+def test_import_keeps_all_fields(db, tmp_path):
+    path = _write_array(tmp_path / "parameter.json", RECORDS)
+
+    assert import_history.import_history(path, batch_size=2) == (5, 5, 0)
+    row = db.get_request_by_id(RECORDS[0]["id"], use_cache=False)
+    assert row["status"] == -1
+    assert row["file_name"] == RECORDS[0]["file_name"]
+    assert str(row["created_at"]).replace(" ", "T").startswith("2024-01-01T09:00:00")
+
+def test_import_resumes_after_interruption(db, tmp_path, monkeypatch):
+    path = _write_ndjson(tmp_path / "history.ndjson", RECORDS)
+    real_insert = import_history.bulk_insert_requests
+    calls = []
+
+    def fail_second_batch(columns, rows):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError("接続が切れました")
+        return real_insert(columns, rows)
+
+    monkeypatch.setattr(import_history, "bulk_insert_requests", fail_second_batch)
+    with pytest.raises(RuntimeError):
+        import_history.import_history(path, batch_size=2)
+    assert _count(db) == 2
+
+    monkeypatch.setattr(import_history, "bulk_insert_requests", real_insert)
+    # 最初のバッチは読み飛ばし、残りだけを取り込む
+    assert import_history.import_history(path, batch_size=2) == (5, 3, 0)
+    assert _count(db) == 5
+
+def test_import_again_does_not_duplicate(db, tmp_path):
+    records = [{key: value for key, value in record.items() if key != "id"} for record in RECORDS]
+    path = _write_array(tmp_path / "parameter.json", records)
+    import_history.import_history(path)
+
+    # 完了済みのファイルは取り込まない
+    assert import_history.import_history(path) == (5, 0, 0)
+    # 最初からやり直しても、IDのない行は内容から同じIDになるため重複しない
+    assert import_history.import_history(path, restart=True) == (5, 0, 5)
+    assert _count(db) == 5
+
+def test_changed_input_requires_restart(db, tmp_path):
+    path = _write_array(tmp_path / "parameter.json", RECORDS[:2])
+    import_history.import_history(path)
+    _write_array(tmp_path / "parameter.json", RECORDS)
+    os.utime(path, (0, 0))
+
+    with pytest.raises(ValueError):
+        import_history.import_history(path)
+    assert import_history.import_history(path, restart=True) == (5, 3, 2)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""リース（ハートビート・リーパー）と、リースを失ったワーカーの結果を記録しないこと"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import fax_worker
+import lease
+
+@pytest.fixture
+def claimed(db):
+    """このワーカー（lease.WORKER_ID）が取得した処理中のジョブ"""
+    request_data = db.add_fax_request("file:///a.pdf", "0312345678")
+    db.claim_request(request_data["id"], lease.WORKER_ID, datetime.now() + timedelta(seconds=5))
+    request_data["attempt_count"] = 1
+    return request_data
+
+def _row(db, request_id):
+    return db.get_request_by_id(request_id, use_cache=False)
+
+# -------------------------------
+# ハートビート
+# -------------------------------
+
+def test_heartbeat_extends_lease(db, claimed, tuning_values):
+    tuning_values(heartbeat_interval_seconds=0.05, lease_seconds=600)
+    before = _row(db, claimed["id"])["lease_expires_at"]
+
+    with lease.job_lease(claimed["id"]):
+        threading.Event().wait(0.3)
+
+    after = _row(db, claimed["id"])["lease_expires_at"]
+    assert datetime.fromisoformat(after) > datetime.fromisoformat(before) + timedelta(seconds=500)
+
+def test_heartbeat_stops_when_lease_is_lost(db, claimed, tuning_values):
+    tuning_values(heartbeat_interval_seconds=0.05)
+    db.mycursor.execute("UPDATE fax_parameters SET lease_owner = 'other-worker' WHERE id = %s", (claimed["id"],))
+    db.mydb.commit()
+
+    thread = threading.Thread(target=lease._heartbeat_loop, args=(claimed["id"], threading.Event()))
+    thread.start()
+    thread.join(5)
+    # 停止されなくても自分で終了し、他のワーカーのリースを延長しない
+    assert not thread.is_alive()
+    assert _row(db, claimed["id"])["lease_owner"] == "other-worker"
+
+def test_heartbeat_stops_after_job_max_seconds(db, claimed, tuning_values):
+    tuning_values(heartbeat_interval_seconds=0.05, job_max_seconds=0)
+    before = _row(db, claimed["id"])["lease_expires_at"]
+
+    thread = threading.Thread(target=lease._heartbeat_loop, args=(claimed["id"], threading.Event()))
+    thread.start()
+    thread.join(5)
+    # 固まったジョブのリースは延長せず、期限切れでリーパーに回収させる
+    assert not thread.is_alive()
+    assert _row(db, claimed["id"])["lease_expires_at"] == before
+
+# -------------------------------
+# リーパー
+# -------------------------------
+
+def test_reap_expired_requeues_then_fails(db, tuning_values):
+    tuning_values(lease_max_attempts=2)
+    request_id = db.add_fax_request("file:///a.pdf", "0312345678")["id"]
+    expired = datetime.now() - timedelta(seconds=1)
+
+    db.claim_request(request_id, "crashed-worker", expired)
+    assert lease.reap_expired() == (1, 0)
+    row = _row(db, request_id)
+    assert row["status"] == 0
+    assert row["last_error_class"] == "lease_expired"
+    assert row["lease_owner"] is None
+
+    db.claim_request(request_id, "crashed-worker", expired)
+    assert lease.reap_expired() == (0, 1)
+    assert _row(db, request_id)["status"] == -1
+
+def test_reap_expired_keeps_live_leases(db, claimed):
+    db.mycursor.execute("UPDATE fax_parameters SET lease_expires_at = %s WHERE id = %s",
+                        (datetime.now() + timedelta(minutes=5), claimed["id"]))
+    db.mydb.commit()
+    assert lease.reap_expired() == (0, 0)
+    assert _row(db, claimed["id"])["status"] == 2
+
+# -------------------------------
+# リースを失ったワーカーの結果
+# -------------------------------
+
+def _take_over(db, request_id):
+    """リーパーが回収し、他のワーカーが取得し直した状態にする"""
+    db.mycursor.execute("UPDATE fax_parameters SET lease_owner = 'other-worker' WHERE id = %s", (request_id,))
+    db.mydb.commit()
+
+def test_completion_requires_lease(db, claimed):
+    _take_over(db, claimed["id"])
+    assert db.update_request_status(claimed["id"], 1, lease_owner=lease.WORKER_ID) is False
+    assert _row(db, claimed["id"])["status"] == 2
+
+def test_completion_with_lease(db, claimed):
+    assert db.update_request_status(claimed["id"], 1, lease_owner=lease.WORKER_ID) is True
+    assert _row(db, claimed["id"])["status"] == 1
+
+def test_failure_does_not_touch_taken_over_job(db, claimed):
+    _take_over(db, claimed["id"])
+
+    assert fax_worker.handle_send_failure(claimed, "dialog_not_found", "ダイアログなし") is False
+    row = _row(db, claimed["id"])
+    assert row["status"] == 2
+    assert row["lease_owner"] == "other-worker"
+    assert row["next_attempt_at"] is None
+
+def test_failure_schedules_retry_with_lease(db, claimed):
+    assert fax_worker.handle_send_failure(claimed, "dialog_not_found", "ダイアログなし") is True
+    row = _row(db, claimed["id"])
+    assert row["status"] == 0
+    assert row["next_attempt_at"] is not None
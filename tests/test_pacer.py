@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""pacer のトークンバケットと話中バックオフ（時刻は now で渡す）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import pacer
+
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+NUMBER = "03-1234-5678"
+
+@pytest.fixture
+def pacing(db, tuning_values):
+    tuning_values(pace_burst=3, pace_refill_seconds=60, busy_backoff_seconds=120, busy_backoff_max_seconds=1800)
+    return pacer
+
+@pytest.mark.parametrize("raw, expected", [
+    ("03-1234-5678", "0312345678"),
+    ("０３（１２３４）５６７８", "0312345678"),
+    ("+81-3-1234-5678", "0312345678"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_fax_number(raw, expected):
+    assert pacer.normalize_fax_number(raw) == expected
+
+def test_unknown_destination_is_eligible(pacing):
+    assert pacing.eligible_at(pacing.load_pacing_states(NOW), NUMBER, NOW) is None
+
+def test_burst_then_wait_for_refill(pacing):
+    for _ in range(3):
+        assert pacing.eligible_at(pacing.load_pacing_states(NOW), NUMBER, NOW) is None
+        pacing.consume(NUMBER, NOW)
+
+    # トークンを使い切ると、1件分の回復（60秒）まで送信できない
+    states = pacing.load_pacing_states(NOW)
+    assert pacing.eligible_at(states, NUMBER, NOW) == NOW + timedelta(seconds=60)
+    # 表記の違う同じ番号も同じ送信先として扱う
+    assert pacing.eligible_at(states, "0312345678", NOW) == NOW + timedelta(seconds=60)
+
+    later = NOW + timedelta(seconds=60)
+    assert pacing.eligible_at(pacing.load_pacing_states(later), NUMBER, later) is None
+
+def test_refill_is_capped_at_burst(pacing):
+    pacing.consume(NUMBER, NOW)
+    later = NOW + timedelta(hours=1)
+    assert pacing.load_pacing_states(later)["0312345678"]["tokens"] == pytest.approx(3.0)
+
+def test_busy_backoff_doubles_and_is_capped(pacing):
+    delays = []
+    for _ in range(6):
+        delays.append((pacing.record_busy(NUMBER, NOW) - NOW).total_seconds())
+    assert delays == [120, 240, 480, 960, 1800, 1800]
+
+    states = pacing.load_pacing_states(NOW)
+    assert pacing.eligible_at(states, NUMBER, NOW) == NOW + timedelta(seconds=1800)
+
+def test_success_resets_busy_backoff(pacing):
+    pacing.record_busy(NUMBER, NOW)
+    pacing.record_busy(NUMBER, NOW)
+    pacing.record_result(NUMBER, True, NOW)
+
+    assert pacing.eligible_at(pacing.load_pacing_states(NOW), NUMBER, NOW) is None
+    assert (pacing.record_busy(NUMBER, NOW) - NOW).total_seconds() == 120
+
+def test_failure_keeps_busy_backoff(pacing):
+    next_at = pacing.record_busy(NUMBER, NOW)
+    pacing.record_result(NUMBER, False, NOW)
+
+    overview = pacing.get_pacing_overview(NOW)
+    assert overview[0]["destination"] == "0312345678"
+    assert overview[0]["last_result"] == "failed"
+    assert overview[0]["next_eligible_at"] == next_at.isoformat()
+    assert overview[0]["eligible_now"] is False
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""request_cache の TTL・無効化・同時ミスのまとめ・LRU"""
+
+import threading
+
+import request_cache
+from request_cache import RequestCache, ttl_for
+
+class Loader:
+    """呼び出し回数を数えるダミーの読み込み関数"""
+
+    def __init__(self, status=0):
+        self.calls = 0
+        self.status = status
+
+    def __call__(self, key):
+        self.calls += 1
+        return {"id": key, "status": self.status, "version": self.calls}
+
+def test_ttl_for_status():
+    assert ttl_for({"status": 0}) == request_cache.ACTIVE_TTL_SECONDS
+    assert ttl_for({"status": 1}) == request_cache.SETTLED_TTL_SECONDS
+    # 他のAPIワーカーでの再送・削除が反映されるよう、完了・エラーも数秒に留める
+    assert request_cache.SETTLED_TTL_SECONDS <= 10
+
+def test_hit_until_ttl_expires(clock):
+    cache = RequestCache(ttl=lambda record: 2, clock=clock)
+    loader = Loader()
+
+    assert cache.get("a", loader)["version"] == 1
+    clock.now += 1.9
+    assert cache.get("a", loader)["version"] == 1
+    clock.now += 0.2
+    assert cache.get("a", loader)["version"] == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_returns_copies(clock):
+    cache = RequestCache(clock=clock)
+    record = cache.get("a", Loader())
+    record["status"] = 99
+    assert cache.get("a", Loader())["status"] == 0
+
+def test_missing_record_is_not_cached(clock):
+    cache = RequestCache(clock=clock)
+    calls = []
+    assert cache.get("a", lambda key: calls.append(key)) is None
+    assert cache.get("a", lambda key: calls.append(key)) is None
+    assert calls == ["a", "a"]
+
+def test_invalidate_and_clear(clock):
+    cache = RequestCache(clock=clock)
+    loader = Loader()
+    cache.get("a", loader)
+    cache.get("b", loader)
+
+    cache.invalidate("a")
+    assert cache.get("a", loader)["version"] == 3
+    assert cache.get("b", loader)["version"] == 2
+
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+    assert cache.get("b", loader)["version"] == 4
+
+def test_invalidate_during_load_discards_result(clock):
+    cache = RequestCache(clock=clock)
+
+    def stale_loader(key):
+        # 読み込み中に別のスレッドが更新・無効化した
+        cache.invalidate(key)
+        return {"id": key, "status": 0, "version": "stale"}
+
+    assert cache.get("a", stale_loader)["version"] == "stale"
+    assert cache.get("a", Loader())["version"] == 1
+
+def test_lru_eviction(clock):
+    cache = RequestCache(max_entries=2, clock=clock)
+    loader = Loader()
+    cache.get("a", loader)
+    cache.get("b", loader)
+    cache.get("a", loader)  # a を最近使ったものにする
+    cache.get("c", loader)
+
+    assert cache.stats()["entries"] == 2
+    calls = loader.calls
+    cache.get("a", loader)
+    assert loader.calls == calls
+    cache.get("b", loader)
+    assert loader.calls == calls + 1
+
+def test_concurrent_misses_share_one_load():
+    cache = RequestCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_loader(key):
+        calls.append(key)
+        started.set()
+        release.wait(5)
+        return {"id": key, "status": 0}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("a", slow_loader))) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["a"]
+    assert len(results) == 5
+    assert all(result == {"id": "a", "status": 0} for result in results)
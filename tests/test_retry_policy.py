@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""retry_policy の待機秒数・再試行回数・一括再送の間隔"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import retry_policy
+from retry_policy import (backoff_seconds, should_retry, next_attempt_at, staggered_attempt_times,
+                          get_policy, ERROR_CLASSES, ERROR_LINE_BUSY, ERROR_SEND_FAILED, ERROR_DIALOG_NOT_FOUND,
+                          BULK_RETRY_STAGGER_SECONDS)
+
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    """ジッターを最小（0）に固定する"""
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: low)
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: high)
+
+def test_backoff_doubles_per_attempt_and_is_capped(max_jitter):
+    # line_busy: 120秒から倍々で、1800秒が上限
+    assert [backoff_seconds(ERROR_LINE_BUSY, n) for n in range(1, 7)] == [120, 240, 480, 960, 1800, 1800]
+
+def test_backoff_jitter_keeps_at_least_half(no_jitter):
+    assert [backoff_seconds(ERROR_LINE_BUSY, n) for n in range(1, 4)] == [60, 120, 240]
+
+@pytest.mark.parametrize("error_class", ERROR_CLASSES)
+def test_backoff_stays_within_bounds(error_class):
+    policy = get_policy(error_class)
+    random.seed(0)
+    for attempt in range(1, 10):
+        delay = min(policy["max_seconds"], policy["base_seconds"] * 2 ** (attempt - 1))
+        for _ in range(20):
+            assert delay / 2 <= backoff_seconds(error_class, attempt) <= delay
+
+def test_unknown_error_class_uses_send_failed_policy(max_jitter):
+    assert backoff_seconds("unknown", 2) == backoff_seconds(ERROR_SEND_FAILED, 2)
+    assert should_retry("unknown", 2) is True
+    assert should_retry("unknown", 3) is False
+
+def test_should_retry_until_max_attempts():
+    max_attempts = get_policy(ERROR_DIALOG_NOT_FOUND)["max_attempts"]
+    assert all(should_retry(ERROR_DIALOG_NOT_FOUND, n) for n in range(max_attempts))
+    assert should_retry(ERROR_DIALOG_NOT_FOUND, max_attempts) is False
+
+def test_backoff_follows_tuning(max_jitter, tuning_values):
+    tuning_values(retry_line_busy_base_seconds=10, retry_line_busy_max_seconds=30, retry_line_busy_max_attempts=2)
+    assert [backoff_seconds(ERROR_LINE_BUSY, n) for n in range(1, 4)] == [10, 20, 30]
+    assert should_retry(ERROR_LINE_BUSY, 1) is True
+    assert should_retry(ERROR_LINE_BUSY, 2) is False
+
+def test_next_attempt_at_adds_backoff(max_jitter):
+    assert next_attempt_at(ERROR_LINE_BUSY, 2, NOW) == NOW + timedelta(seconds=240)
+
+def test_staggered_attempt_times_are_spread_and_ordered():
+    random.seed(0)
+    times = staggered_attempt_times(5, NOW)
+    assert len(times) == 5
+    assert times == sorted(times)
+    for i, value in enumerate(times):
+        offset = (value - NOW).total_seconds()
+        assert i * BULK_RETRY_STAGGER_SECONDS <= offset <= i * BULK_RETRY_STAGGER_SECONDS + BULK_RETRY_STAGGER_SECONDS / 2
+
+def test_staggered_attempt_times_empty():
+    assert staggered_attempt_times(0, NOW) == []
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""scheduler の優先度・エイジングと、SQLite上でのジョブの取得"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import pacer
+import scheduler
+from scheduler import (parse_priority, lane_name, effective_priority, select_next_job,
+                       PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_LOW)
+
+AGING_SECONDS_PER_LEVEL = 300
+
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+def _job(job_id, priority, waited_seconds):
+    return {"id": job_id, "priority": priority,
+            "created_at": (NOW - timedelta(seconds=waited_seconds)).isoformat()}
+
+# -------------------------------
+# 優先度
+# -------------------------------
+
+@pytest.mark.parametrize("value, expected", [
+    (None, PRIORITY_NORMAL),
+    ("", PRIORITY_NORMAL),
+    ("urgent", PRIORITY_URGENT),
+    (" Low ", PRIORITY_LOW),
+    ("2", PRIORITY_URGENT),
+    (0, PRIORITY_LOW),
+])
+def test_parse_priority(value, expected):
+    assert parse_priority(value) == expected
+
+@pytest.mark.parametrize("value", ["high", 3, -1, True, 1.5])
+def test_parse_priority_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_priority(value)
+
+def test_lane_name():
+    assert lane_name(PRIORITY_URGENT) == "urgent"
+    assert lane_name(PRIORITY_LOW) == "low"
+    assert lane_name(99) == "normal"
+
+# -------------------------------
+# エイジング
+# -------------------------------
+
+def test_effective_priority_rises_with_wait():
+    assert effective_priority(_job("a", PRIORITY_LOW, 0), NOW) == PRIORITY_LOW
+    assert effective_priority(_job("a", PRIORITY_LOW, AGING_SECONDS_PER_LEVEL), NOW) == PRIORITY_LOW + 1
+    # priority・created_at がない場合は normal・待ち時間0として扱う
+    assert effective_priority({}, NOW) == PRIORITY_NORMAL
+
+def test_select_next_job_prefers_higher_lane():
+    jobs = [_job("low", PRIORITY_LOW, 60), _job("normal", PRIORITY_NORMAL, 60), _job("urgent", PRIORITY_URGENT, 0)]
+    assert select_next_job(jobs, NOW)["id"] == "urgent"
+
+def test_select_next_job_aged_low_overtakes_normal():
+    aged_low = _job("low", PRIORITY_LOW, AGING_SECONDS_PER_LEVEL * 2)
+    fresh_normal = _job("normal", PRIORITY_NORMAL, 10)
+    assert select_next_job([fresh_normal, aged_low], NOW)["id"] == "low"
+
+def test_select_next_job_breaks_ties_by_age():
+    older = _job("older", PRIORITY_NORMAL, 0)
+    older["priority"] = PRIORITY_URGENT
+    newer_aged = _job("newer", PRIORITY_NORMAL, AGING_SECONDS_PER_LEVEL)
+    # 実効優先度は同じ（2）なので、長く待っている方を選ぶ
+    assert select_next_job([older, newer_aged], NOW)["id"] == "newer"
+
+def test_aging_follows_tuning(tuning_values):
+    aged_low = _job("low", PRIORITY_LOW, 600)
+    fresh_normal = _job("normal", PRIORITY_NORMAL, 10)
+    # エイジングを遅くすると、同じ待ち時間の低優先度ジョブは追い越さない
+    tuning_values(aging_seconds_per_level=3600)
+    assert select_next_job([fresh_normal, aged_low], NOW)["id"] == "normal"
+
+def test_select_next_job_empty():
+    assert select_next_job([], NOW) is None
+
+# -------------------------------
+# ジョブの取得（SQLite）
+# -------------------------------
+
+def test_claim_next_job_takes_urgent_first(db):
+    normal = db.add_fax_request("file:///a.pdf", "0311111111", priority=PRIORITY_NORMAL)
+    urgent = db.add_fax_request("file:///b.pdf", "0322222222", priority=PRIORITY_URGENT)
+
+    job, retry_after = scheduler.claim_next_job()
+    assert job["id"] == urgent["id"]
+    assert retry_after is None
+    assert job["attempt_count"] == 1
+    assert db.get_request_by_id(urgent["id"], use_cache=False)["status"] == 2
+
+    job, _ = scheduler.claim_next_job()
+    assert job["id"] == normal["id"]
+    assert scheduler.claim_next_job() == (None, None)
+
+def test_claim_next_job_skips_busy_destination(db):
+    busy = db.add_fax_request("file:///a.pdf", "0311111111", priority=PRIORITY_URGENT)
+    other = db.add_fax_request("file:///b.pdf", "0322222222", priority=PRIORITY_LOW)
+    pacer.record_busy(busy["fax_number"], datetime.now())
+
+    job, _ = scheduler.claim_next_job()
+    assert job["id"] == other["id"]
+
+    # 話中の宛先だけが残った場合は、送信可能になるまでの秒数を返す
+    job, retry_after = scheduler.claim_next_job()
+    assert job is None
+    assert 0 < retry_after <= 120
+
+def test_get_queue_depths(db):
+    db.add_fax_request("file:///a.pdf", "0311111111", priority=PRIORITY_LOW)
+    db.add_fax_request("file:///b.pdf", "0322222222", priority=PRIORITY_LOW)
+
+    depths = {lane["lane"]: lane for lane in scheduler.get_queue_depths()}
+    assert [lane["lane"] for lane in scheduler.get_queue_depths()] == ["urgent", "normal", "low"]
+    assert depths["low"]["pending"] == 2
+    assert depths["urgent"]["pending"] == 0
+
+def test_fail_mode_fails_blocked_destinations_in_one_scan(db, tuning_values, monkeypatch):
+    import circuit_breaker
+    blocked = ["0311111111", "0322222222"]
+    jobs = [db.add_fax_request("file:///a.pdf", number, priority=priority)["id"]
+            for number in blocked for priority in (PRIORITY_URGENT, PRIORITY_LOW)]
+    other = db.add_fax_request("file:///b.pdf", "0333333333", priority=PRIORITY_LOW)
+    for number in blocked:
+        for _ in range(3):
+            circuit_breaker.record_result(number, False, "send_failed", "送信失敗")
+    tuning_values(breaker_mode="fail")
+
+    scans = []
+    original = circuit_breaker.get_pending_request_destinations
+    monkeypatch.setattr(circuit_breaker, "get_pending_request_destinations",
+                        lambda: scans.append(1) or original())
+
+    job, _ = scheduler.claim_next_job()
+    assert job["id"] == other["id"]
+    # 遮断中の宛先が複数あっても、待機中ジョブの走査は1回
+    assert len(scans) == 1
+    assert all(db.get_request_by_id(job_id, use_cache=False)["status"] == -1 for job_id in jobs)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""tuning.json の読み直しと、ワーカー・スケジューラーの動作への反映"""
+
+from datetime import datetime, timedelta
+
+import circuit_breaker
+import lease
+import retry_policy
+import scheduler
+import tuning
+
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+def _job(job_id, priority, waited_seconds):
+    return {"id": job_id, "priority": priority,
+            "created_at": (NOW - timedelta(seconds=waited_seconds)).isoformat()}
+
+def test_defaults_without_file():
+    snapshot = tuning.snapshot()
+    assert snapshot["file_exists"] is False
+    assert all(item["source"] != "file" for item in snapshot["settings"])
+    assert tuning.get("aging_seconds_per_level") == 300
+
+def test_file_changes_scheduler_aging(tuning_file):
+    jobs = [_job("normal", scheduler.PRIORITY_NORMAL, 10), _job("low", scheduler.PRIORITY_LOW, 600)]
+    assert scheduler.select_next_job(jobs, NOW)["id"] == "low"
+
+    assert tuning_file({"aging_seconds_per_level": 3600}) is True
+    assert scheduler.select_next_job(jobs, NOW)["id"] == "normal"
+
+def test_file_changes_retry_backoff(tuning_file, monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: high)
+    tuning_file({"retry_dialog_not_found_base_seconds": 2, "retry_dialog_not_found_max_attempts": 5})
+
+    assert retry_policy.next_attempt_at("dialog_not_found", 1, NOW) == NOW + timedelta(seconds=2)
+    assert retry_policy.should_retry("dialog_not_found", 4) is True
+
+def test_file_changes_lease_and_breaker(tuning_file):
+    tuning_file({"lease_seconds": 60, "heartbeat_interval_seconds": 10,
+                 "breaker_cooldown_seconds": 600, "breaker_cooldown_max_seconds": 1000})
+
+    assert lease.lease_expiry(NOW) == NOW + timedelta(seconds=60)
+    assert [circuit_breaker.cooldown_seconds(n) for n in (1, 2, 3)] == [600, 1000, 1000]
+
+def test_invalid_file_keeps_previous_values(tuning_file):
+    tuning_file({"lease_seconds": 60})
+    # 範囲外・大小関係の誤りはファイル全体を採用しない
+    assert tuning_file({"lease_seconds": 90, "tab_presses": 0}) is False
+    assert tuning.get("lease_seconds") == 60
+    assert tuning_file({"lease_seconds": 20, "heartbeat_interval_seconds": 30}) is False
+    assert tuning.get("lease_seconds") == 60
+    assert "heartbeat_interval_seconds" in tuning.snapshot()["last_error"]
+
+def test_removed_knobs_are_ignored():
+    # 廃止した項目が残っている既存のファイルも、ほかの項目は採用する
+    values, errors = tuning.validate({"send_max_retries": 3, "tab_presses": 8})
+    assert values == {"tab_presses": 8}
+    assert errors == []
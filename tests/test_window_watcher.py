@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""window_watcher の待機処理と、fax_sender のダイアログ操作（FakeWindowProvider で確認）、ワーカーでの送信失敗の扱い"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from window_watcher import (FakeWindowProvider, poll_intervals, wait_until, wait_for_window, wait_for_active,
+                            POLL_INITIAL_INTERVAL, POLL_MAX_INTERVAL)
+import fax_sender
+from fax_sender import send_fax_attempt, LineBusyError, DialogNotFoundError, DestinationWarningError
+
+class FakeKeyboard:
+    """pyautogui の代わりに押されたキーを記録する"""
+
+    def __init__(self):
+        self.keys = []
+        self.typed = []
+
+    def click(self, x, y):
+        pass
+
+    def typewrite(self, text, interval=0):
+        self.typed.append(text)
+
+    def press(self, key, presses=1, interval=0):
+        self.keys.extend([key] * presses)
+
+def _no_launch(pdf_path):
+    pass
+
+# -------------------------------
+# ポーリング
+# -------------------------------
+
+def test_poll_intervals_back_off_up_to_maximum():
+    intervals = poll_intervals()
+    values = [next(intervals) for _ in range(10)]
+    assert values[0] == POLL_INITIAL_INTERVAL
+    assert values == sorted(values)
+    assert values[-1] == POLL_MAX_INTERVAL
+
+def test_wait_until_returns_value_without_sleeping_when_ready(clock):
+    assert wait_until(lambda: "ok", 5, sleep=clock.sleep, clock=clock) == "ok"
+    assert clock.sleeps == []
+
+def test_wait_until_times_out_exactly_at_deadline(clock):
+    assert wait_until(lambda: None, 2, sleep=clock.sleep, clock=clock) is None
+    # 最後の待機は残り時間に切り詰められ、タイムアウトを超えて待たない
+    assert sum(clock.sleeps) == pytest.approx(2)
+    assert clock.sleeps[0] == POLL_INITIAL_INTERVAL
+    assert max(clock.sleeps) <= POLL_MAX_INTERVAL
+
+def test_wait_for_window_finds_window_after_it_appears(clock):
+    provider = FakeWindowProvider(clock=clock)
+    provider.add_window("ファクス送信 - FX 5570", appear_after=1.2)
+
+    title, window = wait_for_window(["ファクス送信"], 30, provider, sleep=clock.sleep, clock=clock)
+
+    assert title == "ファクス送信 - FX 5570"
+    assert window is not None
+    # 出現後、最大の間隔以内に検出する
+    assert 1.2 <= clock.now - 1000.0 < 1.2 + POLL_MAX_INTERVAL
+
+def test_wait_for_window_times_out(clock):
+    provider = FakeWindowProvider(clock=clock)
+    provider.add_window("別のウィンドウ")
+
+    assert wait_for_window(["ファクス送信"], 3, provider, sleep=clock.sleep, clock=clock) == (None, None)
+    assert sum(clock.sleeps) == pytest.approx(3)
+    # 間隔を広げるため、0.05秒ごとに問い合わせ続けない
+    assert provider.title_queries < 3 / POLL_INITIAL_INTERVAL
+
+def test_wait_for_active_reactivates_until_active(clock):
+    provider = FakeWindowProvider(clock=clock)
+    window = provider.add_window("ファクス送信", activate_delay=1.0)
+
+    assert wait_for_active(window, 5, reactivate_interval=0.5, sleep=clock.sleep, clock=clock) is True
+    assert window.activate_calls >= 2
+
+def test_wait_for_active_times_out(clock):
+    provider = FakeWindowProvider(clock=clock)
+    window = provider.add_window("ファクス送信", activate_delay=60)
+
+    assert wait_for_active(window, 2, sleep=clock.sleep, clock=clock) is False
+    assert sum(clock.sleeps) == pytest.approx(2)
+
+# -------------------------------
+# ダイアログ操作（fax_sender）
+# -------------------------------
+
+@pytest.fixture
+def fast_dialogs(tuning_values, monkeypatch):
+    tuning_values(dialog_timeout_seconds=1, warning_timeout_seconds=0.5, input_settle_seconds=0,
+                  type_interval_seconds=0, tab_interval_seconds=0)
+    monkeypatch.setattr(fax_sender.time, "sleep", lambda seconds: None)
+
+def test_send_fax_attempt_succeeds_without_warning(fast_dialogs):
+    provider = FakeWindowProvider()
+    provider.add_window("ファクス送信")
+    keyboard = FakeKeyboard()
+
+    assert send_fax_attempt("test.pdf", "0312345678", provider, keyboard, _no_launch) is True
+    assert keyboard.typed == ["0312345678"]
+    assert keyboard.keys == ["tab"] * 9 + ["enter"]
+
+def test_send_fax_attempt_uses_tuned_tab_presses(fast_dialogs, tuning_values):
+    tuning_values(tab_presses=4)
+    provider = FakeWindowProvider()
+    provider.add_window("ファクス送信")
+    keyboard = FakeKeyboard()
+
+    send_fax_attempt("test.pdf", "0312345678", provider, keyboard, _no_launch)
+    assert keyboard.keys.count("tab") == 4
+
+def test_send_fax_attempt_raises_line_busy(fast_dialogs):
+    provider = FakeWindowProvider()
+    provider.add_window("ファクス送信")
+    provider.add_window("相手先話中", appear_after=0.1)
+    keyboard = FakeKeyboard()
+
+    with pytest.raises(LineBusyError):
+        send_fax_attempt("test.pdf", "0312345678", provider, keyboard, _no_launch)
+    # 話中ダイアログを閉じてから送出する
+    assert keyboard.keys[-2:] == ["enter", "enter"]
+
+def test_send_fax_attempt_dismisses_routine_warning(fast_dialogs):
+    provider = FakeWindowProvider()
+    provider.add_window("ファクス送信")
+    provider.add_window("警告", appear_after=0.1)
+    keyboard = FakeKeyboard()
+
+    # 毎回表示される「警告」はOKで閉じて送信成功とする
+    assert send_fax_attempt("test.pdf", "0312345678", provider, keyboard, _no_launch) is True
+    assert keyboard.keys[-2:] == ["enter", "enter"]
+
+def test_send_fax_attempt_raises_on_destination_error_dialog(fast_dialogs, monkeypatch):
+    monkeypatch.setattr(fax_sender, "DESTINATION_ERROR_KEYWORDS", ["送信エラー"])
+    provider = FakeWindowProvider()
+    provider.add_window("ファクス送信")
+    provider.add_window("送信エラー", appear_after=0.1)
+
+    with pytest.raises(DestinationWarningError):
+        send_fax_attempt("test.pdf", "0312345678", provider, FakeKeyboard(), _no_launch)
+
+def test_send_fax_attempt_raises_when_dialog_missing(fast_dialogs):
+    with pytest.raises(DialogNotFoundError):
+        send_fax_attempt("test.pdf", "0312345678", FakeWindowProvider(), FakeKeyboard(), _no_launch)
+
+# -------------------------------
+# ワーカーでの送信失敗の扱い（fax_worker は send_fax_attempt を1回だけ呼び、失敗は再送予約にする）
+# -------------------------------
+
+@pytest.fixture
+def worker_job(db, monkeypatch, tmp_path):
+    """このワーカーが取得した事前処理済みのジョブ（ダウンロード・送付状・後片付けは行わない）"""
+    import fax_worker
+    import lease
+
+    pdf_path = tmp_path / "prepared.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4")
+    monkeypatch.setattr(fax_worker, "prepared_pdf_for", lambda request_data: str(pdf_path))
+    monkeypatch.setattr(fax_worker, "COVER_PAGE_ENABLED", False)
+    monkeypatch.setattr(fax_worker, "schedule_cleanup", lambda workspace: None)
+
+    request_data = db.add_fax_request("file:///a.pdf", "03-1234-5678")
+    db.claim_request(request_data["id"], lease.WORKER_ID, datetime.now() + timedelta(minutes=5))
+    request_data["attempt_count"] = 1
+    return request_data
+
+def _send_raising(monkeypatch, error):
+    import fax_worker
+    calls = []
+
+    def send(pdf_path, fax_number):
+        calls.append(fax_number)
+        raise error
+
+    monkeypatch.setattr(fax_worker, "send_fax_attempt", send)
+    return calls
+
+def test_worker_defers_busy_line_without_opening_breaker(db, worker_job, monkeypatch):
+    import fax_worker
+    calls = _send_raising(monkeypatch, LineBusyError("話中"))
+
+    assert fax_worker.process_single_fax_request(worker_job) is False
+    assert len(calls) == 1
+    row = db.get_request_by_id(worker_job["id"], use_cache=False)
+    assert row["status"] == 0
+    assert row["last_error_class"] == "line_busy"
+    assert row["next_attempt_at"] is not None
+    # 話中は宛先の送信間隔を空けるが、宛先の異常としては数えない
+    pacing = db.get_destination_pacing("0312345678")
+    assert pacing["last_result"] == "busy"
+    assert pacing["busy_count"] == 1
+    breaker = db.get_destination_breaker("0312345678")
+    assert breaker is None or breaker["consecutive_failures"] == 0
+
+def test_worker_retries_missing_dialog_without_counting_destination(db, worker_job, monkeypatch):
+    import fax_worker
+    _send_raising(monkeypatch, DialogNotFoundError("ダイアログなし"))
+
+    assert fax_worker.process_single_fax_request(worker_job) is False
+    row = db.get_request_by_id(worker_job["id"], use_cache=False)
+    assert row["status"] == 0
+    assert row["last_error_class"] == "dialog_not_found"
+    assert db.get_destination_pacing("0312345678")["last_result"] == "failed"
+    breaker = db.get_destination_breaker("0312345678")
+    assert breaker is None or breaker["consecutive_failures"] == 0
+
+def test_worker_counts_unclassified_failure_against_destination(db, worker_job, monkeypatch):
+    import fax_worker
+    _send_raising(monkeypatch, RuntimeError("キー操作に失敗"))
+
+    assert fax_worker.process_single_fax_request(worker_job) is False
+    row = db.get_request_by_id(worker_job["id"], use_cache=False)
+    assert row["status"] == 0
+    assert row["last_error_class"] == "send_failed"
+    assert db.get_destination_breaker("0312345678")["consecutive_failures"] == 1
+
+def test_worker_fails_job_after_max_attempts(db, worker_job, monkeypatch, tuning_values):
+    import fax_worker
+    tuning_values(retry_send_failed_max_attempts=1)
+    _send_raising(monkeypatch, RuntimeError("キー操作に失敗"))
+
+    assert fax_worker.process_single_fax_request(worker_job) is False
+    row = db.get_request_by_id(worker_job["id"], use_cache=False)
+    assert row["status"] == -1
+    assert row["last_error_class"] == "send_failed"
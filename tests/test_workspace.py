@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""ジョブ作業ディレクトリの作成・バックグラウンド削除・起動時スイープ"""
+
+import os
+import time
+
+import workspace
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+def test_workspaces_are_unique_per_job():
+    first = workspace.create_job_workspace("same-id")
+    second = workspace.create_job_workspace("same-id")
+    assert first != second
+    assert os.path.dirname(first) == workspace.WORKSPACE_ROOT
+
+def test_schedule_cleanup_removes_workspace():
+    path = workspace.create_job_workspace("cleanup")
+    with open(os.path.join(path, "send.pdf"), "wb") as f:
+        f.write(b"%PDF")
+
+    workspace.schedule_cleanup(path)
+    assert workspace.wait_for_cleanup(timeout=5) is True
+    assert not os.path.exists(path)
+
+def test_sweep_reclaims_only_stale_workspaces():
+    stale = workspace.create_job_workspace("stale")
+    fresh = workspace.create_job_workspace("fresh")
+    _age(stale, workspace.STALE_WORKSPACE_SECONDS + 60)
+
+    workspace.sweep_stale_workspaces()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+def test_sweep_leaves_files_outside_workspace_root():
+    # リポジトリに含まれる temp_fax_*.pdf などカレントディレクトリのファイルは消さない
+    path = "temp_fax_20251021_160118.pdf"
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+    _age(path, workspace.STALE_WORKSPACE_SECONDS + 60)
+
+    workspace.sweep_stale_workspaces()
+    assert os.path.exists(path)
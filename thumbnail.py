@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+送信ファイルの1ページ目のプレビュー画像（管理画面・詳細画面用）
+初回だけ描画してディスクにキャッシュし、以降は小さなPNGを返す（PDF全体を転送しない）
+
+  thumbnail_cache/<IDの先頭2文字>/<ID>-<元ファイルのキー>.png
+
+  - 元ファイル（送信用PDF・変換後PDF・アップロードファイル）のパス・サイズ・更新日時からキーを作り、
+    元ファイルが作り直された場合は別のキャッシュになる
+  - キャッシュの合計が THUMBNAIL_CACHE_MAX_BYTES を超えたら、最後に使われたのが古いものから削除する
+  - PDFの描画には pypdfium2 を使う（なければ1ページ目に埋め込まれた画像で代用。スキャン・画像から変換したPDFはこれで足りる）
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+from fetcher import local_path_from_url, fetch, FetchError
+from workspace import create_job_workspace, schedule_cleanup
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+THUMBNAIL_FOLDER = "thumbnail_cache"
+# プレビューの幅（ピクセル）
+THUMBNAIL_WIDTH = int(os.environ.get("FAX_THUMBNAIL_WIDTH", "240"))
+# キャッシュの合計サイズの上限
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get("FAX_THUMBNAIL_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# 古いキャッシュの削除を確認する間隔（秒）
+EVICT_INTERVAL_SECONDS = 60
+# キーを含むURL（/thumbnail/<id>?v=<キー>）をブラウザにキャッシュさせる秒数
+# （元ファイルが変わるとキーが変わり別のURLになる。キーなしのURLは毎回ETagで確認させる）
+THUMBNAIL_MAX_AGE = 7 * 24 * 3600
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.tif')
+
+_evict_lock = threading.Lock()
+_last_evicted_at = None
+
+class ThumbnailUnavailable(Exception):
+    """プレビューを作成できない（元ファイルがない・描画できない形式など）"""
+
+def source_for(request_data):
+    """プレビューの元にするファイル（ローカルのパス, 取得が必要なURL）
+
+    送信用PDF（送付状なしの本文）→ 変換後PDF → アップロードされた元ファイル の順に、存在するものを使う
+    """
+    for path in (request_data.get("prepared_pdf_path"), request_data.get("converted_pdf_path")):
+        if path and os.path.exists(path):
+            return path, None
+    file_url = request_data.get("file_url")
+    if not file_url:
+        return None, None
+    local_path = local_path_from_url(file_url)
+    if local_path is None:
+        return None, file_url
+    return (local_path, None) if os.path.exists(local_path) else (None, None)
+
+def cache_key(request_data):
+    """キャッシュのキー（ETagにも使う）。元ファイルがなければ None"""
+    path, url = source_for(request_data)
+    if path:
+        stat = os.stat(path)
+        source = f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    elif url:
+        source = url
+    else:
+        return None
+    return hashlib.sha1(f"{source}:{THUMBNAIL_WIDTH}".encode("utf-8")).hexdigest()[:16]
+
+def cache_path(request_id, key):
+    return os.path.join(THUMBNAIL_FOLDER, request_id[:2], f"{request_id}-{key}.png")
+
+def _is_pdf(path):
+    with open(path, "rb") as f:
+        return b"%PDF-" in f.read(1024)
+
+def _render_pdf_first_page(pdf_path):
+    """PDFの1ページ目を画像（PIL）にする"""
+    if pypdfium2 is not None:
+        document = pypdfium2.PdfDocument(pdf_path)
+        try:
+            page = document[0]
+            scale = THUMBNAIL_WIDTH / page.get_width()
+            # 縮小時にもう一段なめらかにするため、2倍で描画してから縮める
+            return page.render(scale=scale * 2, grayscale=True).to_pil()
+        finally:
+            document.close()
+
+    from pypdf import PdfReader
+    with open(pdf_path, "rb") as f:
+        images = PdfReader(f).pages[0].images
+        if not images:
+            raise ThumbnailUnavailable("PDFの描画に pypdfium2 が必要です")
+        return max((item.image for item in images), key=lambda img: img.width * img.height)
+
+def render(source_path, output_path):
+    """元ファイルの1ページ目を幅 THUMBNAIL_WIDTH のPNGにして output_path に保存"""
+    from PIL import Image
+
+    if _is_pdf(source_path):
+        img = _render_pdf_first_page(source_path)
+    else:
+        img = Image.open(source_path)
+        img.seek(0)  # 複数ページのTIFFは1ページ目
+    img = img.convert("L")
+    img.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", optimize=True)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = f"{output_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(temp_path, output_path)
+
+def get_thumbnail(request_data):
+    """プレビュー画像のパスとキーを返す（キャッシュになければ作成）。作成できなければ ThumbnailUnavailable"""
+    request_id = request_data["id"]
+    key = cache_key(request_data)
+    if key is None:
+        raise ThumbnailUnavailable("元ファイルが見つかりません")
+
+    path = cache_path(request_id, key)
+    if os.path.exists(path):
+        # 最後に使われた日時として更新日時を更新（削除する順序に使う）
+        os.utime(path)
+        return path, key
+
+    started = time.monotonic()
+    source_path, url = source_for(request_data)
+    workspace = None
+    try:
+        if source_path is None:
+            # リモートのファイルしかない場合（事前処理前など）は一度だけ取得して描画する
+            workspace = create_job_workspace(request_id)
+            source_path = os.path.join(workspace, "thumbnail_source")
+            fetch(url, source_path)
+        render(source_path, path)
+    except ThumbnailUnavailable:
+        raise
+    except FetchError as e:
+        raise ThumbnailUnavailable(str(e))
+    except Exception as e:
+        raise ThumbnailUnavailable(f"プレビューを作成できません: {e}")
+    finally:
+        if workspace:
+            schedule_cleanup(workspace)
+
+    elapsed = (time.monotonic() - started) * 1000
+    print(f"[thumbnail] プレビューを作成しました: ID={request_id}（{elapsed:.0f}ms）")
+    evict_if_needed()
+    return path, key
+
+def evict_if_needed(force=False):
+    """キャッシュの合計が上限を超えていれば、最後に使われたのが古いものから削除する。戻り値は削除した件数"""
+    global _last_evicted_at
+    now = time.monotonic()
+    with _evict_lock:
+        if not force and _last_evicted_at is not None and now - _last_evicted_at < EVICT_INTERVAL_SECONDS:
+            return 0
+        _last_evicted_at = now
+
+        entries = []
+        total = 0
+        for root, _, files in os.walk(THUMBNAIL_FOLDER):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= THUMBNAIL_CACHE_MAX_BYTES:
+            return 0
+
+        # 上限の8割まで減らす（上限付近で毎回削除が走らないようにする）
+        target = THUMBNAIL_CACHE_MAX_BYTES * 0.8
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        print(f"[thumbnail] 古いプレビューを削除しました（{removed}件）")
+        return removed
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+実行時の調整値（ワーカー・APIサーバー共通）
+tuning.json（FAX_TUNING_FILE で変更可）から読み込み、ファイルが更新されたら再起動せずに読み直す
+
+  - ファイルにない項目は既定値を使う（ファイルがなければすべて既定値）。
+    env を持つ項目は、その環境変数が既定値になる（従来の環境変数での設定との互換用。不正な値は無視する）
+  - 型・範囲を検証し、不正な項目が1つでもあればファイル全体を採用せず、直前の値を使い続ける
+  - 更新の確認はファイルの更新日時とサイズを見るだけで、RELOAD_CHECK_SECONDS 秒に1回まで
+  - 現在の値は /tuning で確認できる
+  - 起動時に一度だけ使う値（スレッドプールの大きさなど）は env_int で環境変数を検証して読む
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+TUNING_FILE = os.environ.get("FAX_TUNING_FILE", "tuning.json")
+# ファイルの更新を確認する間隔（秒）
+RELOAD_CHECK_SECONDS = 2
+
+# 項目ごとの型・既定値・範囲
+SETTINGS = {
+    # ワーカー
+    "worker_poll_interval_seconds": {"type": float, "default": 1.0, "min": 0, "max": 60,
+                                     "description": "1件処理してから次のジョブを取得するまでの待機秒数"},
+    "worker_max_idle_wait_seconds": {"type": float, "default": 120.0, "min": 0, "max": 3600,
+                                     "description": "送信保留中のジョブだけが残っている場合に待機する最大秒数"},
+    # スケジューラー
+    "aging_seconds_per_level": {"type": float, "default": 300.0, "min": 1, "max": 86400,
+                                "description": "待機中のジョブの優先度を1段階引き上げるまでの待ち秒数（エイジング）"},
+    # ジョブのリース（lease）
+    "lease_seconds": {"type": float, "default": 120.0, "min": 10, "max": 3600,
+                      "description": "処理中ジョブのリースの有効秒数（ハートビートの間隔より長くする）"},
+    "heartbeat_interval_seconds": {"type": float, "default": 30.0, "min": 1, "max": 600,
+                                   "description": "リースを延長するハートビートの間隔"},
+    "job_max_seconds": {"type": float, "default": 900.0, "min": 60, "max": 7200,
+                        "description": "これを超えたジョブは固まったとみなし、ハートビートを止めて回収させる秒数"},
+    "lease_max_attempts": {"type": int, "default": 3, "min": 1, "max": 20,
+                           "description": "リース切れで回収されたジョブをエラーにする試行回数"},
+    # FAXドライバーの操作
+    "printer_name": {"type": str, "default": "FX 5570 FAX Driver",
+                     "description": "FAXドライバー（プリンター）名"},
+    "dialog_timeout_seconds": {"type": float, "default": 30.0, "min": 1, "max": 300,
+                               "description": "FAX送信ダイアログの出現を待つ最大秒数"},
+    "activate_timeout_seconds": {"type": float, "default": 5.0, "min": 0.5, "max": 60,
+                                 "description": "ダイアログのアクティブ化を待つ最大秒数"},
+    "warning_timeout_seconds": {"type": float, "default": 7.5, "min": 0.5, "max": 60,
+                                "description": "送信開始後の警告・話中ダイアログを待つ秒数"},
+    "type_interval_seconds": {"type": float, "default": 0.1, "min": 0, "max": 1,
+                              "description": "宛先番号の1文字ごとの入力間隔"},
+    "tab_presses": {"type": int, "default": 9, "min": 1, "max": 30,
+                    "description": "「送信開始」ボタンまでのTabキーの回数"},
+    "tab_interval_seconds": {"type": float, "default": 0.2, "min": 0, "max": 2,
+                             "description": "Tabキーの押下間隔"},
+    "input_settle_seconds": {"type": float, "default": 0.2, "min": 0, "max": 5,
+                             "description": "クリック・入力直後にフォーカスが落ち着くまでの待ち"},
+    # コールバック通知
+    "callback_timeout_seconds": {"type": float, "default": 30.0, "min": 1, "max": 120,
+                                 "description": "コールバック通知のタイムアウト秒数"},
+    # ファイル取得（fetcher）
+    "fetch_connect_timeout_seconds": {"type": float, "default": 5.0, "min": 0.5, "max": 60,
+                                      "env": "FAX_FETCH_CONNECT_TIMEOUT",
+                                      "description": "ファイル取得の接続タイムアウト秒数"},
+    "fetch_read_timeout_seconds": {"type": float, "default": 30.0, "min": 1, "max": 600,
+                                   "env": "FAX_FETCH_READ_TIMEOUT",
+                                   "description": "ファイル取得の読み込みタイムアウト（無通信の秒数）"},
+    "fetch_total_timeout_seconds": {"type": float, "default": 120.0, "min": 1, "max": 3600,
+                                    "env": "FAX_FETCH_TOTAL_TIMEOUT",
+                                    "description": "1ファイルの取得にかける最大秒数"},
+    "fetch_max_bytes": {"type": int, "default": 50 * 1024 * 1024, "min": 1024, "max": 1024 * 1024 * 1024,
+                        "env": "FAX_FETCH_MAX_BYTES",
+                        "description": "取得するファイルの上限サイズ（バイト）"},
+    # 送信先ごとのペーシング（pacer）
+    "pace_burst": {"type": int, "default": 3, "min": 1, "max": 50,
+                   "description": "同じ送信先へ連続して送信できる最大件数（トークンバケットの容量）"},
+    "pace_refill_seconds": {"type": float, "default": 60.0, "min": 1, "max": 3600,
+                            "description": "1件分のトークンが回復するまでの秒数"},
+    "busy_backoff_seconds": {"type": float, "default": 120.0, "min": 1, "max": 3600,
+                             "description": "話中を検出した送信先の初回の待機秒数（話中が続くと倍）"},
+    "busy_backoff_max_seconds": {"type": float, "default": 1800.0, "min": 1, "max": 86400,
+                                 "description": "話中の送信先の待機秒数の上限"},
+    # 送信先ごとのサーキットブレーカー（circuit_breaker）
+    "breaker_failure_threshold": {"type": int, "default": 3, "min": 1, "max": 50,
+                                  "env": "FAX_BREAKER_THRESHOLD",
+                                  "description": "送信先を遮断するまでの連続失敗回数"},
+    "breaker_mode": {"type": str, "default": "park", "choices": ("park", "fail"),
+                     "env": "FAX_BREAKER_MODE",
+                     "description": "遮断中の送信先のジョブの扱い（park: 保留 / fail: エラーにする）"},
+    "breaker_cooldown_seconds": {"type": float, "default": 1800.0, "min": 60, "max": 86400,
+                                 "description": "初回の遮断時間（遮断のたびに倍）"},
+    "breaker_cooldown_max_seconds": {"type": float, "default": 21600.0, "min": 60, "max": 7 * 86400,
+                                     "description": "遮断時間の上限"},
+}
+
+def _retry_settings(error_class, label, base_seconds, max_seconds, max_attempts):
+    """再送（retry_policy）のエラー種別ごとの項目（初回待機秒数・最大待機秒数・最大試行回数）"""
+    prefix = f"retry_{error_class}"
+    return {
+        f"{prefix}_base_seconds": {"type": float, "default": float(base_seconds), "min": 1, "max": 86400,
+                                   "description": f"{label}の再送の初回待機秒数（失敗が続くと倍）"},
+        f"{prefix}_max_seconds": {"type": float, "default": float(max_seconds), "min": 1, "max": 86400,
+                                  "description": f"{label}の再送の最大待機秒数"},
+        f"{prefix}_max_attempts": {"type": int, "default": max_attempts, "min": 1, "max": 20,
+                                   "description": f"{label}の最大試行回数"},
+    }
+
+# 再送（retry_policy）：エラー種別ごと
+SETTINGS.update(_retry_settings("download_failed", "ファイル取得失敗", 30, 1800, 5))
+SETTINGS.update(_retry_settings("dialog_not_found", "FAXダイアログ未検出", 10, 300, 3))
+SETTINGS.update(_retry_settings("line_busy", "話中", 120, 1800, 6))
+SETTINGS.update(_retry_settings("destination_warning", "送信先のエラーダイアログ", 60, 1800, 3))
+SETTINGS.update(_retry_settings("send_failed", "その他の送信失敗", 30, 600, 3))
+
+# 廃止した項目（既存の tuning.json に残っていてもエラーにせず無視する）
+REMOVED_SETTINGS = ("send_max_retries", "send_retry_delay_seconds")
+
+# 項目間の大小関係（(小さい方, 大きい方)。ファイルの値と既定値を合わせて確認する）
+ORDERED_SETTINGS = [
+    ("heartbeat_interval_seconds", "lease_seconds"),
+    ("lease_seconds", "job_max_seconds"),
+    ("busy_backoff_seconds", "busy_backoff_max_seconds"),
+    ("breaker_cooldown_seconds", "breaker_cooldown_max_seconds"),
+] + [(f"retry_{c}_base_seconds", f"retry_{c}_max_seconds")
+     for c in ("download_failed", "dialog_not_found", "line_busy", "destination_warning", "send_failed")]
+
+def _parse_env(spec, text):
+    """環境変数の文字列を項目の型に変換（検証は validate で行う）"""
+    if spec["type"] is str:
+        return text
+    try:
+        return float(text) if "." in text else int(text)
+    except ValueError:
+        return text
+
+def _env_defaults():
+    """既定値（env を持つ項目は、正しい値が設定されていれば環境変数の値）と、環境変数から読んだ項目"""
+    defaults = {name: spec["default"] for name, spec in SETTINGS.items()}
+    from_env = set()
+    for name, spec in SETTINGS.items():
+        text = os.environ.get(spec.get("env", ""))
+        if not text:
+            continue
+        values, errors = validate({name: _parse_env(spec, text.strip())})
+        if errors:
+            print(f"[tuning] 環境変数 {spec['env']} が不正なため既定値を使います: {errors[0]}")
+            continue
+        defaults[name] = values[name]
+        from_env.add(name)
+    return defaults, from_env
+
+_lock = threading.Lock()
+_from_file = set()
+_file_signature = None
+_checked_at = None
+_loaded_at = None
+_last_error = None
+
+def validate(data):
+    """ファイルの内容を検証し、(値の辞書, エラーのリスト) を返す"""
+    if not isinstance(data, dict):
+        return {}, ["JSONオブジェクトで指定してください"]
+    values = {}
+    errors = []
+    for name, value in data.items():
+        spec = SETTINGS.get(name)
+        if spec is None and name in REMOVED_SETTINGS:
+            print(f"[tuning] 廃止した項目のため無視します: {name}")
+            continue
+        if spec is None:
+            errors.append(f"{name}: 不明な項目です")
+            continue
+        expected = spec["type"]
+        if expected is str:
+            if not isinstance(value, str) or not value.strip():
+                errors.append(f"{name}: 空でない文字列で指定してください")
+                continue
+            value = value.strip()
+            if "choices" in spec and value not in spec["choices"]:
+                errors.append(f"{name}: {' / '.join(spec['choices'])} のいずれかで指定してください: {value}")
+                continue
+        else:
+            # bool は int のサブクラスのため除く
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{name}: 数値で指定してください")
+                continue
+            if expected is int and value != int(value):
+                errors.append(f"{name}: 整数で指定してください")
+                continue
+            value = expected(value)
+            if not spec["min"] <= value <= spec["max"]:
+                errors.append(f"{name}: {spec['min']}〜{spec['max']}の範囲で指定してください: {value}")
+                continue
+        values[name] = value
+    return values, errors
+
+def relation_errors(values):
+    """項目間の大小関係（ORDERED_SETTINGS）のエラーのリスト"""
+    return [f"{smaller} は {larger} 以下にしてください: {values[smaller]} > {values[larger]}"
+            for smaller, larger in ORDERED_SETTINGS if values[smaller] > values[larger]]
+
+def env_int(name, default, minimum=1, maximum=None):
+    """起動時に一度だけ使う整数の環境変数を読む（不正な値は既定値を使い、起動は止めない）"""
+    text = os.environ.get(name)
+    if not text:
+        return default
+    try:
+        value = int(text)
+    except ValueError:
+        value = None
+    if value is None or value < minimum or (maximum is not None and value > maximum):
+        print(f"[tuning] 環境変数 {name} が不正なため既定値 {default} を使います: {text}")
+        return default
+    return value
+
+def _signature():
+    try:
+        stat = os.stat(TUNING_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def reload(force=False):
+    """ファイルが更新されていれば読み直す（戻り値は値が変わったか）"""
+    global _values, _from_file, _file_signature, _checked_at, _loaded_at, _last_error
+    now = time.monotonic()
+    with _lock:
+        if not force and _checked_at is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+            return False
+        _checked_at = now
+        signature = _signature()
+        if not force and signature == _file_signature:
+            return False
+        _file_signature = signature
+
+        if signature is None:
+            values, errors = {}, []
+        else:
+            try:
+                with open(TUNING_FILE, "r", encoding="utf-8") as f:
+                    values, errors = validate(json.load(f))
+            except (OSError, ValueError) as e:
+                values, errors = {}, [f"読み込めません: {e}"]
+        new_values = dict(DEFAULTS, **values)
+        if not errors:
+            errors = relation_errors(new_values)
+        if errors:
+            # 書きかけ・入力ミスのファイルでは動作を変えない（次にファイルが更新されたら読み直す）
+            _last_error = " / ".join(errors)
+            print(f"[tuning] {TUNING_FILE} が不正なため、直前の設定を使い続けます: {_last_error}")
+            return False
+
+        changed = {name: value for name, value in new_values.items() if _values[name] != value}
+        _values = new_values
+        _from_file = set(values)
+        _loaded_at = datetime.now()
+        _last_error = None
+    if changed:
+        print(f"[tuning] 設定を読み込みました: {changed}")
+    return bool(changed)
+
+def get(name):
+    """現在の値（ファイルが更新されていれば読み直してから返す）"""
+    reload()
+    return _values[name]
+
+def current():
+    """現在の値の辞書（1回の処理の間は同じ値を使う場合に。読み直しても返した辞書は変わらない）"""
+    reload()
+    return _values
+
+def snapshot():
+    """/tuning 用の現在の値・既定値・読み込み元"""
+    reload()
+    with _lock:
+        settings = []
+        for name, spec in SETTINGS.items():
+            source = "file" if name in _from_file else "env" if name in _from_env else "default"
+            item = {"name": name, "value": _values[name], "default": spec["default"],
+                    "source": source, "description": spec["description"]}
+            if "min" in spec:
+                item["min"], item["max"] = spec["min"], spec["max"]
+            if "choices" in spec:
+                item["choices"] = list(spec["choices"])
+            settings.append(item)
+        return {
+            "file": os.path.abspath(TUNING_FILE),
+            "file_exists": _file_signature is not None,
+            "loaded_at": _loaded_at.isoformat() if _loaded_at else None,
+            "reload_check_seconds": RELOAD_CHECK_SECONDS,
+            "last_error": _last_error,
+            "settings": settings,
+        }
+
+# 起動時に読み込む（環境変数 → tuning.json の順に反映）
+DEFAULTS, _from_env = _env_defaults()
+_values = dict(DEFAULTS)
+reload(force=True)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+アップロードファイルの保存（コンテンツアドレス方式）
+受信中のデータをチャンクごとにディスクへ書き込みながらSHA-256を計算し、
+ハッシュ値をファイル名として保存する（同じ内容のファイルは1つだけ保存される）
+
+  uploads/.incoming/       受信中の一時ファイル
+  uploads/<先頭2文字>/<sha256><拡張子>   保存済みファイル
+"""
+
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+UPLOAD_FOLDER = "uploads"
+INCOMING_FOLDER = os.path.join(UPLOAD_FOLDER, ".incoming")
+
+# 1ファイルの最大サイズ（バイト）。受信中に超えた時点で中断する
+UPLOAD_MAX_BYTES = int(os.environ.get("FAX_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# フォーム項目分の余裕を含めたリクエスト全体の上限
+REQUEST_MAX_BYTES = UPLOAD_MAX_BYTES + 1024 * 1024
+
+class HashingUploadFile:
+    """受信データを一時ファイルに書き込みながらハッシュとサイズを計算するファイル
+
+    werkzeug のフォームパーサーが write() で書き込み、seek(0) 後に読み出す。
+    commit() されないまま close() されると一時ファイルを削除する
+    """
+
+    def __init__(self, max_bytes=UPLOAD_MAX_BYTES, directory=INCOMING_FOLDER):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix="upload_", dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.committed_path = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"ファイルサイズが上限（{self.max_bytes} バイト）を超えています")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def commit(self, ext):
+        """ハッシュ値のパスに移動（同じ内容が保存済みなら一時ファイルを破棄）。保存先パスを返す"""
+        digest = self.hexdigest()
+        blob_dir = os.path.join(UPLOAD_FOLDER, digest[:2])
+        os.makedirs(blob_dir, exist_ok=True)
+        blob_path = os.path.join(blob_dir, digest + ext.lower())
+
+        self._file.close()
+        if os.path.exists(blob_path):
+            os.remove(self.temp_path)
+            print(f"同じ内容のファイルが保存済みのため再利用します: {blob_path}")
+        else:
+            os.replace(self.temp_path, blob_path)
+            print(f"ファイルを保存しました: {blob_path} ({self.size} バイト)")
+        self.committed_path = blob_path
+        return blob_path
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.committed_path is None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    # フォームパーサー・FileStorage から使われるファイル操作
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        return self._file.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __iter__(self):
+        return iter(self._file)
+
+class StreamingUploadRequest(Request):
+    """アップロードファイルをメモリに溜めず HashingUploadFile に直接書き込むリクエスト"""
+
+    max_content_length = REQUEST_MAX_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingUploadFile()
+        # 受信途中で中断した場合は request.files に登録されないため、ここで保持して close() で削除する
+        self.__dict__.setdefault("_upload_files", []).append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        for upload in self.__dict__.get("_upload_files", []):
+            upload.close()
+
+def store_upload(file, ext):
+    """受信済みのアップロードファイルをハッシュ値のパスに保存し、保存先パスを返す"""
+    stream = file.stream
+    if not isinstance(stream, HashingUploadFile):
+        # StreamingUploadRequest 以外から受け取った場合は、ここでハッシュを計算しながら書き出す
+        copy = HashingUploadFile()
+        try:
+            while True:
+                chunk = stream.read(64 * 1024)
+                if not chunk:
+                    break
+                copy.write(chunk)
+            return copy.commit(ext)
+        finally:
+            copy.close()
+    return stream.commit(ext)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ウィンドウ監視モジュール
+固定秒数のsleepの代わりに、短い間隔から徐々に間隔を広げるポーリングでダイアログの出現・状態を待つ
+ウィンドウの取得元（プロバイダー）は差し替え可能で、Linux上では FakeWindowProvider で動作確認できる
+"""
+
+import time
+
+# ポーリング設定（初回は短く、徐々に間隔を広げる）
+POLL_INITIAL_INTERVAL = 0.05
+POLL_MAX_INTERVAL = 0.5
+POLL_BACKOFF = 1.5
+
+# -------------------------------
+# ウィンドウプロバイダー
+# -------------------------------
+
+class PyGetWindowProvider:
+    """pygetwindow を使って実際のウィンドウを取得する（Windows用）"""
+
+    def __init__(self):
+        import pygetwindow
+        self._gw = pygetwindow
+
+    def get_all_titles(self):
+        return self._gw.getAllTitles()
+
+    def get_window(self, title):
+        windows = self._gw.getWindowsWithTitle(title)
+        return windows[0] if windows else None
+
+class FakeWindow:
+    """テスト用のウィンドウ（activate() 後、activate_delay 秒でアクティブになる）"""
+
+    def __init__(self, title, left=0, top=0, activate_delay=0.0, clock=time.monotonic):
+        self.title = title
+        self.left = left
+        self.top = top
+        self.activate_delay = activate_delay
+        self.activate_calls = 0
+        self._clock = clock
+        self._active_at = None
+
+    def activate(self):
+        self.activate_calls += 1
+        if self._active_at is None:
+            self._active_at = self._clock() + self.activate_delay
+
+    @property
+    def isActive(self):
+        return self._active_at is not None and self._clock() >= self._active_at
+
+class FakeWindowProvider:
+    """テスト用のプロバイダー（指定秒数後にウィンドウが出現する）"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._windows = []  # [(出現時刻, FakeWindow)]
+        self.title_queries = 0
+
+    def add_window(self, title, appear_after=0.0, **kwargs):
+        window = FakeWindow(title, clock=self._clock, **kwargs)
+        self._windows.append((self._clock() + appear_after, window))
+        return window
+
+    def remove_window(self, title):
+        self._windows = [(at, w) for at, w in self._windows if w.title != title]
+
+    def get_all_titles(self):
+        self.title_queries += 1
+        now = self._clock()
+        return [w.title for at, w in self._windows if at <= now]
+
+    def get_window(self, title):
+        now = self._clock()
+        for at, window in self._windows:
+            if at <= now and window.title == title:
+                return window
+        return None
+
+_default_provider = None
+
+def get_default_provider():
+    """既定のプロバイダー（pygetwindow）を取得"""
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = PyGetWindowProvider()
+    return _default_provider
+
+# -------------------------------
+# 待機処理
+# -------------------------------
+
+def poll_intervals(initial=POLL_INITIAL_INTERVAL, maximum=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF):
+    """ポーリング間隔を初回から最大値まで広げながら生成"""
+    interval = initial
+    while True:
+        yield interval
+        interval = min(maximum, interval * backoff)
+
+def wait_until(predicate, timeout, initial=POLL_INITIAL_INTERVAL, maximum=POLL_MAX_INTERVAL,
+               backoff=POLL_BACKOFF, sleep=time.sleep, clock=time.monotonic):
+    """predicate() が真値を返すまで待機し、その値を返す（タイムアウト時は None）"""
+    deadline = clock() + timeout
+    for interval in poll_intervals(initial, maximum, backoff):
+        result = predicate()
+        if result:
+            return result
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return None
+        sleep(min(interval, remaining))
+
+def find_window(keywords, provider=None):
+    """タイトルにキーワードを含むウィンドウを探す（見つからなければ (None, None)）"""
+    provider = provider or get_default_provider()
+    for title in provider.get_all_titles():
+        if any(keyword in title for keyword in keywords):
+            window = provider.get_window(title)
+            if window is not None:
+                return title, window
+    return None, None
+
+def wait_for_window(keywords, timeout, provider=None, **poll_options):
+    """キーワードを含むウィンドウが出現するまで待機（タイムアウト時は (None, None)）"""
+    provider = provider or get_default_provider()
+
+    def probe():
+        title, window = find_window(keywords, provider)
+        return (title, window) if window is not None else None
+
+    return wait_until(probe, timeout, **poll_options) or (None, None)
+
+def wait_for_active(window, timeout, reactivate_interval=0.5, **poll_options):
+    """ウィンドウがアクティブになるまで待機（一定間隔で activate() を再送）"""
+    clock = poll_options.get("clock", time.monotonic)
+    window.activate()
+    state = {"last_activate": clock()}
+
+    def is_active():
+        if window.isActive:
+            return True
+        if clock() - state["last_activate"] >= reactivate_interval:
+            window.activate()
+            state["last_activate"] = clock()
+        return False
+
+    return bool(wait_until(is_active, timeout, **poll_options))
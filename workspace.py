@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ジョブ作業ディレクトリ管理モジュール
+ジョブごとに衝突しない一時ディレクトリを割り当て、削除はバックグラウンドで行う
+"""
+
+import os
+import time
+import queue
+import shutil
+import tempfile
+import threading
+
+# 設定
+WORKSPACE_ROOT = "workspaces"
+STALE_WORKSPACE_SECONDS = 60 * 60  # 起動時スイープで回収する経過時間
+CLEANUP_RETRY_INTERVAL = 2         # 削除リトライ間隔（秒）
+CLEANUP_MAX_RETRIES = 30           # 削除リトライ上限
+
+_cleanup_queue = queue.Queue()
+_janitor_thread = None
+_janitor_lock = threading.Lock()
+
+# -------------------------------
+# 作業ディレクトリ作成
+# -------------------------------
+
+def create_job_workspace(request_id):
+    """ジョブ専用の作業ディレクトリを作成してパスを返す"""
+    if not os.path.exists(WORKSPACE_ROOT):
+        os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    # mkdtempがランダムな接尾辞を付与するため、同一秒・同一IDでも衝突しない
+    path = tempfile.mkdtemp(prefix=f"job_{request_id}_", dir=WORKSPACE_ROOT)
+    print(f"[workspace] 作業ディレクトリ作成: {path}")
+    return path
+
+# -------------------------------
+# バックグラウンド削除（ジャニター）
+# -------------------------------
+
+def _try_remove(path):
+    """パスを削除し、完了したかどうかを返す（使用中なら False）"""
+    if not os.path.exists(path):
+        return True
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except PermissionError:
+        return False
+    except OSError as e:
+        print(f"[workspace] 削除エラー: {path} ({e})")
+        return False
+
+def _janitor_loop():
+    """削除待ちのパスをリトライしながら削除し続ける"""
+    pending = []  # [path, 試行回数, 次回試行時刻]
+    while True:
+        timeout = None
+        if pending:
+            timeout = max(0.0, min(p[2] for p in pending) - time.time())
+        try:
+            path = _cleanup_queue.get(timeout=timeout)
+            pending.append([path, 0, time.time()])
+        except queue.Empty:
+            pass
+
+        now = time.time()
+        remaining = []
+        for entry in pending:
+            path, attempts, next_try = entry
+            if next_try > now:
+                remaining.append(entry)
+                continue
+            if _try_remove(path):
+                print(f"[workspace] 作業ディレクトリを削除: {path}")
+                _cleanup_queue.task_done()
+                continue
+            attempts += 1
+            if attempts >= CLEANUP_MAX_RETRIES:
+                print(f"⚠ [workspace] 削除を断念（起動時スイープで回収）: {path}")
+                _cleanup_queue.task_done()
+                continue
+            print(f"⚠ [workspace] 使用中のため削除保留: {path} (試行 {attempts}/{CLEANUP_MAX_RETRIES})")
+            remaining.append([path, attempts, now + CLEANUP_RETRY_INTERVAL])
+        pending = remaining
+
+def _ensure_janitor():
+    """ジャニタースレッドを必要時に起動"""
+    global _janitor_thread
+    with _janitor_lock:
+        if _janitor_thread is None or not _janitor_thread.is_alive():
+            _janitor_thread = threading.Thread(target=_janitor_loop, name="workspace-janitor", daemon=True)
+            _janitor_thread.start()
+
+def schedule_cleanup(path):
+    """作業ディレクトリの削除を予約（呼び出し元はブロックしない）"""
+    if not path:
+        return
+    _ensure_janitor()
+    _cleanup_queue.put(path)
+
+def wait_for_cleanup(timeout=None):
+    """予約済みの削除が終わるまで待機（プロセス終了前に使用）"""
+    if _janitor_thread is None:
+        return True
+    deadline = None if timeout is None else time.time() + timeout
+    while _cleanup_queue.unfinished_tasks:
+        if deadline is not None and time.time() >= deadline:
+            print(f"⚠ [workspace] 未削除の作業ディレクトリがあります: {_cleanup_queue.unfinished_tasks}件")
+            return False
+        time.sleep(0.1)
+    return True
+
+# -------------------------------
+# 起動時スイープ
+# -------------------------------
+
+def sweep_stale_workspaces(max_age_seconds=STALE_WORKSPACE_SECONDS):
+    """前回の実行で残った作業ディレクトリを回収
+
+    対象は WORKSPACE_ROOT の中だけ（カレントディレクトリの temp_fax_* などは、このモジュールが
+    作成したものか区別できないため触らない）
+    """
+    now = time.time()
+    candidates = []
+    if os.path.isdir(WORKSPACE_ROOT):
+        candidates.extend(os.path.join(WORKSPACE_ROOT, name) for name in os.listdir(WORKSPACE_ROOT))
+
+    reclaimed = 0
+    for path in candidates:
+        try:
+            age = now - os.path.getmtime(path)
+        except OSError:
+            continue
+        if age < max_age_seconds:
+            continue
+        if _try_remove(path):
+            reclaimed += 1
+        else:
+            schedule_cleanup(path)
+
+    if reclaimed:
+        print(f"[workspace] 起動時スイープ: {reclaimed}件の残存作業ファイルを回収")
+    return reclaimed
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本番用WSGIエントリーポイント
+
+  Windows : python wsgi.py
+            waitress（マルチスレッド・単一プロセス）で起動
+  Linux   : gunicorn -c gunicorn.conf.py wsgi:application
+            複数プロセス＋スレッドで起動（複数コアを使用、HUPシグナルでグレースフルリロード）
+
+ワーカー数・スレッド数は環境変数で調整する（gunicorn.conf.py も同じ値を参照）
+  FAX_API_HOST     待ち受けアドレス（既定: 0.0.0.0）
+  FAX_API_PORT     ポート番号（既定: 5000）
+  FAX_API_WORKERS  gunicornのワーカープロセス数（既定: CPUコア数）
+  FAX_API_THREADS  1プロセスあたりのスレッド数（既定: 8）
+"""
+
+import os
+
+from app import app, init_worker
+
+API_HOST = os.environ.get("FAX_API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("FAX_API_PORT", "5000"))
+API_THREADS = int(os.environ.get("FAX_API_THREADS", "8"))
+
+application = app
+
+def serve():
+    """waitress で起動（Windows 用。1プロセス内のスレッドで並行処理）"""
+    from waitress import serve as waitress_serve
+
+    init_worker()
+    print(f"FAX送信APIサーバー起動中（waitress, {API_HOST}:{API_PORT}, threads={API_THREADS}）")
+    print("FAX送信処理は別途 fax_worker.py を実行してください")
+    waitress_serve(application, host=API_HOST, port=API_PORT, threads=API_THREADS,
+                   connection_limit=max(100, API_THREADS * 16), channel_timeout=120)
+
+if __name__ == "__main__":
+    serve()